@@ -0,0 +1,186 @@
+"""
+A least recently used cache of data read by a driver, limited
+by the number of bytes held. Used so that data for an extent or
+range that has been read recently doesn't need to be read from
+the file again.
+"""
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function, division
+
+import collections
+
+DEFAULT_CACHE_SIZE = 0
+"Default maximum number of bytes held by a BlockCache - off unless asked for"
+
+def getLocationForExtent(extent):
+    """
+    Returns a hashable location to use in cache keys for
+    a basedriver.Extent.
+    """
+    return ('EXTENT', extent.xMin, extent.xMax, extent.yMin, extent.yMax,
+            extent.binSize)
+
+def getLocationForRange(pulseRange):
+    """
+    Returns a hashable location to use in cache keys for
+    a basedriver.PulseRange.
+    """
+    return ('RANGE', pulseRange.startPulse, pulseRange.endPulse)
+
+def getColumnsKey(colNames):
+    """
+    Returns a hashable version of the column names (which may be
+    a string, list or a view of the keys of a h5py group).
+    """
+    if isinstance(colNames, str):
+        return colNames
+    return tuple(colNames)
+
+def getNBytes(value):
+    """
+    Returns the approximate number of bytes used by value, which
+    may be a numpy array, an object with an nbytes attribute, a tuple
+    or list of these, or None.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (tuple, list)):
+        return sum([getNBytes(item) for item in value])
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return nbytes
+    # h5space.H5Space - count the selection array
+    boolArray = getattr(value, 'boolArray', None)
+    if boolArray is not None:
+        return boolArray.nbytes
+    indices = getattr(value, 'indices', None)
+    if indices is not None:
+        return indices.nbytes
+    return 0
+
+class BlockCache(object):
+    """
+    Least recently used cache of values (normally tuples of arrays).
+    When the total size of the values goes over maxBytes the
+    least recently used ones are dropped. A maxBytes of 0 disables
+    the cache.
+    """
+    def __init__(self, maxBytes=DEFAULT_CACHE_SIZE):
+        self.maxBytes = maxBytes
+        self.totalBytes = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the value stored for key, or None.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        # re-insert so it is the most recently used
+        self.entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value):
+        """
+        Store value for key, dropping least recently used values to
+        keep under maxBytes. Values bigger than maxBytes aren't stored.
+        """
+        self.remove(key)
+        if self.maxBytes == 0:
+            return
+        nbytes = getNBytes(value)
+        if nbytes > self.maxBytes:
+            return
+
+        while self.entries and self.totalBytes + nbytes > self.maxBytes:
+            oldKey, (oldValue, oldBytes) = self.entries.popitem(last=False)
+            self.totalBytes -= oldBytes
+
+        self.entries[key] = (value, nbytes)
+        self.totalBytes += nbytes
+
+    def putArray(self, key, value):
+        """
+        As put() but for values (tuples) whose first element is an array 
+        that is also handed out to the user. A copy of the array is stored
+        so any changes they make to it don't change what is cached.
+        """
+        if self.maxBytes == 0:
+            return
+        self.put(key, self.copyArray(value))
+
+    def remove(self, key):
+        """
+        Remove any value stored for key.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.totalBytes -= entry[1]
+
+    def clear(self):
+        """
+        Remove all the values.
+        """
+        self.entries.clear()
+        self.totalBytes = 0
+
+    def getArrayWithColumns(self, arrayType, location, colNames):
+        """
+        For caches where the keys are (arrayType, location, columnsKey)
+        and the first element of the value is a structured array
+        (stored with putArray()). Returns the value for the most recently 
+        used entry for arrayType and location with all of colNames, and a 
+        flag saying whether the columns match exactly. Returns (None, False) 
+        if there isn't one. The array in the returned value is a copy so 
+        the user can change it.
+        """
+        colsKey = getColumnsKey(colNames)
+        key = (arrayType, location, colsKey)
+        value = self.get(key)
+        if value is not None:
+            return self.copyArray(value), True
+
+        if isinstance(colNames, str):
+            requested = [colNames]
+        else:
+            requested = list(colNames)
+
+        for key in reversed(list(self.entries.keys())):
+            if key[0] != arrayType or key[1] != location:
+                continue
+            value = self.entries[key][0]
+            names = value[0].dtype.names
+            if names is None:
+                # only one column cached and it isn't this one
+                continue
+            found = True
+            for name in requested:
+                if name not in names:
+                    found = False
+                    break
+            if found:
+                return self.copyArray(self.get(key)), False
+
+        return None, False
+
+    @staticmethod
+    def copyArray(value):
+        """
+        Returns value with a copy of the array that is its first element
+        """
+        return (value[0].copy(),) + tuple(value[1:])
@@ -18,6 +18,18 @@ These are contained in the READSUPPORTEDOPTIONS module level variable.
 |                       | 'BEAM0011', 'BEAM0101', 'BEAM0110',        |
 |                       | 'BEAM1000', 'BEAM1011']                    |
 +-----------------------+--------------------------------------------+
+| CHUNK_CACHE_NBYTES    | Size in bytes of the HDF5 chunk cache for  |
+|                       | each dataset. Set to h5space.CHUNK_CACHE_   |
+|                       | AUTO to size it from the columns in the    |
+|                       | file and the block size. Defaults to the   |
+|                       | HDF5 default of 1MB.                       |
++-----------------------+--------------------------------------------+
+| CHUNK_CACHE_NSLOTS    | Number of slots in the hash table of the   |
+|                       | HDF5 chunk cache. Should be a prime.       |
++-----------------------+--------------------------------------------+
+| CHUNK_CACHE_W0        | Preemption policy (0-1) of the HDF5 chunk  |
+|                       | cache.                                     |
++-----------------------+--------------------------------------------+
 """
 
 # This file is part of PyLidar
@@ -43,8 +55,11 @@ import copy
 import numpy
 
 from . import generic
+from . import gridindexutils
+from . import h5space
 
-READSUPPORTEDOPTIONS = ('POINT_FROM', 'BEAM')
+READSUPPORTEDOPTIONS = ('POINT_FROM', 'BEAM', 'CHUNK_CACHE_NBYTES',
+        'CHUNK_CACHE_NSLOTS', 'CHUNK_CACHE_W0')
 "Supported read options"
 
 DEFAULT_POINT_FROM = ('longitude_lastbin', 'latitude_lastbin', 'elevation_lastbin')
@@ -70,9 +85,15 @@ class GEDIL1A01File(generic.LiDARFile):
                 msg = '%s not a supported GEDI L1A01 option' % repr(key)
                 raise generic.LiDARInvalidSetting(msg)
 
-        # attempt to open the file
+        self.beam = DEFAULT_BEAM
+        if 'BEAM' in userClass.lidarDriverOptions:
+            self.beam = userClass.lidarDriverOptions['BEAM']
+
+        # attempt to open the file. Only the beam is read so the chunk
+        # cache is sized from that.
         try:
-            self.fileHandle = h5py.File(fname, 'r')
+            self.fileHandle = h5space.openFileWithChunkCache(fname, 'r',
+                        userClass.lidarDriverOptions, controls, self.beam)
         except (OSError, IOError) as err:
             # always seems to throw an OSError
             # found another one!
@@ -89,9 +110,6 @@ class GEDIL1A01File(generic.LiDARFile):
         self.pointFrom = DEFAULT_POINT_FROM
         if 'POINT_FROM' in userClass.lidarDriverOptions:
             self.pointFrom = userClass.lidarDriverOptions['POINT_FROM']
-        self.beam = DEFAULT_BEAM
-        if 'BEAM' in userClass.lidarDriverOptions:
-            self.beam = userClass.lidarDriverOptions['BEAM']
         
         self.range = None
 
@@ -103,14 +121,21 @@ class GEDIL1A01File(generic.LiDARFile):
         self.fileHandle = None
         self.range = None
 
-    def readPointsByPulse(self, colNames=None):
+    def readPointsByPulse(self, colNames=None, ragged=False):
         """
         Return a 2d masked structured array of point that matches
         the pulses.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         # just read the points and add a dimensions
         # since there is one point per pulse
         points = self.readPointsForRange(colNames)
+        if ragged:
+            nPoints = points.shape[0]
+            return gridindexutils.RaggedArray(points, 
+                        numpy.arange(nPoints, dtype=numpy.uint32),
+                        numpy.ones(nPoints, dtype=numpy.uint32))
         points = numpy.expand_dims(points, 0)
 
         # make mask (can't just supply False as numpy gives an error)
@@ -248,7 +248,8 @@ class LiDARFile(basedriver.Driver):
         """
         raise NotImplementedError()
 
-    def readPulsesForExtentByBins(extent=None, colNames=None):
+    def readPulsesForExtentByBins(self, extent=None, colNames=None, 
+                ragged=False):
         """
         Read all the pulses within the given extent as a 3d structured 
         masked array to match the block/bins being used.
@@ -258,11 +259,14 @@ class LiDARFile(basedriver.Driver):
 
         colNames can be a name or list of column names to return. By default
         all columns are returned.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead
+            of the masked array.
         """
         raise NotImplementedError()
         
-    def readPointsForExtentByBins(extent=None, colNames=None, indexByPulse=False, 
-                returnPulseIndex=False):
+    def readPointsForExtentByBins(self, extent=None, colNames=None, 
+                indexByPulse=False, returnPulseIndex=False, ragged=False):
         """
         Read all the points within the given extent as a 3d structured 
         masked array to match the block/bins being used.
@@ -280,14 +284,18 @@ class LiDARFile(basedriver.Driver):
             the indices into the 1d pulse array (as returned by 
             readPulsesForExtent())
         
+        Pass ragged=True to return gridindexutils.RaggedArray instances
+            instead of the masked arrays.
         """
         raise NotImplementedError()
 
     @abc.abstractmethod        
-    def readPointsByPulse(self):     
+    def readPointsByPulse(self, colNames=None, ragged=False):     
         """
         Read a 2d structured masked array containing the points
         for each pulse.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         raise NotImplementedError()
 
@@ -321,7 +329,18 @@ class LiDARFile(basedriver.Driver):
         Returns True if file has a spatial index defined
         """
         raise NotImplementedError()
-        
+
+    def getPulseCountsForExtent(self, extent):
+        """
+        Return a 2d array of the number of pulses in each bin of the
+        spatial index that covers the given extent. Used to find blocks 
+        with no data before reading them.
+
+        Raise a LiDARFunctionUnsupported error if driver does not
+        have a spatial index that can be queried this way.
+        """
+        raise LiDARFunctionUnsupported()
+
     # see below for no spatial index
     @abc.abstractmethod
     def setPulseRange(self, pulseRange):
@@ -19,8 +19,10 @@ Common utility functions for dealing with grid spatial indices
 from __future__ import print_function, division
 
 import os
+import multiprocessing
 import numpy
 from . import h5space
+from .. import profiling
 
 DEBUG_MODE = os.getenv('PYLIDAR_DEBUG', '0')
 DEBUG_MODE = int(DEBUG_MODE) > 0
@@ -29,8 +31,19 @@ if DEBUG_MODE:
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
         return wrapper
+    parallelJit = jit
+    prange = range
 else:
     from numba import jit
+    from numba import prange
+    # as jit, but iterations of prange loops are run in parallel
+    parallelJit = jit(nopython=True, parallel=True, nogil=True)
+
+SORT_MAX_CHUNKS = multiprocessing.cpu_count()
+"""
+Maximum number of chunks sortByBin() splits the elements into to count
+and place them in parallel.
+"""
 
 @jit
 def unsortArray(inArray, sortIndices, outArray):
@@ -115,37 +128,74 @@ def flatten2dMaskedArray(flatArray, in2d, mask2d, idx2d):
                 flatArray[idx] = val
 
     
-@jit
-def BuildSpatialIndexInternal(binNum, sortedBinNumNdx, si_start, si_count):
+@parallelJit
+def countBinsByChunk(binNum, chunkCounts):
     """
-    Internal function used by CreateSpatialIndex.
-    
-    Fills in the spatial index from the sorted bins created by CreateSpatialIndex.
-    
-    binNum is row * nCols + col where row and col are arrays of the row and col of each element being spatially indexed.
-    sortedBinNumNdx is argsorted binNum    
-    si_start and si_count are output spatial indices
+    Internal function used by sortByBin.
+
+    Splits binNum into as many equal chunks as there are rows in 
+    chunkCounts and counts the elements of each chunk in each bin.
     """
-    nCols = si_start.shape[1]
-    nRows = si_start.shape[0]
+    nChunks = chunkCounts.shape[0]
     nThings = binNum.shape[0]
-    for i in range(nThings):
-        # get the bin of the sorted location of this element
-        bn = binNum[sortedBinNumNdx[i]]
-        # extract the row and column
-        row = bn // nCols
-        col = bn % nCols
-        # range check in case outside of the bouds of index 
-        # being created - not needed anymore as caller does this
-        #if row >= 0 and col >= 0 and row < nRows and col < nCols:    
-        if si_count[row, col] == 0:
-            # first element of a new bin - save the start 
-            # rest of elements in this bin should be next
-            # since it is sorted
-            si_start[row, col] = i
-        # update count of elements
-        si_count[row, col] += 1
-    
+    chunkSize = (nThings + nChunks - 1) // nChunks
+    for chunk in prange(nChunks):
+        start = chunk * chunkSize
+        end = min(start + chunkSize, nThings)
+        for i in range(start, end):
+            chunkCounts[chunk, binNum[i]] += 1
+
+@parallelJit
+def placeBinsByChunk(binNum, chunkOffsets, sortedBinNumNdx):
+    """
+    Internal function used by sortByBin.
+
+    chunkOffsets is where the first element of each chunk (as for 
+    countBinsByChunk) in each bin goes in sortedBinNumNdx. Fills in
+    sortedBinNumNdx with the index of each element in binNum.
+    """
+    nChunks = chunkOffsets.shape[0]
+    nThings = binNum.shape[0]
+    chunkSize = (nThings + nChunks - 1) // nChunks
+    for chunk in prange(nChunks):
+        start = chunk * chunkSize
+        end = min(start + chunkSize, nThings)
+        for i in range(start, end):
+            bn = binNum[i]
+            sortedBinNumNdx[chunkOffsets[chunk, bn]] = i
+            chunkOffsets[chunk, bn] += 1
+
+def sortByBin(binNum, nBins):
+    """
+    Counting sort of elements by bin. Takes O(n + nBins) rather than 
+    the O(n log n) of argsort, and elements in the same bin stay in 
+    the order they were.
+
+    binNum is a 1d array of the bin (0 to nBins - 1) of each element.
+
+    Returns:
+
+    * an array of indices that sorts binNum (as argsort(binNum))
+    * a 1d array of the number of elements in each bin
+    """
+    nThings = binNum.shape[0]
+    # each chunk needs counts for all the bins, so only split into as 
+    # many as there are elements for
+    nChunks = max(1, min(SORT_MAX_CHUNKS, nThings // max(nBins, 1)))
+
+    chunkCounts = numpy.zeros((nChunks, nBins), dtype=numpy.int64)
+    countBinsByChunk(binNum, chunkCounts)
+
+    counts = chunkCounts.sum(axis=0)
+    binStarts = numpy.cumsum(counts) - counts
+    # where each chunk starts within each bin
+    chunkOffsets = (numpy.cumsum(chunkCounts, axis=0) - chunkCounts + 
+                        binStarts)
+
+    sortedBinNumNdx = numpy.empty((nThings,), dtype=numpy.int64)
+    placeBinsByChunk(binNum, chunkOffsets, sortedBinNumNdx)
+    return sortedBinNumNdx, counts
+
 @jit
 def convertIdxBool2D(start_idx_array, count_array, outBool, boolStart, outRow, outCol, 
                         outIdx, counts, outMask):
@@ -288,6 +338,7 @@ def convertIdxBool1D(start_idx_array, count_array, outBool, boolStart, outRow, o
             # update the current element number
             counter += 1
     
+@profiling.timed(profiling.INDEX)
 def CreateSpatialIndex(coordOne, coordTwo, binSize, coordOneMax, 
                 coordTwoMin, nRows, nCols, indexDtype, countDtype):
     """
@@ -338,28 +389,26 @@ def CreateSpatialIndex(coordOne, coordTwo, binSize, coordOneMax,
     # work out the elements that aren't within the new spatial 
     # index and remove them
     validMask = (row >= 0) & (col >= 0) & (row < nRows) & (col < nCols)
-    row = row[validMask].astype(numpy.uint32)
-    col = col[validMask].astype(numpy.uint32)
-    coordOne = coordOne[validMask]
-    coordTwo = coordTwo[validMask]
+    row = row[validMask].astype(numpy.int64)
+    col = col[validMask].astype(numpy.int64)
         
     # convert this to a 'binNum' which is a combination of row and col
     # and can be sorted to make a complete ordering of the 2-d grid of bins
     binNum = row * nCols + col
     # get an array of indices of the sorted version of the bins
-    sortedBinNumNdx = numpy.argsort(binNum)
+    sortedBinNumNdx, counts = sortByBin(binNum, nRows * nCols)
     
-    # output spatial index arrays
-    si_start = numpy.zeros((nRows, nCols), dtype=indexDtype)
-    si_count = numpy.zeros((nRows, nCols), dtype=countDtype)
-        
-    # call our helper function to put the elements into the spatial index
-    BuildSpatialIndexInternal(binNum, sortedBinNumNdx, si_start, si_count)
+    # output spatial index arrays. Empty bins have a start of 0.
+    si_count = counts.reshape((nRows, nCols)).astype(countDtype)
+    si_start = numpy.cumsum(counts) - counts
+    si_start[counts == 0] = 0
+    si_start = si_start.reshape((nRows, nCols)).astype(indexDtype)
         
     # return array to get back to sorted version of the elements
     # and the new spatial index
     return validMask, sortedBinNumNdx, si_start, si_count
 
+@profiling.timed(profiling.INDEX)
 def convertSPDIdxToReadIdxAndMaskInfo(start_idx_array, count_array, outSize=None):
     """
     Convert either a 2d SPD spatial index or 1d index (pulse to points, 
@@ -432,12 +481,263 @@ def convertSPDIdxToReadIdxAndMaskInfo(start_idx_array, count_array, outSize=None
         
     if outSize is not None:
         space = h5space.H5Space(outSize, outBool, boolStart)
-        
+
         # return the arrays
         return space, outIdx, outMask
     else:
         return outIdx, outMask
 
+@jit
+def fillRaggedBinIndex2D(start, count, outRow, outCol):
+    """
+    Internal function called by RaggedArray.getBinIndex().
+
+    Fills outRow and outCol (same length as the data of the ragged array)
+    with the row and column of the bin each element belongs to.
+    """
+    nRows = start.shape[0]
+    nCols = start.shape[1]
+    for row in range(nRows):
+        for col in range(nCols):
+            s = start[row, col]
+            for i in range(count[row, col]):
+                # cast back in case the add was promoted to a double
+                idx = int(s + i)
+                outRow[idx] = row
+                outCol[idx] = col
+
+@jit
+def fillRaggedBinIndex1D(start, count, outRow):
+    """
+    Internal function called by RaggedArray.getBinIndex().
+
+    Fills outRow (same length as the data of the ragged array)
+    with the index of the bin each element belongs to.
+    """
+    nRows = start.shape[0]
+    for row in range(nRows):
+        s = start[row]
+        for i in range(count[row]):
+            # cast back in case the add was promoted to a double
+            idx = int(s + i)
+            outRow[idx] = row
+
+class RaggedArray(object):
+    """
+    An alternative to the 3d (or 2d) masked arrays returned by
+    getPointsByBins(), getPulsesByBins() and getPointsByPulse() that
+    doesn't pad every bin out to the size of the largest one.
+
+    * data is the 1d (structured) array of elements. The elements
+      of each bin are stored next to each other.
+    * start is a 2d (bins) or 1d (pulses) array of the index into data of
+      the first element of each bin.
+    * count is the same shape as start and contains the number of
+      elements in each bin.
+
+    The elements for a bin are data[start[row, col]:start[row, col] +
+    count[row, col]] which is what getBin() returns (a view, not a copy).
+    Indexing with a column name (or list of names) returns a new
+    RaggedArray of just those columns that shares start and count.
+
+    Since data, start and count are plain numpy arrays they can be
+    passed straight to a numba function that loops over the bins.
+    """
+    def __init__(self, data, start, count):
+        self.data = data
+        self.start = start
+        self.count = count
+
+    @property
+    def shape(self):
+        "Shape of the grid of bins"
+        return self.count.shape
+
+    @property
+    def dtype(self):
+        "dtype of the data"
+        return self.data.dtype
+
+    @property
+    def nbytes(self):
+        "Total size of the arrays in bytes"
+        return self.data.nbytes + self.start.nbytes + self.count.nbytes
+
+    def __getitem__(self, colNames):
+        return RaggedArray(self.data[colNames], self.start, self.count)
+
+    def copy(self):
+        "Returns a copy of the data (start and count are shared)"
+        return RaggedArray(self.data.copy(), self.start, self.count)
+
+    def getBin(self, row, col=None):
+        """
+        Returns a view of data containing the elements of the given bin.
+        Don't pass col for a 1d array of bins (e.g. points by pulse).
+        """
+        if col is None:
+            s = self.start[row]
+            c = self.count[row]
+        else:
+            s = self.start[row, col]
+            c = self.count[row, col]
+        return self.data[s:s + c]
+
+    def getMaxCount(self):
+        "Returns the number of elements in the largest bin"
+        if self.count.size == 0:
+            return 0
+        return int(self.count.max())
+
+    def getBinIndex(self):
+        """
+        Returns arrays the same length as data with the bin that each
+        element is in. For a 2d grid of bins returns a tuple of (row, col)
+        arrays, otherwise a single array.
+        """
+        nElements = self.data.shape[0]
+        if self.count.ndim == 2:
+            outRow = numpy.zeros(nElements, dtype=numpy.uint32)
+            outCol = numpy.zeros(nElements, dtype=numpy.uint32)
+            fillRaggedBinIndex2D(self.start, self.count, outRow, outCol)
+            return outRow, outCol
+        else:
+            outRow = numpy.zeros(nElements, dtype=numpy.uint32)
+            fillRaggedBinIndex1D(self.start, self.count, outRow)
+            return outRow
+
+    def toMasked(self):
+        """
+        Returns the same data as a masked array shaped
+        (maxCount,) + shape, as getPointsByBins() etc return by default.
+        """
+        maxCount = self.getMaxCount()
+        levels = numpy.arange(maxCount).reshape((maxCount,) +
+                        (1,) * self.count.ndim)
+        mask = levels >= self.count
+        idx = numpy.where(mask, 0, self.start.astype(numpy.int64) + levels)
+        if self.data.size == 0:
+            # nothing to index - all elements masked anyway
+            data = numpy.empty(mask.shape, dtype=self.data.dtype)
+        else:
+            data = self.data[idx]
+        return numpy.ma.array(data, mask=mask)
+
+def convertSPDIdxToRaggedIdx(start_idx_array, count_array):
+    """
+    Given the start indices and counts from a SPD spatial index or a
+    pulse to points index (as passed to convertSPDIdxToReadIdxAndMaskInfo),
+    return the start of each bin (or pulse) within the subset of the data
+    that the index covers, for use with RaggedArray.
+
+    Assumes the ranges of the bins don't overlap.
+    """
+    outStart = numpy.zeros(count_array.shape, dtype=numpy.uint64)
+    valid = count_array > 0
+    starts = start_idx_array[valid]
+    counts = count_array[valid].astype(numpy.uint64)
+    # the bins are read in the order they occur in the file
+    order = numpy.argsort(starts, kind='mergesort')
+    sortedCounts = counts[order]
+    subsetStarts = numpy.empty_like(sortedCounts)
+    subsetStarts[order] = numpy.cumsum(sortedCounts) - sortedCounts
+    outStart[valid] = subsetStarts
+    return outStart
+
+def convertSPDIdxToReadSpace(start_idx_array, count_array, outSize):
+    """
+    As convertSPDIdxToReadIdxAndMaskInfo() but only returns the 
+    h5space.H5Space for reading the data, without creating the index and
+    mask for the masked array (which are padded to the largest count).
+    Use SPDIdxInfo to create these when they are needed.
+    """
+    if count_array.size > 0:
+        starts = start_idx_array.ravel().astype(numpy.int64)
+        counts = count_array.ravel().astype(numpy.int64)
+        boolStart = int(starts.min())
+        boolSize = int((starts + counts).max()) - boolStart
+        starts -= boolStart
+        # +1 where each range starts, -1 after it ends. Ranges don't 
+        # overlap so the running total is 1 inside one and 0 elsewhere.
+        edges = (numpy.bincount(starts, minlength=boolSize + 1) - 
+                    numpy.bincount(starts + counts, minlength=boolSize + 1))
+        outBool = numpy.cumsum(edges[:boolSize]) > 0
+    else:
+        boolStart = 0
+        outBool = numpy.zeros((0,), dtype=numpy.bool)
+
+    return h5space.H5Space(outSize, outBool, boolStart)
+
+def getTrailingBinsSpace(idxInfo, overlap, outSize):
+    """
+    Given the SPDIdxInfo for a block read with the given overlap, returns
+    a h5space.H5Space that selects just the elements in the last 
+    overlap * 2 columns and rows of bins. These are the bins that are also
+    read for the blocks to the right and below.
+    """
+    band = overlap * 2
+    trailing = numpy.zeros(idxInfo.count_array.shape, dtype=numpy.bool)
+    trailing[-band:] = True
+    trailing[:, -band:] = True
+    return convertSPDIdxToReadSpace(idxInfo.start_idx_array[trailing],
+                idxInfo.count_array[trailing], outSize)
+
+def getSubsetSpace(space, subSpace, idxInfo, outSize):
+    """
+    space is a h5space.H5Space and idxInfo a SPDIdxInfo with one start and
+    count for each element space selects (eg the points of each pulse).
+    Given subSpace which selects some of the same elements as space, returns
+    a h5space.H5Space selecting the elements idxInfo refers to for just 
+    those.
+    """
+    pos = numpy.searchsorted(space.getSelectedIndices(), 
+                subSpace.getSelectedIndices())
+    return convertSPDIdxToReadSpace(idxInfo.start_idx_array[pos],
+                idxInfo.count_array[pos], outSize)
+
+class SPDIdxInfo(object):
+    """
+    Keeps the start indices and counts (as passed to 
+    convertSPDIdxToReadIdxAndMaskInfo()) for data that has been read with 
+    the space from convertSPDIdxToReadSpace(). The index and mask for a 
+    masked array, or the start for a RaggedArray, are only created when 
+    first asked for.
+    """
+    def __init__(self, start_idx_array, count_array):
+        self.start_idx_array = start_idx_array
+        self.count_array = count_array
+        self.idx = None
+        self.mask = None
+        self.raggedStart = None
+
+    @property
+    def nbytes(self):
+        "Total size of the arrays in bytes"
+        nbytes = self.start_idx_array.nbytes + self.count_array.nbytes
+        for array in (self.idx, self.mask, self.raggedStart):
+            if array is not None:
+                nbytes += array.nbytes
+        return nbytes
+
+    def getIdxAndMask(self):
+        """
+        Returns the index and mask as returned by 
+        convertSPDIdxToReadIdxAndMaskInfo()
+        """
+        if self.idx is None:
+            self.idx, self.mask = convertSPDIdxToReadIdxAndMaskInfo(
+                            self.start_idx_array, self.count_array)
+        return self.idx, self.mask
+
+    def getRaggedStartAndCount(self):
+        """
+        Returns the start and count for a RaggedArray of the data
+        """
+        if self.raggedStart is None:
+            self.raggedStart = convertSPDIdxToRaggedIdx(self.start_idx_array,
+                            self.count_array)
+        return self.raggedStart, self.count_array
+
 def getSlicesForExtent(siPixGrid, siShape, overlap, xMin, xMax, yMin, yMax):
     """
     xMin, xMax, yMin, yMax is the extent snapped to the pixGrid.
@@ -560,3 +860,78 @@ def snapToGrid(val, valOnGrid, res, method):
 
     snappedVal = valOnGrid + numWholePix * res
     return snappedVal
+
+BLOCKORDER_ROWMAJOR = 0
+"Constant for use with getBlockOrder. Across each row, then down"
+BLOCKORDER_MORTON = 1
+"Constant for use with getBlockOrder. Morton (Z order) curve"
+BLOCKORDER_HILBERT = 2
+"Constant for use with getBlockOrder. Hilbert curve"
+
+def getMortonCodes(cols, rows):
+    """
+    Returns an array of the position of each of the given blocks
+    (column and row numbers, starting at 0) along a Morton (Z order) curve.
+    """
+    cols = numpy.asarray(cols, dtype=numpy.int64)
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    codes = numpy.zeros(cols.shape, dtype=numpy.int64)
+    maxVal = max(int(cols.max()), int(rows.max())) if cols.size > 0 else 0
+    bit = 0
+    while (1 << bit) <= maxVal:
+        codes |= ((cols >> bit) & 1) << (2 * bit)
+        codes |= ((rows >> bit) & 1) << (2 * bit + 1)
+        bit += 1
+    return codes
+
+def getHilbertCodes(cols, rows):
+    """
+    Returns an array of the position of each of the given blocks
+    (column and row numbers, starting at 0) along a Hilbert curve
+    that covers them all. Blocks that are next to each other in this
+    order are usually close together, but not always neighbours as the
+    curve covers a square padded out to a power of 2 and any blocks 
+    not given are skipped.
+    """
+    x = numpy.array(cols, dtype=numpy.int64)
+    y = numpy.array(rows, dtype=numpy.int64)
+    codes = numpy.zeros(x.shape, dtype=numpy.int64)
+    maxVal = max(int(x.max()), int(y.max())) if x.size > 0 else 0
+    # side of the square the curve covers - must be a power of 2
+    n = 1
+    while n <= maxVal:
+        n *= 2
+
+    s = n // 2
+    while s > 0:
+        rx = ((x & s) > 0).astype(numpy.int64)
+        ry = ((y & s) > 0).astype(numpy.int64)
+        codes += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve joins up
+        flip = (ry == 0) & (rx == 1)
+        x = numpy.where(flip, n - 1 - x, x)
+        y = numpy.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = numpy.where(swap, y, x), numpy.where(swap, x, y)
+        s //= 2
+    return codes
+
+def getBlockOrder(cols, rows, blockOrder):
+    """
+    Returns an array of indices into cols and rows (the column and row 
+    numbers of a set of blocks) giving the order to visit the blocks in. 
+    blockOrder is one of the BLOCKORDER_* constants.
+    """
+    cols = numpy.asarray(cols)
+    rows = numpy.asarray(rows)
+    if blockOrder == BLOCKORDER_ROWMAJOR:
+        # lexsort sorts on the last key first
+        return numpy.lexsort((cols, rows))
+    elif blockOrder == BLOCKORDER_MORTON:
+        codes = getMortonCodes(cols, rows)
+    elif blockOrder == BLOCKORDER_HILBERT:
+        codes = getHilbertCodes(cols, rows)
+    else:
+        msg = 'Unknown block order %d' % blockOrder
+        raise ValueError(msg)
+    return numpy.argsort(codes, kind='mergesort')
@@ -20,11 +20,21 @@ specifically the ability to quickly deal with multiple ranges.
 from __future__ import print_function, division
 
 import sys
+import zlib
 import numpy
 import h5py
 from numba import jit
 import ctypes
+from concurrent.futures import ThreadPoolExecutor
 from rios.parallel.jobmanager import find_executable
+from . import generic
+
+# hdf5plugin registers the Blosc/Zstd etc filters with HDF5 when imported
+# and knows how to pass their parameters. Optional.
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
 
 # Need to give ourselves access to H5Sselect_hyperslab()
 # within the HDF5 library so we can call it from numba
@@ -145,6 +155,41 @@ def createSpaceFromRange(start, end, size):
     space = H5Space(size, boolArray, start)
     return space
 
+READ_MIN_RUNS = 64
+"""
+Selections made from a boolArray with fewer contiguous runs than this
+are always read as they are. Otherwise H5Space.read() uses the 
+READ_*_COST values to choose how to read them.
+"""
+READ_COALESCE_GAP = 1024
+"""
+When reading, runs of selected elements separated by no more than this
+many unselected elements may be read as one range and the unselected 
+elements thrown away.
+"""
+READ_RUN_COST = 1.0
+"Relative cost of each hyperslab in a selection when reading"
+READ_POINT_COST = 0.1
+"Relative cost of each element in a point selection when reading"
+READ_BYTE_COST = 0.0005
+"Relative cost of each byte read"
+
+DIRECT_CHUNK_BATCH_SIZE = 256 * 1024
+"""
+Minimum number of elements decompressed by each task of a 
+DirectChunkReader. Chunks are given to the threads in batches so the cost
+of handing them over doesn't outweigh the decompression of small chunks.
+"""
+
+READ_HYPERSLAB = 0
+"ways of reading a selection. See H5Space.getReadStrategy()"
+READ_COALESCED = 1
+"ways of reading a selection. See H5Space.getReadStrategy()"
+READ_FULL_RANGE = 2
+"ways of reading a selection. See H5Space.getReadStrategy()"
+READ_POINTS = 3
+"ways of reading a selection. See H5Space.getReadStrategy()"
+
 class H5Space(object):
     """
     Object that wraps a h5py.h5s.SpaceID object and allows 
@@ -164,31 +209,34 @@ class H5Space(object):
 
         Pass either boolArray and boolStart or indices but not all 3.
         """
-        # create the space object
-        self.space = h5py.h5s.create_simple((size,), (size,))
-        # default is all selected - reset to none in case boolArray all False
-        self.space.select_none()
+        self.size = size
+        # h5py.h5s.SpaceID object. For boolArray this is created when 
+        # first needed as a fragmented boolArray creates a lot of 
+        # hyperslabs and read() might not need it.
+        self._space = None
+        # for read() which is called once per column. The starts and ends 
+        # of the runs of True in boolArray, and a dictionary keyed on the
+        # item size of the strategy, space and bool array from 
+        # getReadInfo().
+        self._runs = None
+        self._readInfo = {}
+        # for DirectChunkReader - see getChunkInfo()
+        self._chunkInfo = {}
 
         if boolArray is not None and boolStart is not None:
-            # convert the bool array into it
-            start = numpy.empty(1, dtype=numpy.uint64)
-            count = numpy.empty(1, dtype=numpy.uint64)
-            if boolArray.size > 0:
-                convertBoolToHDF5Space(boolArray, boolStart, self.space.id, 
-                    start, count, H5Sselect_hyperslab, h5py.h5s.SELECT_SET, 
-                    h5py.h5s.SELECT_OR)
-        
             # grab these for updateBoolArray()    
             self.boolArray = boolArray
             self.boolStart = boolStart
             self.indices = None
 
         elif indices is not None:
+            self._space = h5py.h5s.create_simple((size,), (size,))
+            self._space.select_none()
             if len(indices) > 0:
                 # this step is necessary otherwise you get the error:
                 # Coordinate array must have shape (<npoints>, 1)
                 indices = numpy.expand_dims(indices, axis=1)
-                self.space.select_elements(indices)
+                self._space.select_elements(indices)
             self.indices = indices
             self.boolArray = None
             self.boolStart = None
@@ -197,13 +245,142 @@ class H5Space(object):
             msg = 'Need to specify either boolArray and boolStart or indices'
             raise ValueError(msg)
 
+    @property
+    def space(self):
+        """
+        The h5py.h5s.SpaceID object for the selection
+        """
+        if self._space is None:
+            self._space = self.createSpaceFromBool(self.boolArray)
+        return self._space
+
+    def createSpaceFromBool(self, boolArray):
+        """
+        Creates a h5py.h5s.SpaceID object with the elements that are True
+        in boolArray (which starts at self.boolStart) selected.
+        """
+        space = h5py.h5s.create_simple((self.size,), (self.size,))
+        # default is all selected - reset to none in case boolArray all False
+        space.select_none()
+        if boolArray.size > 0:
+            # convert the bool array into it
+            start = numpy.empty(1, dtype=numpy.uint64)
+            count = numpy.empty(1, dtype=numpy.uint64)
+            convertBoolToHDF5Space(boolArray, self.boolStart, space.id, 
+                start, count, H5Sselect_hyperslab, h5py.h5s.SELECT_SET, 
+                h5py.h5s.SELECT_OR)
+        return space
+
+    def getReadStrategy(self, itemsize):
+        """
+        Works out the cheapest way of reading the selection, for elements 
+        of the given size in bytes. Returns a tuple of one of the READ_* 
+        values and, for READ_COALESCED and READ_FULL_RANGE, a bool array
+        (starting at self.boolStart) of the elements to read.
+
+        The hyperslabs in a selection are slow for HDF5 to deal with. 
+        Rather than selecting each run of elements in boolArray it can 
+        be quicker to select a range that includes several runs 
+        (READ_COALESCED, see READ_COALESCE_GAP) or all of them 
+        (READ_FULL_RANGE) and throw away the extra elements. Or to select
+        the elements one by one (READ_POINTS). The READ_*_COST values are 
+        used to choose.
+        """
+        if self.boolArray is None or self._space is not None:
+            # indices, or already done the work of creating the space
+            return READ_HYPERSLAB, None
+
+        runStarts, runEnds = self.getRuns()
+        if runStarts.size < READ_MIN_RUNS:
+            return READ_HYPERSLAB, None
+        nSelected = int((runEnds - runStarts).sum())
+        byteCost = READ_BYTE_COST * itemsize
+
+        # join the runs with small gaps between them
+        joined = (runStarts[1:] - runEnds[:-1]) <= READ_COALESCE_GAP
+        coalescedStarts = runStarts[numpy.append(True, ~joined)]
+        coalescedEnds = runEnds[numpy.append(~joined, True)]
+        nCoalesced = int((coalescedEnds - coalescedStarts).sum())
+        nFull = int(runEnds[-1] - runStarts[0])
+
+        costs = [(runStarts.size * READ_RUN_COST + nSelected * byteCost,
+                        READ_HYPERSLAB),
+                (coalescedStarts.size * READ_RUN_COST + nCoalesced * byteCost,
+                        READ_COALESCED),
+                (READ_RUN_COST + nFull * byteCost, READ_FULL_RANGE),
+                (nSelected * (READ_POINT_COST + byteCost), READ_POINTS)]
+        cost, strategy = min(costs)
+
+        readBool = None
+        if strategy == READ_COALESCED:
+            # +1 at the start of each range, -1 at the end
+            markers = numpy.zeros(self.boolArray.size + 1, dtype=numpy.int8)
+            markers[coalescedStarts] = 1
+            markers[coalescedEnds] -= 1
+            readBool = numpy.cumsum(markers[:-1]) > 0
+        elif strategy == READ_FULL_RANGE:
+            readBool = numpy.zeros(self.boolArray.size, dtype=bool)
+            readBool[runStarts[0]:runEnds[-1]] = True
+
+        return strategy, readBool
+
+    def getRuns(self):
+        """
+        Returns arrays of the start and end (exclusive) of each run of True
+        values in boolArray. Only worked out once.
+        """
+        if self._runs is None:
+            changes = numpy.diff(self.boolArray.astype(numpy.int8), 
+                        prepend=0, append=0)
+            self._runs = (numpy.nonzero(changes == 1)[0], 
+                        numpy.nonzero(changes == -1)[0])
+        return self._runs
+
+    def getReadInfo(self, itemsize):
+        """
+        Returns a tuple of the strategy from getReadStrategy(), the 
+        h5py.h5s.SpaceID to read with and, for READ_COALESCED and 
+        READ_FULL_RANGE, a bool array of which of the elements read are 
+        selected. These are only worked out once for each itemsize as 
+        read() is normally called for each column.
+        """
+        info = self._readInfo.get(itemsize)
+        if info is None:
+            strategy, readBool = self.getReadStrategy(itemsize)
+            keep = None
+            if strategy == READ_HYPERSLAB:
+                space = self.space
+            elif strategy == READ_POINTS:
+                space = h5py.h5s.create_simple((self.size,), (self.size,))
+                indices = self.getSelectedIndices()
+                space.select_elements(numpy.expand_dims(indices, axis=1))
+            else:
+                space = self.createSpaceFromBool(readBool)
+                keep = self.boolArray[readBool]
+            info = (strategy, space, keep)
+            self._readInfo[itemsize] = info
+        return info
+
     def read(self, dataSet):
         """
         Given a h5py dataset read the data ranges selected and return a
         numpy array.
         """
+        strategy, space, keep = self.getReadInfo(dataSet.dtype.itemsize)
+        data = self.readSpace(dataSet, space)
+        if keep is not None:
+            # read more than needed, throw away what isn't selected
+            data = data[keep]
+        return data
+
+    @staticmethod
+    def readSpace(dataSet, space):
+        """
+        Reads the elements selected in space (a h5py.h5s.SpaceID object)
+        from the dataset
+        """
         # create an empty array of the right size
-        npoints = self.space.get_select_npoints()
+        npoints = space.get_select_npoints()
         data = numpy.empty(npoints, dtype=dataSet.dtype)
 
         if npoints > 0:        
@@ -211,7 +388,7 @@ class H5Space(object):
             mspace = h5py.h5s.create_simple(data.shape, data.shape)
         
             # read it
-            dataSet.id.read(mspace, self.space, data)
+            dataSet.id.read(mspace, space, data)
         return data
         
     def write(self, dataSet, data):
@@ -233,6 +410,11 @@ class H5Space(object):
         """
         #if mask.size != self.space.get_select_npoints():
         #    raise ValueError('mask is wrong size')
+
+        # the selection is changing
+        self._runs = None
+        self._readInfo = {}
+        self._chunkInfo = {}
             
         if self.boolStart is not None and self.boolArray is not None:
             start = numpy.empty(1, dtype=numpy.uint64)
@@ -245,10 +427,33 @@ class H5Space(object):
             self.space.select_none()
             self.space.select_elements(self.indices)
 
+    def getChunkInfo(self, chunkLen):
+        """
+        For reading the selection a chunk at a time, for a 1d dataset 
+        with chunks of chunkLen elements. Returns an array of the ids 
+        (index // chunkLen) of the chunks the selection touches, in order,
+        and an array of the index of each selected element into these 
+        chunks one after the other. Only worked out once for each chunkLen.
+        """
+        info = self._chunkInfo.get(chunkLen)
+        if info is None:
+            indices = numpy.reshape(self.getSelectedIndices(), -1).astype(
+                        numpy.uint64)
+            chunkIds = indices // numpy.uint64(chunkLen)
+            uniqueChunkIds = numpy.unique(chunkIds)
+            chunkIdx = numpy.searchsorted(uniqueChunkIds, chunkIds)
+            gatherIdx = (chunkIdx.astype(numpy.uint64) * numpy.uint64(chunkLen)
+                        + (indices % numpy.uint64(chunkLen)))
+            info = (uniqueChunkIds, gatherIdx)
+            self._chunkInfo[chunkLen] = info
+        return info
+
     def getSelectionSize(self):
         """
         Return the number of elements that are cuurently selected
         """
+        if self._space is None:
+            return int(numpy.count_nonzero(self.boolArray))
         return self.space.get_select_npoints()
         
     def getSelectedIndices(self):
@@ -265,3 +470,454 @@ class H5Space(object):
                             dtype=numpy.uint64)
 
             return indices[self.boolArray]
+
+def createSpacesFromIndices(indices, size, maxGap=READ_COALESCE_GAP):
+    """
+    Given a sorted array of the indices of the elements to read from a 
+    dataset of the given size, returns a list of H5Space objects that
+    select them between them, in order. The indices are split where there
+    are gaps of more than maxGap elements, so the bool array of each 
+    H5Space only covers a group of indices that are close together rather
+    than everything from the first to the last.
+    """
+    if indices.size == 0:
+        return [H5Space(size, numpy.zeros((0,), dtype=numpy.bool), 0)]
+
+    indices = indices.astype(numpy.int64)
+    splits = numpy.nonzero(numpy.diff(indices) > maxGap)[0] + 1
+    spaces = []
+    for group in numpy.split(indices, splits):
+        boolStart = int(group[0])
+        boolArray = numpy.zeros((int(group[-1]) - boolStart + 1,), 
+                        dtype=numpy.bool)
+        boolArray[group - boolStart] = True
+        spaces.append(H5Space(size, boolArray, boolStart))
+    return spaces
+
+def getReuseInfo(space, lastSpace):
+    """
+    Given a H5Space about to be read and the H5Space that was used to
+    read some data previously (for example for the neighbouring block
+    when there is an overlap) works out which of the elements selected 
+    by space have already been read.
+
+    Returns None if none of them have. Otherwise returns a tuple with:
+
+    * A H5Space that selects just the elements that haven't been read
+    * A bool array (one element per element selected by space) that is
+      True for the elements read with this new H5Space
+    * An array of the indices into the previously read data of the
+      other elements
+
+    These can be passed to combineReusedData(). Only works when both
+    spaces were created with a boolArray.
+    """
+    if (lastSpace is None or space.boolArray is None or 
+            lastSpace.boolArray is None):
+        return None
+
+    start = int(space.boolStart)
+    lastStart = int(lastSpace.boolStart)
+    # don't bother going further if the ranges don't overlap
+    if (start >= lastStart + lastSpace.boolArray.size or 
+            lastStart >= start + space.boolArray.size):
+        return None
+
+    # both are in file order
+    selected = numpy.nonzero(space.boolArray)[0]
+    indices = selected + start
+    lastIndices = numpy.nonzero(lastSpace.boolArray)[0] + lastStart
+    if lastIndices.size == 0:
+        return None
+    lastIdx = numpy.searchsorted(lastIndices, indices)
+    lastIdx[lastIdx >= lastIndices.size] = 0
+    reused = lastIndices[lastIdx] == indices
+    if not reused.any():
+        return None
+
+    newBool = space.boolArray.copy()
+    newBool[selected[reused]] = False
+    newSpace = H5Space(space.size, newBool, space.boolStart)
+    return newSpace, ~reused, lastIdx[reused]
+
+def combineReusedData(newData, lastData, newMask, lastIdx):
+    """
+    Given the data read with the H5Space returned by getReuseInfo() and
+    the data previously read (which must have the same columns in the same
+    order) returns the data for all the elements of the original H5Space.
+    newMask and lastIdx are as returned by getReuseInfo().
+    """
+    data = numpy.empty(newMask.shape, dtype=newData.dtype)
+    data[newMask] = newData
+    data[~newMask] = lastData[lastIdx]
+    return data
+
+def getHaloData(space, data, haloSpace):
+    """
+    Given data read with space (a H5Space) and haloSpace which selects some
+    of the same elements, returns a copy of the data for just those elements
+    in file order. Suitable for passing to getReuseInfo() and 
+    combineReusedData() along with haloSpace when the next block is read.
+    """
+    idx = numpy.searchsorted(space.getSelectedIndices(),
+                haloSpace.getSelectedIndices())
+    return data[idx]
+
+PLUGIN_FILTER_IDS = {'blosc' : 32001, 'lz4' : 32004, 'bzip2' : 307, 
+        'zstd' : 32015}
+"IDs of the HDF5 filters that can be used by name if they are registered"
+
+BLOSC_COMPRESSORS = {'blosclz' : 0, 'lz4' : 1, 'lz4hc' : 2, 'snappy' : 3, 
+        'zlib' : 4, 'zstd' : 5}
+"codes for the compressors that the Blosc filter can use internally"
+
+def getCompressionArgs(compression):
+    """
+    Converts a description of the compression to use for a HDF5 dataset
+    into a dictionary of keyword arguments for h5py's create_dataset().
+    compression can be one of:
+
+    * 'none' or None. No compression.
+    * 'gzip' or 'gzip:level'. zlib with the given level (0-9, defaults to 1).
+    * 'lzf'. The LZF filter which is bundled with h5py.
+    * 'blosc', 'blosc:level' or 'blosc:compressor:level'. Blosc using the 
+      given compressor (one of the keys of BLOSC_COMPRESSORS, defaults 
+      to 'lz4') and level (defaults to 5). Blosc does its own shuffling.
+    * 'zstd' or 'zstd:level'. Zstandard with the given level 
+      (defaults to 3).
+    * 'lz4' or 'bzip2'.
+    * An integer. The ID of any other filter registered with HDF5. Or a 
+      tuple of the ID and a tuple of the parameters to pass to it.
+
+    The filters that aren't part of h5py need to be registered, either
+    by having the hdf5plugin package installed or by pointing HDF5_PLUGIN_PATH
+    at them. The byte shuffle filter is used with all but 'none' and 'blosc'.
+
+    Raises generic.LiDARInvalidSetting if the compression isn't understood
+    or the filter isn't available.
+    """
+    if compression is None:
+        return {}
+
+    if isinstance(compression, tuple):
+        filterId, opts = compression
+        return getFilterArgs(int(filterId), tuple(opts))
+    elif isinstance(compression, (int, numpy.integer)):
+        return getFilterArgs(int(compression), None)
+
+    parts = compression.lower().split(':')
+    name = parts[0]
+    params = parts[1:]
+    try:
+        if name == 'none' and len(params) == 0:
+            return {}
+        elif name == 'gzip' and len(params) <= 1:
+            level = 1
+            if len(params) > 0:
+                level = int(params[0])
+            if level < 0 or level > 9:
+                msg = 'gzip compression level must be between 0 and 9'
+                raise generic.LiDARInvalidSetting(msg)
+            return {'shuffle' : True, 'compression' : 'gzip',
+                        'compression_opts' : level}
+        elif name == 'lzf' and len(params) == 0:
+            return {'shuffle' : True, 'compression' : 'lzf'}
+        elif name == 'blosc' and len(params) <= 2:
+            compressor = 'lz4'
+            level = 5
+            if len(params) == 2:
+                compressor = params[0]
+            if len(params) > 0:
+                level = int(params[-1])
+            if compressor not in BLOSC_COMPRESSORS:
+                msg = 'Unknown Blosc compressor %s' % compressor
+                raise generic.LiDARInvalidSetting(msg)
+            if hdf5plugin is not None:
+                return dict(hdf5plugin.Blosc(cname=compressor, clevel=level,
+                        shuffle=hdf5plugin.Blosc.SHUFFLE))
+            # first 4 parameters are filled in by the filter
+            return getFilterArgs(PLUGIN_FILTER_IDS[name], 
+                    (0, 0, 0, 0, level, 1, BLOSC_COMPRESSORS[compressor]),
+                    shuffle=False)
+        elif name == 'zstd' and len(params) <= 1:
+            level = 3
+            if len(params) > 0:
+                level = int(params[0])
+            if hdf5plugin is not None:
+                args = dict(hdf5plugin.Zstd(clevel=level))
+                args['shuffle'] = True
+                return args
+            return getFilterArgs(PLUGIN_FILTER_IDS[name], (level,))
+        elif (name == 'lz4' or name == 'bzip2') and len(params) == 0:
+            if hdf5plugin is not None:
+                if name == 'lz4':
+                    args = dict(hdf5plugin.LZ4())
+                else:
+                    args = dict(hdf5plugin.BZip2())
+                args['shuffle'] = True
+                return args
+            return getFilterArgs(PLUGIN_FILTER_IDS[name], None)
+    except ValueError:
+        # from int()
+        pass
+
+    msg = 'Unable to understand compression %s' % repr(compression)
+    raise generic.LiDARInvalidSetting(msg)
+
+def getFilterArgs(filterId, opts, shuffle=True):
+    """
+    Returns a dictionary of keyword arguments for h5py's create_dataset()
+    that uses the HDF5 filter with the given ID and parameters (a tuple
+    or None). Raises generic.LiDARInvalidSetting if the filter isn't
+    registered with HDF5.
+    """
+    if not h5py.h5z.filter_avail(filterId):
+        msg = ('HDF5 filter %d is not available. Install hdf5plugin or ' +
+                'set HDF5_PLUGIN_PATH') % filterId
+        raise generic.LiDARInvalidSetting(msg)
+
+    args = {'shuffle' : shuffle, 'compression' : filterId}
+    if opts is not None:
+        args['compression_opts'] = opts
+    return args
+
+CHUNK_CACHE_OPTIONS = {'CHUNK_CACHE_NBYTES' : 'rdcc_nbytes', 
+        'CHUNK_CACHE_NSLOTS' : 'rdcc_nslots', 'CHUNK_CACHE_W0' : 'rdcc_w0'}
+"driver options for the HDF5 chunk cache and the h5py.File() argument for each"
+CHUNK_CACHE_AUTO = 'AUTO'
+"""
+Value for the CHUNK_CACHE_NBYTES driver option that sizes the cache 
+from the columns in the file
+"""
+MAX_AUTO_CHUNK_CACHE_NBYTES = 64 * 1024 * 1024
+"Largest chunk cache (per dataset) that will be used with CHUNK_CACHE_AUTO"
+MIN_AUTO_CHUNK_CACHE_NBYTES = 1024 * 1024
+"Smallest chunk cache that will be used with CHUNK_CACHE_AUTO (the HDF5 default)"
+
+def openFileWithChunkCache(fname, mode, driverOptions, controls, 
+                groupName=None):
+    """
+    Opens fname with h5py (mode is the h5py mode string) with the chunk
+    cache set from the CHUNK_CACHE_* keys in driverOptions (a dictionary).
+    HDF5 gives each open dataset its own cache of this size.
+
+    If CHUNK_CACHE_NBYTES is CHUNK_CACHE_AUTO and the file already exists
+    the size of the cache (and number of slots if CHUNK_CACHE_NSLOTS isn't
+    given) is worked out with getAutoChunkCacheArgs(). groupName is passed 
+    to this and controls is used to find the size of a block.
+
+    Returns the h5py.File. Errors from h5py are passed on, as with 
+    h5py.File().
+    """
+    args = {}
+    for key in CHUNK_CACHE_OPTIONS:
+        if key in driverOptions:
+            args[CHUNK_CACHE_OPTIONS[key]] = driverOptions[key]
+
+    if args.get('rdcc_nbytes') != CHUNK_CACHE_AUTO:
+        return h5py.File(fname, mode, **args)
+
+    del args['rdcc_nbytes']
+    fileHandle = h5py.File(fname, mode, **args)
+    if mode == 'w':
+        # nothing there to size the cache from
+        return fileHandle
+
+    # number of elements in each column for a block. Only exact for 
+    # non spatial processing, but gives an idea for spatial processing
+    blockSize = controls.windowSize * controls.windowSize
+    group = fileHandle
+    if groupName is not None and groupName in fileHandle:
+        group = fileHandle[groupName]
+    nbytes, nslots = getAutoChunkCacheArgs(group, blockSize)
+    fileHandle.close()
+
+    args['rdcc_nbytes'] = nbytes
+    if 'rdcc_nslots' not in args:
+        args['rdcc_nslots'] = nslots
+    return h5py.File(fname, mode, **args)
+
+def getAutoChunkCacheArgs(group, blockSize):
+    """
+    Works out the size of the chunk cache (in bytes) needed so that 
+    reading blockSize elements from any of the chunked datasets under 
+    the h5py group doesn't decompress any chunks more than once. Allows 
+    for a block straddling a chunk boundary. The result is kept between 
+    MIN_AUTO_CHUNK_CACHE_NBYTES and MAX_AUTO_CHUNK_CACHE_NBYTES.
+
+    Returns a tuple of the size and the number of slots to use in the
+    cache's hash table (a prime about 100 times the number of chunks in
+    the cache, as recommended by the HDF5 documentation).
+    """
+    # list of [nbytes, nchunks] so the function below can update it
+    largest = [0, 0]
+    def checkDataset(name, obj):
+        if isinstance(obj, h5py.Dataset) and obj.chunks is not None:
+            chunkBytes = int(numpy.prod(obj.chunks)) * obj.dtype.itemsize
+            # chunks along the first axis (which is the one blocks 
+            # are read along) 
+            nchunks = min(int(numpy.ceil(blockSize / obj.chunks[0])) + 1,
+                    int(numpy.ceil(obj.shape[0] / obj.chunks[0])))
+            for chunkLen, size in zip(obj.chunks[1:], obj.shape[1:]):
+                nchunks *= int(numpy.ceil(size / chunkLen))
+            nbytes = min(nchunks * chunkBytes, MAX_AUTO_CHUNK_CACHE_NBYTES)
+            if nbytes > largest[0]:
+                largest[0] = nbytes
+                largest[1] = max(nbytes // max(chunkBytes, 1), 1)
+
+    group.visititems(checkDataset)
+    nbytes, nchunks = largest
+    nbytes = max(nbytes, MIN_AUTO_CHUNK_CACHE_NBYTES)
+
+    return nbytes, getNextPrime(max(nchunks, 1) * 100)
+
+def getNextPrime(n):
+    """
+    Returns the smallest prime number >= n
+    """
+    n = max(n, 2)
+    while True:
+        isPrime = True
+        i = 2
+        while i * i <= n:
+            if n % i == 0:
+                isPrime = False
+                break
+            i += 1
+        if isPrime:
+            return n
+        n += 1
+
+class DirectChunkReader(object):
+    """
+    Reads the selection given by a H5Space from a 1d dataset compressed
+    with gzip (with or without the shuffle filter) without HDF5 doing
+    the decompression. The compressed chunks the selection touches are read
+    with read_direct_chunk() and decompressed with a pool of threads. zlib
+    releases the GIL so this uses as many cores as there are threads, 
+    unlike H5Space.read() which decompresses one chunk at a time.
+
+    The chunks are handed to the threads in batches of at least 
+    DIRECT_CHUNK_BATCH_SIZE elements. This only helps when the chunks are 
+    large enough for the decompression to take longer than reading them - 
+    with small chunks there is little to share between the threads.
+
+    Datasets that are compressed any other way are read with H5Space.read().
+    Only use on files opened read only since chunks that HDF5 hasn't 
+    written yet will not be seen.
+    """
+    def __init__(self, numThreads):
+        self.numThreads = numThreads
+        self.pool = ThreadPoolExecutor(numThreads)
+
+    def close(self):
+        """
+        Shut down the threads
+        """
+        self.pool.shutdown()
+
+    @staticmethod
+    def getFilters(dataSet):
+        """
+        Returns a list of the filter codes (h5py.h5z.FILTER_*) for the
+        dataset in the order they were applied when writing, or None if 
+        it can't be read by this class.
+        """
+        if (len(dataSet.shape) != 1 or dataSet.chunks is None or 
+                dataSet.dtype.kind not in 'biuf' or 
+                not hasattr(dataSet.id, 'read_direct_chunk')):
+            return None
+
+        plist = dataSet.id.get_create_plist()
+        filters = []
+        for n in range(plist.get_nfilters()):
+            code = plist.get_filter(n)[0]
+            if code not in (h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE):
+                return None
+            filters.append(code)
+
+        if h5py.h5z.FILTER_DEFLATE not in filters:
+            # no point, HDF5 is just copying
+            return None
+        return filters
+
+    def read(self, dataSet, selection):
+        """
+        Given a h5py dataset and a H5Space read the data selected and 
+        return a numpy array, as H5Space.read() does.
+        """
+        filters = self.getFilters(dataSet)
+        npoints = selection.getSelectionSize()
+        if filters is None or npoints == 0:
+            return selection.read(dataSet)
+
+        chunkLen = dataSet.chunks[0]
+        uniqueChunkIds, gatherIdx = selection.getChunkInfo(chunkLen)
+        nChunks = uniqueChunkIds.size
+
+        # split the chunks into batches - a few per thread, but not 
+        # so small that handing them over costs more than decompressing
+        maxBatches = max(nChunks * chunkLen // DIRECT_CHUNK_BATCH_SIZE, 1)
+        nBatches = min(self.numThreads * 4, maxBatches, nChunks)
+        batchEdges = numpy.linspace(0, nChunks, nBatches + 1).astype(int)
+
+        # reading the chunks has to be done one at a time, but each batch
+        # can be decompressed while the next ones are read
+        dtype = dataSet.dtype
+        chunkData = numpy.empty(nChunks * chunkLen, dtype=dtype)
+        futures = []
+        for batch in range(nBatches):
+            first = batchEdges[batch]
+            last = batchEdges[batch + 1]
+            raws = []
+            for chunkId in uniqueChunkIds[first:last]:
+                offset = (int(chunkId) * chunkLen,)
+                raws.append(dataSet.id.read_direct_chunk(offset))
+            out = chunkData[first * chunkLen:last * chunkLen]
+            if nBatches == 1:
+                decompressChunks(raws, filters, out)
+            else:
+                futures.append(self.pool.submit(decompressChunks, raws, 
+                            filters, out))
+
+        for future in futures:
+            # raise any errors
+            future.result()
+
+        return chunkData[gatherIdx]
+
+def decompressChunks(raws, filters, out):
+    """
+    Decompresses a batch of chunks (a list of the (filterMask, data) tuples
+    returned by read_direct_chunk()) with decompressChunk() into out, 
+    an array of the length of all the chunks.
+    """
+    chunkLen = out.size // len(raws)
+    for n, (filterMask, raw) in enumerate(raws):
+        out[n * chunkLen:(n + 1) * chunkLen] = decompressChunk(raw, 
+                        filterMask, filters, out.dtype)
+
+def decompressChunk(raw, filterMask, filters, dtype):
+    """
+    Undoes the filters (a list of h5py.h5z.FILTER_DEFLATE and 
+    h5py.h5z.FILTER_SHUFFLE in the order they were applied) for a chunk
+    read with read_direct_chunk(). Filters with their bit set in filterMask 
+    were skipped when the chunk was written. Returns the chunk as an array 
+    of dtype.
+    """
+    for n in range(len(filters) - 1, -1, -1):
+        if filterMask & (1 << n):
+            continue
+        if filters[n] == h5py.h5z.FILTER_DEFLATE:
+            raw = zlib.decompress(raw)
+        elif dtype.itemsize > 1:
+            # unshuffle - the shuffle filter stores the first byte of each 
+            # element, then the second etc
+            shuffled = numpy.frombuffer(raw, dtype=numpy.uint8)
+            nElements = shuffled.size // dtype.itemsize
+            nBytes = nElements * dtype.itemsize
+            unshuffled = shuffled.copy()
+            unshuffled[:nBytes] = shuffled[:nBytes].reshape(
+                        (dtype.itemsize, nElements)).T.reshape(-1)
+            raw = unshuffled.tobytes()
+    return numpy.frombuffer(raw, dtype=dtype)
@@ -233,10 +233,12 @@ class LasFile(generic.LiDARFile):
         """
         return HEADER_TRANSLATION_DICT
 
-    def readPointsByPulse(self, colNames=None):
+    def readPointsByPulse(self, colNames=None, ragged=False):
         """
         Read a 2d structured masked array containing the points
         for each pulse.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         pulses = self.readPulsesForRange()
         points = self.readPointsForRange()
@@ -245,6 +247,12 @@ class LasFile(generic.LiDARFile):
         nReturns = pulses['NUMBER_OF_RETURNS']
         startIdxs = pulses['PTS_START_IDX']
 
+        if ragged:
+            start = gridindexutils.convertSPDIdxToRaggedIdx(startIdxs, 
+                            nReturns)
+            points = self.subsetColumns(points, colNames)
+            return gridindexutils.RaggedArray(points, start, nReturns)
+
         point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(        
                 startIdxs, nReturns)
                 
@@ -482,7 +490,8 @@ class LasFile(generic.LiDARFile):
         self.readData()
         return self.subsetColumns(self.lastPulses, colNames)
         
-    def readPulsesForExtentByBins(self, extent=None, colNames=None):
+    def readPulsesForExtentByBins(self, extent=None, colNames=None, 
+                ragged=False):
         """
         Read all the pulses within the given extent as a 3d structured 
         masked array to match the block/bins being used.
@@ -492,6 +501,8 @@ class LasFile(generic.LiDARFile):
 
         colNames can be a name or list of column names to return. By default
         all columns are returned.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         # now spatially index the pulses
         if extent is None:
@@ -508,20 +519,27 @@ class LasFile(generic.LiDARFile):
             extent.binSize))
         nrows += (self.controls.overlap * 2)
         ncols += (self.controls.overlap * 2)
+        xMin = extent.xMin - (self.controls.overlap * extent.binSize)
+        yMax = extent.yMax + (self.controls.overlap * extent.binSize)
                 
         xidx = self.lastPulses['X_IDX']
         yidx = self.lastPulses['Y_IDX']
         
-        mask, sortedbins, idx, cnt = gridindexutils.CreateSpatialIndex(xidx,
-                yidx, extent.binSize, extent.yMax, extent.xMin, 
+        mask, sortedbins, idx, cnt = gridindexutils.CreateSpatialIndex(yidx,
+                xidx, extent.binSize, yMax, xMin, 
                 nrows, ncols, LAS_SIMPLEGRID_INDEX_DTYPE, 
                 LAS_SIMPLEGRID_COUNT_DTYPE)
 
-        pulse_idx, pulse_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(        
-                idx, cnt)
-                
         pulses = self.lastPulses[mask]
         pulses = pulses[sortedbins]
+
+        if ragged:
+            # the sorted pulses are already grouped by bin
+            pulses = self.subsetColumns(pulses, colNames)
+            return gridindexutils.RaggedArray(pulses, idx, cnt)
+
+        pulse_idx, pulse_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(        
+                idx, cnt)
         
         pulsesByBins = pulses[pulse_idx]
         if colNames is None:
@@ -530,12 +548,12 @@ class LasFile(generic.LiDARFile):
             # TODO: check this with a later numpy
             colNames = pulsesByBins.dtype.names
             
-        pointsByBins = self.subsetColumns(pointsByBins, colNames)
+        pulsesByBins = self.subsetColumns(pulsesByBins, colNames)
         pulsesByBins = numpy.ma.array(pulsesByBins, mask=pulse_idx_mask)              
         return pulsesByBins
         
     def readPointsForExtentByBins(self, extent=None, colNames=None, indexByPulse=False, 
-                returnPulseIndex=False):
+                returnPulseIndex=False, ragged=False):
         """
         Read all the points within the given extent as a 3d structured 
         masked array to match the block/bins being used.
@@ -553,6 +571,8 @@ class LasFile(generic.LiDARFile):
             the indices into the 1d pulse array (as returned by 
             readPulsesForExtent())
         
+        Pass ragged=True to return gridindexutils.RaggedArray instances
+            instead of masked arrays.
         """
         # now spatially index the points
         if extent is None:
@@ -569,6 +589,8 @@ class LasFile(generic.LiDARFile):
             extent.binSize))
         nrows += (self.controls.overlap * 2)
         ncols += (self.controls.overlap * 2)
+        xMin = extent.xMin - (self.controls.overlap * extent.binSize)
+        yMax = extent.yMax + (self.controls.overlap * extent.binSize)
                 
         if indexByPulse:
             xidx = self.lastPulses['X_IDX']
@@ -580,16 +602,29 @@ class LasFile(generic.LiDARFile):
             xidx = self.lastPoints['X']
             yidx = self.lastPoints['Y']
         
-        mask, sortedbins, idx, cnt = gridindexutils.CreateSpatialIndex(xidx,
-                yidx, extent.binSize, extent.yMax, extent.xMin, 
+        mask, sortedbins, idx, cnt = gridindexutils.CreateSpatialIndex(yidx,
+                xidx, extent.binSize, yMax, xMin, 
                 nrows, ncols, LAS_SIMPLEGRID_INDEX_DTYPE, 
                 LAS_SIMPLEGRID_COUNT_DTYPE)
 
-        point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(        
-                idx, cnt)
-                
         points = self.lastPoints[mask]
         points = points[sortedbins]
+
+        if ragged:
+            # the sorted points are already grouped by bin
+            points = self.subsetColumns(points, colNames)
+            points = gridindexutils.RaggedArray(points, idx, cnt)
+            if returnPulseIndex:
+                nreturns = self.lastPulses['NUMBER_OF_RETURNS']
+                pulse_idx_1d = numpy.repeat(numpy.arange(0, nreturns.size),
+                                nreturns)
+                pulse_idx_1d = pulse_idx_1d[mask][sortedbins]
+                return points, gridindexutils.RaggedArray(pulse_idx_1d, 
+                                idx, cnt)
+            return points
+
+        point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(        
+                idx, cnt)
         
         pointsByBins = points[point_idx]
         if colNames is None:
@@ -613,7 +648,7 @@ class LasFile(generic.LiDARFile):
             # sort the right way
             sortedpulse_idx_1d = pulse_idx_1d[sortedbins]
             # turn into a 3d in the same way as the points themselves
-            pulse_idx_3d = sortedpulse_idx_1d[pts_idx]
+            pulse_idx_3d = sortedpulse_idx_1d[point_idx]
             
             # create a masked array 
             pulse_idx_3dmask = numpy.ma.array(pulse_idx_3d, mask=point_idx_mask)
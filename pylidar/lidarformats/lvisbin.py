@@ -171,14 +171,21 @@ class LVISBinFile(generic.LiDARFile):
         self.lastReceived = None
         self.lastTransmitted = None
 
-    def readPointsByPulse(self, colNames=None):
+    def readPointsByPulse(self, colNames=None, ragged=False):
         """
         Return a 2d masked structured array of point that matches
         the pulses.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         # just read the points and add a dimensions
         # since there is one point per pulse
         points = self.readPointsForRange(colNames)
+        if ragged:
+            nPoints = points.shape[0]
+            return gridindexutils.RaggedArray(points, 
+                        numpy.arange(nPoints, dtype=numpy.uint32),
+                        numpy.ones(nPoints, dtype=numpy.uint32))
         points = numpy.expand_dims(points, 0)
         mask = numpy.zeros_like(points, dtype=numpy.bool)
 
@@ -13,6 +13,18 @@ These are contained in the READSUPPORTEDOPTIONS module level variable.
 |                       | create a fake point from (x,y,z). Default  |
 |                       | is ('LON0', 'LAT0', 'Z0')                  |
 +-----------------------+--------------------------------------------+
+| CHUNK_CACHE_NBYTES    | Size in bytes of the HDF5 chunk cache for  |
+|                       | each dataset. Set to h5space.CHUNK_CACHE_   |
+|                       | AUTO to size it from the columns in the    |
+|                       | file and the block size. Defaults to the   |
+|                       | HDF5 default of 1MB.                       |
++-----------------------+--------------------------------------------+
+| CHUNK_CACHE_NSLOTS    | Number of slots in the hash table of the   |
+|                       | HDF5 chunk cache. Should be a prime.       |
++-----------------------+--------------------------------------------+
+| CHUNK_CACHE_W0        | Preemption policy (0-1) of the HDF5 chunk  |
+|                       | cache.                                     |
++-----------------------+--------------------------------------------+
 """
 
 # This file is part of PyLidar
@@ -38,8 +50,11 @@ import copy
 import numpy
 
 from . import generic
+from . import gridindexutils
+from . import h5space
 
-READSUPPORTEDOPTIONS = ('POINT_FROM',)
+READSUPPORTEDOPTIONS = ('POINT_FROM', 'CHUNK_CACHE_NBYTES',
+        'CHUNK_CACHE_NSLOTS', 'CHUNK_CACHE_W0')
 "Supported read options"
 
 DEFAULT_POINT_FROM = ('LON0', 'LAT0', 'Z0')
@@ -66,7 +81,8 @@ class LVISHDF5File(generic.LiDARFile):
 
         # attempt to open the file
         try:
-            self.fileHandle = h5py.File(fname, 'r')
+            self.fileHandle = h5space.openFileWithChunkCache(fname, 'r',
+                        userClass.lidarDriverOptions, controls)
         except (OSError, IOError) as err:
             # always seems to throw an OSError
             # found another one!
@@ -100,14 +116,21 @@ class LVISHDF5File(generic.LiDARFile):
         self.fileHandle = None
         self.range = None
 
-    def readPointsByPulse(self, colNames=None):
+    def readPointsByPulse(self, colNames=None, ragged=False):
         """
         Return a 2d masked structured array of point that matches
         the pulses.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         # just read the points and add a dimensions
         # since there is one point per pulse
         points = self.readPointsForRange(colNames)
+        if ragged:
+            nPoints = points.shape[0]
+            return gridindexutils.RaggedArray(points, 
+                        numpy.arange(nPoints, dtype=numpy.uint32),
+                        numpy.ones(nPoints, dtype=numpy.uint32))
         points = numpy.expand_dims(points, 0)
 
         # make mask (can't just supply False as numpy gives an error)
@@ -138,10 +138,12 @@ class RieglRDBFile(generic.LiDARFile):
         """
         raise generic.LiDARFunctionUnsupported()
 
-    def readPointsByPulse(self, colNames=None):
+    def readPointsByPulse(self, colNames=None, ragged=False):
         """
         Read a 2d structured masked array containing the points
         for each pulse.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         pulses = self.readPulsesForRange()
         points = self.readPointsForRange()
@@ -150,6 +152,12 @@ class RieglRDBFile(generic.LiDARFile):
         nReturns = pulses['NUMBER_OF_RETURNS']
         startIdxs = pulses['PTS_START_IDX']
 
+        if ragged:
+            start = gridindexutils.convertSPDIdxToRaggedIdx(startIdxs, 
+                            nReturns)
+            points = self.subsetColumns(points, colNames)
+            return gridindexutils.RaggedArray(points, start, nReturns)
+
         point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(        
                 startIdxs, nReturns)
                 
@@ -330,6 +330,12 @@ class SPDV3File(generic.LiDARFile):
         self.lastPulseRange = None
         self.lastPoints = None
         self.lastPulses = None
+        # tuples of the h5space.H5Space and data last read for an
+        # extent. When there is an overlap the elements shared with
+        # the next block are copied from these. The data is a copy
+        # of what was returned in case the user changes it.
+        self.haloPulses = None
+        self.haloPoints = None
         
         # the current extent or range for data being read
         self.extent = None
@@ -337,16 +343,14 @@ class SPDV3File(generic.LiDARFile):
         
         # h5space.H5Space
         self.lastPointsSpace = None
-        # index to turn into 2d pointsbypulse
-        self.lastPoints_Idx = None
-        # mask for 2d pointsbypulse
-        self.lastPoints_IdxMask = None
+        # gridindexutils.SPDIdxInfo to turn into 2d pointsbypulse.
+        # See the lastPoints_Idx and lastPoints_IdxMask properties.
+        self.lastPointsIdxInfo = None
         # h5space.H5Space
         self.lastPulsesSpace = None
-        # index to turn into 3d pulsebybins
-        self.lastPulses_Idx = None
-        # mask for 3d pulsebybins
-        self.lastPulses_IdxMask = None
+        # gridindexutils.SPDIdxInfo to turn into 3d pulsebybins
+        # See the lastPulses_Idx and lastPulses_IdxMask properties.
+        self.lastPulsesIdxInfo = None
         # index to turn into 3d pointsbybins
         self.lastPoints3d_Idx = None
         # mask for 3d pointsbybins
@@ -511,6 +515,40 @@ spatial index will be recomputed on the fly"""
             self.controls.messageHandler(msg, generic.MESSAGE_INFORMATION)
             self.unalignedWarningGiven = True
         
+    @property
+    def lastPulses_Idx(self):
+        """
+        Index that turns the last pulses read into a masked array by bins.
+        Only created when first needed as it is padded to the fullest bin.
+        """
+        if self.lastPulsesIdxInfo is None:
+            return None
+        return self.lastPulsesIdxInfo.getIdxAndMask()[0]
+
+    @property
+    def lastPulses_IdxMask(self):
+        "Mask for the masked array made with lastPulses_Idx"
+        if self.lastPulsesIdxInfo is None:
+            return None
+        return self.lastPulsesIdxInfo.getIdxAndMask()[1]
+
+    @property
+    def lastPoints_Idx(self):
+        """
+        Index that turns the last points read into a masked array by pulse.
+        Only created when first needed as it is padded to the most returns.
+        """
+        if self.lastPointsIdxInfo is None:
+            return None
+        return self.lastPointsIdxInfo.getIdxAndMask()[0]
+
+    @property
+    def lastPoints_IdxMask(self):
+        "Mask for the masked array made with lastPoints_Idx"
+        if self.lastPointsIdxInfo is None:
+            return None
+        return self.lastPointsIdxInfo.getIdxAndMask()[1]
+
     def readPointsForExtent(self, colNames=None):
         """
         Read out the points for the given extent as a 1d structured array.
@@ -527,21 +565,22 @@ spatial index will be recomputed on the fly"""
         startIdxs = pulses['PTS_START_IDX']
         
         nOut = self.fileHandle['DATA']['POINTS'].shape[0]
-        point_space, point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
-                        startIdxs, nReturns, nOut)
+        point_space = gridindexutils.convertSPDIdxToReadSpace(startIdxs, 
+                        nReturns, nOut)
         
-        points = point_space.read(self.fileHandle['DATA']['POINTS'])
+        # translates any classifications also
+        points = self.readReusingHalo(self.fileHandle['DATA']['POINTS'],
+                        point_space, self.haloPoints, True)
 
-        # translate any classifications
-        self.recodeClassification(points, generic.RECODE_TO_LAS, colNames)
-        
         # self.lastExtent updated in readPulsesForExtent()
         # keep these indices from pulses to points - handy for the indexing 
         # functions.
         self.lastPointsSpace = point_space
         self.lastPoints = points
-        self.lastPoints_Idx = point_idx
-        self.lastPoints_IdxMask = point_idx_mask
+        self.lastPointsIdxInfo = gridindexutils.SPDIdxInfo(startIdxs, nReturns)
+        if self.extentAlignedWithSpatialIndex:
+            # pulses are re-sorted otherwise
+            self.setPointsHalo(point_space, points)
         return self.subsetColumns(points, colNames)
             
     def readPulsesForExtent(self, colNames=None):
@@ -593,9 +632,14 @@ spatial index will be recomputed on the fly"""
             idx_subset[imageSlice] = self.si_idx[siSlice]
         
         nOut = self.fileHandle['DATA']['PULSES'].shape[0]
-        pulse_space, pulse_idx, pulse_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
+        pulse_space = gridindexutils.convertSPDIdxToReadSpace(
                 idx_subset, cnt_subset, nOut)
-        pulses = pulse_space.read(self.fileHandle['DATA']['PULSES'])
+        pulse_idx_info = gridindexutils.SPDIdxInfo(idx_subset, cnt_subset)
+        if self.extentAlignedWithSpatialIndex:
+            pulses = self.readReusingHalo(self.fileHandle['DATA']['PULSES'],
+                        pulse_space, self.haloPulses)
+        else:
+            pulses = pulse_space.read(self.fileHandle['DATA']['PULSES'])
 
         if not self.extentAlignedWithSpatialIndex:
             # need to recompute subset of spatial index to bins
@@ -614,8 +658,9 @@ spatial index will be recomputed on the fly"""
                     self.extent.yMax, self.extent.xMin, nrows, ncols, 
                     SPDV3_SI_INDEX_DTYPE, SPDV3_SI_COUNT_DTYPE)
             # ok calculate indices on new spatial indexes
-            pulse_space, pulse_idx, pulse_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
+            pulse_space = gridindexutils.convertSPDIdxToReadSpace(
                             new_idx, new_cnt, nOut)
+            pulse_idx_info = gridindexutils.SPDIdxInfo(new_idx, new_cnt)
             # re-sort the pulses to match the new spatial index
             pulses = pulses[mask]
             pulses = pulses[sortedbins]
@@ -626,14 +671,72 @@ spatial index will be recomputed on the fly"""
         # keep these indices from spatial index to pulses as they are
         # handy for the ByBins functions
         self.lastPulsesSpace = pulse_space
-        self.lastPulses_Idx = pulse_idx
-        self.lastPulses_IdxMask = pulse_idx_mask
+        self.lastPulsesIdxInfo = pulse_idx_info
         self.lastPoints = None # are now invalid
+        if self.extentAlignedWithSpatialIndex:
+            # re-sorted otherwise
+            self.setPulsesHalo(pulse_space, pulse_idx_info, pulses)
         return self.subsetColumns(pulses, colNames)
 
-    def readPulsesForExtentByBins(self, extent=None, colNames=None):
+    def setPulsesHalo(self, pulse_space, idxInfo, pulses):
+        """
+        Internal method. When reading with an overlap, keeps a copy of the 
+        pulses in the trailing bins of the block (those the next blocks 
+        will read again) for readReusingHalo().
+        """
+        if self.mode != generic.READ or self.controls.overlap == 0:
+            return
+        haloSpace = gridindexutils.getTrailingBinsSpace(idxInfo, 
+                        self.controls.overlap, pulse_space.size)
+        haloData = h5space.getHaloData(pulse_space, pulses, haloSpace)
+        self.haloPulses = (haloSpace, haloData)
+
+    def setPointsHalo(self, point_space, points):
+        """
+        Internal method. As setPulsesHalo() but for the points of the
+        pulses in the trailing bins. Uses the pulses last read.
+        """
+        if self.mode != generic.READ or self.controls.overlap == 0:
+            return
+        haloPulseSpace = gridindexutils.getTrailingBinsSpace(
+                        self.lastPulsesIdxInfo, self.controls.overlap, 
+                        self.lastPulsesSpace.size)
+        haloSpace = gridindexutils.getSubsetSpace(self.lastPulsesSpace, 
+                        haloPulseSpace, self.lastPointsIdxInfo, 
+                        point_space.size)
+        haloData = h5space.getHaloData(point_space, points, haloSpace)
+        self.haloPoints = (haloSpace, haloData)
+
+    def readReusingHalo(self, dataSet, selection, halo, recode=False):
+        """
+        Reads the records selected by selection (a h5space.H5Space) 
+        from dataSet, translating the classifications if recode is True.
+        When there is an overlap between blocks the records that were read
+        last time (halo is a tuple of the h5space.H5Space and records)
+        are copied from there rather than being read again.
+        """
+        reuseInfo = None
+        if halo is not None and self.controls.overlap > 0:
+            lastSpace, lastData = halo
+            reuseInfo = h5space.getReuseInfo(selection, lastSpace)
+
+        if reuseInfo is not None:
+            selection, newMask, lastIdx = reuseInfo
+
+        data = selection.read(dataSet)
+        if recode:
+            self.recodeClassification(data, generic.RECODE_TO_LAS)
+
+        if reuseInfo is not None:
+            data = h5space.combineReusedData(data, lastData, newMask, lastIdx)
+        return data
+
+    def readPulsesForExtentByBins(self, extent=None, colNames=None,
+                    ragged=False):
         """
         Return the pulses as a 3d structured masked array.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         # if they have given us a new extent then use that
         if extent is not None:
@@ -642,16 +745,24 @@ spatial index will be recomputed on the fly"""
         # go and get the pulses - should returned cached if 
         # already got.
         pulses = self.readPulsesForExtent()
-        # get these 'last' indices which map spatial index to pulses
-        idx = self.lastPulses_Idx
-        idxMask = self.lastPulses_IdxMask 
-        # re-map into 3d
-        pulsesByBins = pulses[idx]
-        
+        # get the info which maps spatial index to pulses
+        idxInfo = self.lastPulsesIdxInfo
+
         # set extent back to the 'normal' one for this block
         # in case they call this again without the extent param
         if extent is not None:
             self.setExtent(oldExtent)
+
+        if ragged:
+            # pulses are already grouped by bin
+            start, count = idxInfo.getRaggedStartAndCount()
+            pulses = self.subsetColumns(pulses, colNames)
+            return gridindexutils.RaggedArray(pulses, start, count)
+
+        idx, idxMask = idxInfo.getIdxAndMask()
+
+        # re-map into 3d
+        pulsesByBins = pulses[idx]
             
         # make masked array
         pulsesByBins = self.subsetColumns(pulsesByBins, colNames)
@@ -659,7 +770,7 @@ spatial index will be recomputed on the fly"""
         return pulses
         
     def readPointsForExtentByBins(self, extent=None, colNames=None, 
-                    indexByPulse=False, returnPulseIndex=False):
+                    indexByPulse=False, returnPulseIndex=False, ragged=False):
         """
         Return the points as a 3d structured masked array.
         
@@ -672,6 +783,8 @@ spatial index will be recomputed on the fly"""
         Pass returnPulseIndex=True to also return a masked 3d array of 
             the indices into the 1d pulse array (as returned by 
             readPulsesForExtent())
+        Pass ragged=True to return gridindexutils.RaggedArray instances
+            instead of masked arrays.
             
         """
         # if they have given us a new extent then use that
@@ -709,20 +822,33 @@ spatial index will be recomputed on the fly"""
         mask, sortedbins, idx, cnt = gridindexutils.CreateSpatialIndex(
                 y_idx, x_idx, self.lastExtent.binSize, 
                 yMax, xMin, nrows, ncols, SPDV3_SI_INDEX_DTYPE, SPDV3_SI_COUNT_DTYPE)
-                
-        pts_idx, pts_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
-                                idx, cnt)
 
         points = points[mask]                  
         sortedPoints = points[sortedbins]
-        
-        pointsByBins = sortedPoints[pts_idx]
 
         # set extent back to the 'normal' one for this block
         # in case they call this again without the extent param
         if extent is not None:
             self.setExtent(oldExtent)
 
+        if ragged:
+            # the sorted points are already grouped by bin
+            sortedPoints = self.subsetColumns(sortedPoints, colNames)
+            points = gridindexutils.RaggedArray(sortedPoints, idx, cnt)
+            if returnPulseIndex:
+                nreturns = self.lastPulses['NUMBER_OF_RETURNS']
+                pulse_idx_1d = numpy.repeat(numpy.arange(0, nreturns.size),
+                                nreturns)
+                pulse_idx_1d = pulse_idx_1d[mask][sortedbins]
+                return points, gridindexutils.RaggedArray(pulse_idx_1d, 
+                                idx, cnt)
+            return points
+                
+        pts_idx, pts_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
+                                idx, cnt)
+        
+        pointsByBins = sortedPoints[pts_idx]
+
         self.lastPoints3d_Idx = pts_idx
         self.lastPoints3d_IdxMask = pts_idx_mask
         self.lastPoints3d_InRegionMask = mask
@@ -754,18 +880,25 @@ spatial index will be recomputed on the fly"""
             # just return the points
             return points
 
-    def readPointsByPulse(self, colNames=None):
+    def readPointsByPulse(self, colNames=None, ragged=False):
         """
         Return a 2d masked structured array of point that matches
         the pulses.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         if self.controls.spatialProcessing:
             points = self.readPointsForExtent()
         else:
             points = self.readPointsForRange()
-        idx = self.lastPoints_Idx
-        idxMask = self.lastPoints_IdxMask
         
+        if ragged:
+            start, count = self.lastPointsIdxInfo.getRaggedStartAndCount()
+            points = self.subsetColumns(points, colNames)
+            return gridindexutils.RaggedArray(points, start, count)
+
+        idx, idxMask = self.lastPointsIdxInfo.getIdxAndMask()
+
         pointsByPulse = points[idx]
         pointsByPulse = self.subsetColumns(pointsByPulse, colNames)
         points = numpy.ma.array(pointsByPulse, mask=idxMask)
@@ -1335,7 +1468,37 @@ spatial index will be recomputed on the fly"""
         Return True if we have a spatial index.
         """
         return self.si_cnt is not None
-        
+
+    def getPulseCountsForExtent(self, extent):
+        """
+        Return a 2d array of the number of pulses in each bin of the
+        spatial index that covers the given extent.
+        """
+        if not self.hasSpatialIndex():
+            msg = 'SPDV3 file has no spatial index'
+            raise generic.LiDARFunctionUnsupported(msg)
+
+        pixGrid = self.getPixelGrid()
+        xMin = gridindexutils.snapToGrid(extent.xMin, pixGrid.xMin,
+                pixGrid.xRes, gridindexutils.SNAPMETHOD_LESS)
+        xMax = gridindexutils.snapToGrid(extent.xMax, pixGrid.xMax,
+                pixGrid.xRes, gridindexutils.SNAPMETHOD_GREATER)
+        yMin = gridindexutils.snapToGrid(extent.yMin, pixGrid.yMin,
+                pixGrid.yRes, gridindexutils.SNAPMETHOD_LESS)
+        yMax = gridindexutils.snapToGrid(extent.yMax, pixGrid.yMax,
+                pixGrid.yRes, gridindexutils.SNAPMETHOD_GREATER)
+
+        nrows = int(numpy.round((yMax - yMin) / self.si_binSize))
+        ncols = int(numpy.round((xMax - xMin) / self.si_binSize))
+        cnt_subset = numpy.zeros((nrows, ncols), dtype=SPDV3_SI_COUNT_DTYPE)
+
+        imageSlice, siSlice = gridindexutils.getSlicesForExtent(pixGrid,
+             self.si_cnt.shape, 0, xMin, xMax, yMin, yMax)
+        if imageSlice is not None and siSlice is not None:
+            cnt_subset[imageSlice] = self.si_cnt[siSlice]
+
+        return cnt_subset
+
     # The functions below are for when there is no spatial index.
     def setPulseRange(self, pulseRange):
         """
@@ -1374,8 +1537,8 @@ spatial index will be recomputed on the fly"""
         
         nOut = self.fileHandle['DATA']['POINTS'].shape[0]
         
-        point_space, point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
-                    startIdxs, nReturns, nOut)
+        point_space = gridindexutils.convertSPDIdxToReadSpace(startIdxs, 
+                    nReturns, nOut)
                 
         points = point_space.read(self.fileHandle['DATA']['POINTS'])
 
@@ -1386,8 +1549,7 @@ spatial index will be recomputed on the fly"""
         # functions.
         self.lastPoints = points
         self.lastPointsSpace = point_space
-        self.lastPoints_Idx = point_idx
-        self.lastPoints_IdxMask = point_idx_mask
+        self.lastPointsIdxInfo = gridindexutils.SPDIdxInfo(startIdxs, nReturns)
         # self.lastPulseRange copied in readPulsesForRange()
         return self.subsetColumns(points, colNames)
     
@@ -1528,6 +1690,8 @@ spatial index will be recomputed on the fly"""
         self.lastExtent = None
         self.lastPoints = None
         self.lastPulses = None
+        self.haloPulses = None
+        self.haloPoints = None
 
 class SPDV3FileInfo(generic.LiDARFileInfo):
     """
@@ -2,6 +2,46 @@
 """
 SPD V4 format driver and support functions
 
+Read Driver Options
+-------------------
+
+These are contained in the READSUPPORTEDOPTIONS module level variable.
+
++-----------------------------+-------------------------------------------+
+| Name                        | Use                                       |
++=============================+===========================================+
+| BLOCK_CACHE_SIZE            | Maximum number of bytes of recently read  |
+|                             | pulses and points (and the information    |
+|                             | needed to read them) to keep so they      |
+|                             | don't need to be read again. Copies of    |
+|                             | the arrays are kept so this costs memory  |
+|                             | and time - useful when the same extents   |
+|                             | are read repeatedly. Defaults to 0 which  |
+|                             | only keeps the current block.             |
++-----------------------------+-------------------------------------------+
+| CHUNK_CACHE_NBYTES          | Size in bytes of the HDF5 chunk cache for |
+|                             | each column. Set to h5space.CHUNK_CACHE_  |
+|                             | AUTO to size it from the columns in the   |
+|                             | file and the block size. Defaults to the  |
+|                             | HDF5 default of 1MB.                      |
++-----------------------------+-------------------------------------------+
+| CHUNK_CACHE_NSLOTS          | Number of slots in the hash table of the  |
+|                             | HDF5 chunk cache. Should be a prime.      |
++-----------------------------+-------------------------------------------+
+| CHUNK_CACHE_W0              | Preemption policy (0-1) of the HDF5 chunk |
+|                             | cache.                                    |
++-----------------------------+-------------------------------------------+
+| DIRECT_CHUNK_THREADS        | Number of threads to decompress columns   |
+|                             | with, bypassing HDF5. Only for columns    |
+|                             | compressed with gzip. See                 |
+|                             | h5space.DirectChunkReader. Only helps for |
+|                             | files written with a large HDF5_CHUNK_SIZE|
+|                             | (tens of thousands of elements) - the     |
+|                             | default of 250 is too small to gain       |
+|                             | anything. Defaults to 0 which lets HDF5   |
+|                             | decompress them.                          |
++-----------------------------+-------------------------------------------+
+
 Write Driver Options
 --------------------
 
@@ -16,6 +56,57 @@ These are contained in the WRITESUPPORTEDOPTIONS module level variable.
 | HDF5_CHUNK_SIZE             | Set the HDF5 chunk size when creating     |
 |                             | columns. Defaults to 250.                 |
 +-----------------------------+-------------------------------------------+
+| COMPRESSION                 | The HDF5 compression to use when creating |
+|                             | columns. Either a single value used for   |
+|                             | everything, or a dictionary keyed on the  |
+|                             | ARRAY_TYPE_* values from .generic and     |
+|                             | COMPRESSION_SPATIAL_INDEX that overrides  |
+|                             | the values in DEFAULT_COMPRESSION. See    |
+|                             | h5space.getCompressionArgs() for the      |
+|                             | values ('gzip:1', 'lzf', 'none', 'zstd'   |
+|                             | etc). Transmitted and received waveforms  |
+|                             | use the ARRAY_TYPE_WAVEFORMS value.       |
++-----------------------------+-------------------------------------------+
+| EXPECTED_NUMBER_OF_PULSES   | When creating a file, the number of       |
+|                             | pulses that are expected to be written.   |
+|                             | The pulse columns are created this big    |
+|                             | to start with, rather than grown as data  |
+|                             | is written. Any extra is removed on close.|
++-----------------------------+-------------------------------------------+
+| EXPECTED_NUMBER_OF_POINTS   | As for EXPECTED_NUMBER_OF_PULSES but for  |
+|                             | the point columns.                        |
++-----------------------------+-------------------------------------------+
+| SPATIAL_INDEX_TYPE          | Type of spatial index to create. One of   |
+|                             | the SPDV4_INDEXTYPE_* values. Defaults to |
+|                             | SPDV4_INDEXTYPE_SIMPLEGRID. Use           |
+|                             | SPDV4_INDEXTYPE_PYRAMIDGRID so the file   |
+|                             | can also be read at bin sizes that are    |
+|                             | powers of 2 times the bin size without    |
+|                             | the index being recomputed.               |
++-----------------------------+-------------------------------------------+
+| POINT_SPATIAL_INDEX         | If True, also write an index of the       |
+|                             | points by their own X and Y on the same   |
+|                             | grid. readPointsForExtentByBins() then    |
+|                             | uses it rather than binning the points    |
+|                             | for each block. setPixelGrid() must be    |
+|                             | called before any points are written.     |
+|                             | The bins of the points are kept in a      |
+|                             | temporary file in the same directory      |
+|                             | until the file is closed. Defaults to     |
+|                             | False.                                    |
++-----------------------------+-------------------------------------------+
+| CHUNK_CACHE_NBYTES          | Size in bytes of the HDF5 chunk cache for |
+|                             | each column. Set to h5space.CHUNK_CACHE_  |
+|                             | AUTO to size it from the columns in the   |
+|                             | file and the block size. Defaults to the  |
+|                             | HDF5 default of 1MB.                      |
++-----------------------------+-------------------------------------------+
+| CHUNK_CACHE_NSLOTS          | Number of slots in the hash table of the  |
+|                             | HDF5 chunk cache. Should be a prime.      |
++-----------------------------+-------------------------------------------+
+| CHUNK_CACHE_W0              | Preemption policy (0-1) of the HDF5 chunk |
+|                             | cache.                                    |
++-----------------------------+-------------------------------------------+
 
 """
 # This file is part of PyLidar
@@ -45,16 +136,29 @@ from . import generic
 from . import gridindexutils
 from . import h5space
 from . import spdv4_index
+from . import blockcache
 
 WRITESUPPORTEDOPTIONS = ('SCALING_BUT_NO_DATA_WARNING', 
-            'HDF5_CHUNK_SIZE')
+            'HDF5_CHUNK_SIZE', 'COMPRESSION', 'CHUNK_CACHE_NBYTES', 
+            'CHUNK_CACHE_NSLOTS', 'CHUNK_CACHE_W0', 'EXPECTED_NUMBER_OF_PULSES',
+            'EXPECTED_NUMBER_OF_POINTS', 'SPATIAL_INDEX_TYPE',
+            'POINT_SPATIAL_INDEX')
 "driver options"
-READSUPPORTEDOPTIONS = ()
+READSUPPORTEDOPTIONS = ('BLOCK_CACHE_SIZE', 'CHUNK_CACHE_NBYTES', 
+            'CHUNK_CACHE_NSLOTS', 'CHUNK_CACHE_W0', 'DIRECT_CHUNK_THREADS')
 "driver options"
 
 "Default hdf5 chunk size set on column creation"
 DEFAULT_HDF5_CHUNK_SIZE = 250
 
+COMPRESSION_SPATIAL_INDEX = 'SPATIAL_INDEX'
+"key for the spatial index in the COMPRESSION driver option"
+DEFAULT_COMPRESSION = {generic.ARRAY_TYPE_PULSES : 'gzip:1',
+        generic.ARRAY_TYPE_POINTS : 'gzip:1', 
+        generic.ARRAY_TYPE_WAVEFORMS : 'gzip:1',
+        COMPRESSION_SPATIAL_INDEX : 'gzip:1'}
+"Default compression set on column creation (same as SPDLib)"
+
 HEADER_FIELDS = {'AZIMUTH_MAX' : numpy.float64, 'AZIMUTH_MIN' : numpy.float64,
 'BANDWIDTHS' : numpy.float32, 'BIN_SIZE' : numpy.float32,
 'BLOCK_SIZE_POINT' : numpy.uint16, 'BLOCK_SIZE_PULSE' : numpy.uint16,
@@ -187,6 +291,8 @@ SPDV4_PULSE_INDEX_ZPLANE = 7 # Reserved
 
 SPDV4_INDEXTYPE_SIMPLEGRID = spdv4_index.SPDV4_INDEXTYPE_SIMPLEGRID
 "types of spatial indices"
+SPDV4_INDEXTYPE_PYRAMIDGRID = spdv4_index.SPDV4_INDEXTYPE_PYRAMIDGRID
+"types of spatial indices"
 
 SPDV4_SIMPLEGRID_COUNT_DTYPE = spdv4_index.SPDV4_SIMPLEGRID_COUNT_DTYPE
 "data types for the spatial index"
@@ -293,6 +399,75 @@ def flatten3dWaveformData(wavedata, inmask, nrecv, flattened):
                 nrecv[nrecv_idx] = c
                 nrecv_idx += 1
 
+class ColumnAppender(object):
+    """
+    Appends data to a 1d HDF5 dataset when creating a file. Data is kept
+    in memory until there are whole chunks of it, which are then written 
+    at once so HDF5 never has to rewrite a partially filled chunk. The 
+    dataset is grown geometrically (or straight to expectedSize if that is 
+    given) rather than being resized for every block.
+
+    Call flush() at the end to write the last partial chunk and trim the 
+    dataset to the number of elements appended.
+    """
+    def __init__(self, dataset, expectedSize=None):
+        self.dataset = dataset
+        self.chunkLen = dataset.chunks[0]
+        self.expectedSize = expectedSize
+        # number of elements appended, including those not yet written
+        self.size = dataset.shape[0]
+        # number written to the dataset
+        self.written = dataset.shape[0]
+        self.pending = []
+        self.nPending = 0
+
+    def append(self, data):
+        """
+        Append the elements in the 1d array data to the dataset
+        """
+        # copy as data may be a view on an array the caller reuses
+        self.pending.append(data.copy())
+        self.nPending += data.size
+        self.size += data.size
+
+        nWhole = (self.nPending // self.chunkLen) * self.chunkLen
+        if nWhole > 0:
+            pending = numpy.concatenate(self.pending)
+            self.writeSlab(pending[:nWhole])
+            self.pending = [pending[nWhole:]]
+            self.nPending = self.pending[0].size
+
+    def writeSlab(self, data):
+        """
+        Internal method. Writes data after the elements already written,
+        growing the dataset if needed.
+        """
+        end = self.written + data.size
+        allocated = self.dataset.shape[0]
+        if end > allocated:
+            if self.expectedSize is not None and self.expectedSize >= end:
+                newSize = self.expectedSize
+            else:
+                newSize = max(end, allocated * 2)
+            # whole number of chunks
+            newSize = -(-newSize // self.chunkLen) * self.chunkLen
+            self.dataset.resize((newSize,))
+
+        self.dataset[self.written:end] = data
+        self.written = end
+
+    def flush(self):
+        """
+        Write any data still in memory and trim the dataset to the
+        number of elements appended.
+        """
+        if self.nPending > 0:
+            self.writeSlab(numpy.concatenate(self.pending))
+        self.pending = []
+        self.nPending = 0
+        if self.dataset.shape[0] != self.size:
+            self.dataset.resize((self.size,))
+
 class SPDV4File(generic.LiDARFile):
     """
     Class to support reading and writing of SPD Version 4.x files.
@@ -330,18 +505,79 @@ class SPDV4File(generic.LiDARFile):
 
         # type of spatial index to use
         self.preferredSpatialIndex = SPDV4_INDEXTYPE_SIMPLEGRID
+        if 'SPATIAL_INDEX_TYPE' in userClass.lidarDriverOptions:
+            self.preferredSpatialIndex = (
+                userClass.lidarDriverOptions['SPATIAL_INDEX_TYPE'])
+            # raises if not valid
+            spdv4_index.SPDV4SpatialIndex.getClassForType(
+                                self.preferredSpatialIndex)
+
+        # also index the points by their own location when creating
+        self.indexPoints = False
+        if 'POINT_SPATIAL_INDEX' in userClass.lidarDriverOptions:
+            self.indexPoints = (
+                userClass.lidarDriverOptions['POINT_SPATIAL_INDEX'])
 
         # create index on update - only valid for more advanced indices
         self.createIndexOnUpdate = False
 
+        # cache of data read for recent extents and ranges. Only when 
+        # reading as writing would make it out of date.
+        cacheSize = 0
+        if mode == generic.READ:
+            cacheSize = blockcache.DEFAULT_CACHE_SIZE
+            if 'BLOCK_CACHE_SIZE' in userClass.lidarDriverOptions:
+                cacheSize = userClass.lidarDriverOptions['BLOCK_CACHE_SIZE']
+        self.blockCache = blockcache.BlockCache(cacheSize)
+
+        # decompress columns ourselves with a pool of threads. Only when
+        # reading as HDF5 may not have written chunks yet otherwise.
+        self.chunkReader = None
+        if (mode == generic.READ and 
+                'DIRECT_CHUNK_THREADS' in userClass.lidarDriverOptions):
+            numThreads = userClass.lidarDriverOptions['DIRECT_CHUNK_THREADS']
+            if numThreads > 0:
+                self.chunkReader = h5space.DirectChunkReader(numThreads)
+
         # hdf5 chunk size - as a tuple - columns are 1d
         self.hdf5ChunkSize = (DEFAULT_HDF5_CHUNK_SIZE,)
         if 'HDF5_CHUNK_SIZE' in userClass.lidarDriverOptions:
             self.hdf5ChunkSize = (userClass.lidarDriverOptions['HDF5_CHUNK_SIZE'],)
 
+        # ColumnAppender objects keyed on the name of the dataset.
+        # Only used when creating.
+        self.appenders = {}
+        self.expectedSizes = {}
+        if 'EXPECTED_NUMBER_OF_PULSES' in userClass.lidarDriverOptions:
+            self.expectedSizes[generic.ARRAY_TYPE_PULSES] = int(
+                userClass.lidarDriverOptions['EXPECTED_NUMBER_OF_PULSES'])
+        if 'EXPECTED_NUMBER_OF_POINTS' in userClass.lidarDriverOptions:
+            self.expectedSizes[generic.ARRAY_TYPE_POINTS] = int(
+                userClass.lidarDriverOptions['EXPECTED_NUMBER_OF_POINTS'])
+
+        # hdf5 compression - dictionary of create_dataset() keyword
+        # arguments for each of the keys in DEFAULT_COMPRESSION
+        compression = DEFAULT_COMPRESSION.copy()
+        if 'COMPRESSION' in userClass.lidarDriverOptions:
+            option = userClass.lidarDriverOptions['COMPRESSION']
+            if isinstance(option, dict):
+                for key in option:
+                    if key not in compression:
+                        msg = 'Unknown key %s in COMPRESSION' % repr(key)
+                        raise generic.LiDARInvalidSetting(msg)
+                compression.update(option)
+            else:
+                for key in compression:
+                    compression[key] = option
+        self.compressionArgs = {}
+        for key in compression:
+            self.compressionArgs[key] = h5space.getCompressionArgs(
+                                    compression[key])
+
         # attempt to open the file
         try:
-            self.fileHandle = h5py.File(fname, h5py_mode)
+            self.fileHandle = h5space.openFileWithChunkCache(fname, 
+                    h5py_mode, userClass.lidarDriverOptions, controls)
         except (OSError, IOError) as err:
             # always seems to throw an OSError
             # found another one!
@@ -411,6 +647,9 @@ class SPDV4File(generic.LiDARFile):
         self.si_handler = spdv4_index.SPDV4SpatialIndex.getHandlerForFile(
                             self.fileHandle, mode, 
                             prefType=self.preferredSpatialIndex)
+        if self.si_handler is not None:
+            self.si_handler.compressionArgs = self.compressionArgs[
+                                    COMPRESSION_SPATIAL_INDEX]
          
         # the following is for caching reads so we don't need to 
         # keep re-reading each time the user asks. Also handy since
@@ -419,14 +658,20 @@ class SPDV4File(generic.LiDARFile):
         self.lastPulseRange = None
         self.lastPoints = None
         self.lastPointsSpace = None
-        self.lastPoints_Idx = None
-        self.lastPoints_IdxMask = None
+        # gridindexutils.SPDIdxInfo for the last points and pulses read.
+        # See the lastPoints_Idx etc properties.
+        self.lastPointsIdxInfo = None
         self.lastPointsColumns = None
         self.lastPulses = None
         self.lastPulsesSpace = None
-        self.lastPulses_Idx = None
-        self.lastPulses_IdxMask = None
+        self.lastPulsesIdxInfo = None
         self.lastPulsesColumns = None
+        # tuples of the h5space.H5Space, data and column names last 
+        # read for an extent. When there is an overlap the elements 
+        # shared with the next block are copied from these. The data
+        # is a copy of what was returned in case the user changes it.
+        self.haloPulses = None
+        self.haloPoints = None
         # h5space.H5Space
         self.lastWaveSpace = None
         self.lastWave_Idx = None
@@ -530,7 +775,10 @@ class SPDV4File(generic.LiDARFile):
         # need to check that the given extent is on the same grid as the 
         # spatial index. If not a new spatial index will have to be calculated
         # for each block before we can access the data.
-        totalPixGrid = self.getPixelGrid()
+        # the index may have grids for more than one bin size
+        totalPixGrid = self.si_handler.getPixelGridForBinSize(extent.binSize)
+        if totalPixGrid is None:
+            totalPixGrid = self.getPixelGrid()
         extentPixGrid = pixelgrid.PixelGridDefn(xMin=extent.xMin, 
                 xMax=extent.xMax, yMin=extent.yMin, yMax=extent.yMax,
                 xRes=extent.binSize, yRes=extent.binSize, projection=totalPixGrid.projection)
@@ -567,6 +815,13 @@ spatial index will be recomputed on the fly"""
             
         else:
             self.si_handler.createNewIndex(pixGrid)
+            if self.indexPoints:
+                pointsHandle = self.fileHandle['DATA']['POINTS']
+                if self.getColumnSize(pointsHandle, 'RETURN_NUMBER') > 0:
+                    msg = ('The pixel grid must be set before any points ' +
+                            'are written to create a point index')
+                    raise generic.LiDARInvalidSetting(msg)
+                self.si_handler.startPointIndex()
             
         # cache it
         self.pixGrid = pixGrid
@@ -577,6 +832,16 @@ spatial index will be recomputed on the fly"""
         """
         return (self.si_handler is not None and 
             self.si_handler.pixelGrid is not None)
+
+    def getPulseCountsForExtent(self, extent):
+        """
+        Return a 2d array of the number of pulses in each bin of the
+        spatial index that covers the given extent. 
+        """
+        if not self.hasSpatialIndex():
+            msg = 'Format has no spatial Index. Processing must be done non-spatially'
+            raise generic.LiDARFunctionUnsupported(msg)
+        return self.si_handler.getPulseCountsForExtent(extent)
         
     def close(self):
         """
@@ -585,6 +850,15 @@ spatial index will be recomputed on the fly"""
         if self.si_handler is not None:
             self.si_handler.close()
 
+        if self.chunkReader is not None:
+            self.chunkReader.close()
+            self.chunkReader = None
+
+        # write out anything still to be appended
+        for appender in self.appenders.values():
+            appender.flush()
+        self.appenders = {}
+
         # flush the scaling values
         if self.mode != generic.READ:
             pulsesHandle = self.fileHandle['DATA']['PULSES']
@@ -692,14 +966,12 @@ spatial index will be recomputed on the fly"""
         self.lastExtent = None
         self.lastPoints = None
         self.lastPointsSpace = None
-        self.lastPoints_Idx = None
-        self.lastPoints_IdxMask = None
+        self.lastPointsIdxInfo = None
         self.lastPointsColumns = None
         self.lastPulses = None
         self.lastPulseRange = None
         self.lastPulsesSpace = None
-        self.lastPulses_Idx = None
-        self.lastPulses_IdxMask = None
+        self.lastPulsesIdxInfo = None
         self.lastPulsesColumns = None
         self.lastWaveSpace = None
         self.lastWave_Idx = None
@@ -718,22 +990,107 @@ spatial index will be recomputed on the fly"""
         self.pulseDtypes = None
         self.pointDtypes = None
         self.waveFormDtypes = None
+        self.haloPulses = None
+        self.haloPoints = None
+        self.blockCache.clear()
+
+    def readFieldsReusingHalo(self, handle, colNames, selection, halo,
+                    recode=False):
+        """
+        Calls readFieldsAndUnScale() (and recodeClassification() if recode
+        is True). But when there is an overlap between blocks the elements 
+        of selection that were read last time (halo is a tuple of the 
+        h5space.H5Space, data and column names) are copied from the data 
+        read then, rather than being read again.
+        """
+        reuseInfo = None
+        if halo is not None and self.controls.overlap > 0:
+            lastSpace, lastData, lastColNames = halo
+            lastData = self.getHaloColumns(lastData, lastColNames, colNames)
+            if lastData is not None:
+                reuseInfo = h5space.getReuseInfo(selection, lastSpace)
+
+        if reuseInfo is not None:
+            selection, newMask, lastIdx = reuseInfo
+
+        data = self.readFieldsAndUnScale(handle, colNames, selection)
+        if recode:
+            self.recodeClassification(data, generic.RECODE_TO_LAS, colNames)
+
+        if reuseInfo is not None:
+            data = h5space.combineReusedData(data, lastData, newMask, lastIdx)
+        return data
+
+    def setPulsesHalo(self, pulse_space, idxInfo, pulses, colNames):
+        """
+        Internal method. When reading with an overlap, keeps a copy of the 
+        pulses in the trailing bins of the block (those the next blocks 
+        will read again) for readFieldsReusingHalo().
+        """
+        if self.mode != generic.READ or self.controls.overlap == 0:
+            return
+        haloSpace = gridindexutils.getTrailingBinsSpace(idxInfo, 
+                        self.controls.overlap, pulse_space.size)
+        haloData = h5space.getHaloData(pulse_space, pulses, haloSpace)
+        self.haloPulses = (haloSpace, haloData, colNames)
+
+    def setPointsHalo(self, point_space, idxInfo, points, colNames):
+        """
+        Internal method. As setPulsesHalo() but for the points of the
+        pulses in the trailing bins.
+        """
+        if self.mode != generic.READ or self.controls.overlap == 0:
+            return
+        pulse_space, pulseIdxInfo = self.si_handler.getPulsesSpaceForExtent(
+                        self.extent, self.controls.overlap, 
+                        self.extentAlignedWithSpatialIndex)
+        haloPulseSpace = gridindexutils.getTrailingBinsSpace(pulseIdxInfo,
+                        self.controls.overlap, pulse_space.size)
+        haloSpace = gridindexutils.getSubsetSpace(pulse_space, haloPulseSpace,
+                        idxInfo, point_space.size)
+        haloData = h5space.getHaloData(point_space, points, haloSpace)
+        self.haloPoints = (haloSpace, haloData, colNames)
 
     @staticmethod
-    def readFieldAndUnScale(handle, name, selection, unScaled=False):
+    def getHaloColumns(lastData, lastColNames, colNames):
+        """
+        Internal method. Returns the colNames columns of data previously 
+        read with lastColNames, or None if they weren't all read.
+        """
+        names = lastData.dtype.names
+        if isinstance(colNames, str):
+            if names is None:
+                if colNames == lastColNames:
+                    return lastData
+                return None
+            if colNames in names:
+                return lastData[colNames]
+            return None
+
+        if names is None:
+            return None
+        colNames = list(colNames)
+        for name in colNames:
+            if name not in names:
+                return None
+        return lastData[colNames]
+
+    def readFieldAndUnScale(self, handle, name, selection, unScaled=False):
         """
         Given a h5py handle, field name and selection does
         any unscaling if asked (unScaled=False). 
         """
         attrs = handle[name].attrs
-        data = selection.read(handle[name])
+        if self.chunkReader is not None:
+            data = self.chunkReader.read(handle[name], selection)
+        else:
+            data = selection.read(handle[name])
 
         if not unScaled and GAIN_NAME in attrs and OFFSET_NAME in attrs:
             data = (data / attrs[GAIN_NAME]) + attrs[OFFSET_NAME]
         return data
         
-    @staticmethod
-    def readFieldsAndUnScale(handle, colNames, selection):
+    def readFieldsAndUnScale(self, handle, colNames, selection):
         """
         Given a list of column names returns a structured array
         of the data. If colNames is a string, a single un-structred
@@ -749,8 +1106,8 @@ spatial index will be recomputed on the fly"""
             unScaled = colNames.endswith('_U')
             if unScaled:
                 colNames = colNames[:-2]
-            data = SPDV4File.readFieldAndUnScale(handle, colNames, 
-                                selection, unScaled)
+            data = self.readFieldAndUnScale(handle, colNames, selection, 
+                                unScaled)
 
         else:            
             # create a blank structured array to read the data into
@@ -782,12 +1139,46 @@ spatial index will be recomputed on the fly"""
             data = numpy.empty(numRecords, dtypeList)
         
             for name, hdfName, unScaled in zip(colNames, hdfNameList, unScaledList):
-                field = SPDV4File.readFieldAndUnScale(handle, hdfName, 
+                field = self.readFieldAndUnScale(handle, hdfName, 
                                 selection, unScaled)
                 data[str(name)] = field
             
         return data
         
+    @property
+    def lastPulses_Idx(self):
+        """
+        Index that turns the last pulses read into a masked array by bins.
+        Only created when first needed as it is padded to the fullest bin.
+        """
+        if self.lastPulsesIdxInfo is None:
+            return None
+        return self.lastPulsesIdxInfo.getIdxAndMask()[0]
+
+    @property
+    def lastPulses_IdxMask(self):
+        "Mask for the masked array made with lastPulses_Idx"
+        if self.lastPulsesIdxInfo is None:
+            return None
+        return self.lastPulsesIdxInfo.getIdxAndMask()[1]
+
+    @property
+    def lastPoints_Idx(self):
+        """
+        Index that turns the last points read into a masked array by pulse.
+        Only created when first needed as it is padded to the most returns.
+        """
+        if self.lastPointsIdxInfo is None:
+            return None
+        return self.lastPointsIdxInfo.getIdxAndMask()[0]
+
+    @property
+    def lastPoints_IdxMask(self):
+        "Mask for the masked array made with lastPoints_Idx"
+        if self.lastPointsIdxInfo is None:
+            return None
+        return self.lastPointsIdxInfo.getIdxAndMask()[1]
+
     def readPointsForExtent(self, colNames=None):
         """
         Read all the points within the given extent
@@ -810,23 +1201,45 @@ spatial index will be recomputed on the fly"""
                         self.lastPoints.dtype.names is not None and 
                         colNames in self.lastPoints.dtype.names):
                     return self.lastPoints[colNames]
+
+        # otherwise they may have been read for a recent extent
+        location = blockcache.getLocationForExtent(self.extent)
+        cached, exact = self.blockCache.getArrayWithColumns(
+                        generic.ARRAY_TYPE_POINTS, location, colNames)
+        if cached is not None:
+            points, point_space, idxInfo, cachedColNames = cached
+        else:
+            spaceKey = ('POINTSPACE', location)
+            spaceInfo = self.blockCache.get(spaceKey)
+            if spaceInfo is None:
+                spaceInfo = self.si_handler.getPointsSpaceForExtent(
+                                        self.extent, self.controls.overlap, 
+                                        self.extentAlignedWithSpatialIndex)
+                self.blockCache.put(spaceKey, spaceInfo)
+            point_space, idxInfo = spaceInfo
         
-        point_space, idx, mask_idx = (
-                            self.si_handler.getPointsSpaceForExtent(self.extent, 
-                                        self.controls.overlap, 
-                                        self.extentAlignedWithSpatialIndex))
-        
-        points = self.readFieldsAndUnScale(pointsHandle, colNames, point_space)
+            # translates any classifications also
+            points = self.readFieldsReusingHalo(pointsHandle, colNames, 
+                                point_space, self.haloPoints, True)
+            
+            cachedColNames = blockcache.getColumnsKey(colNames)
+            self.blockCache.putArray((generic.ARRAY_TYPE_POINTS, location, 
+                        cachedColNames), 
+                        (points, point_space, idxInfo, cachedColNames))
 
-        # translate any classifications
-        self.recodeClassification(points, generic.RECODE_TO_LAS, colNames)
+        if self.lastExtent is None or self.lastExtent != self.extent:
+            self.lastPulses = None # cache will now be out of date
             
         self.lastExtent = copy.copy(self.extent)
         self.lastPoints = points
         self.lastPointsSpace = point_space
-        self.lastPoints_Idx = idx
-        self.lastPoints_IdxMask = mask_idx
+        self.lastPointsIdxInfo = idxInfo
         self.lastPointsColumns = colNames
+        self.setPointsHalo(point_space, idxInfo, points, cachedColNames)
+        if cached is not None and not exact:
+            # cached array has more columns than asked for
+            self.lastPointsColumns = cachedColNames
+            points = self.subsetColumns(points, colNames)
         return points
 
     def readPulsesForExtent(self, colNames=None):
@@ -851,13 +1264,43 @@ spatial index will be recomputed on the fly"""
                         self.lastPulses.dtype.names is not None and 
                         colNames in self.lastPulses.dtype.names):
                     return self.lastPulses[colNames]
-        
-        pulse_space, idx, mask_idx = (
-                            self.si_handler.getPulsesSpaceForExtent(self.extent, 
+
+        # otherwise they may have been read for a recent extent
+        location = blockcache.getLocationForExtent(self.extent)
+        cached, exact = self.blockCache.getArrayWithColumns(
+                        generic.ARRAY_TYPE_PULSES, location, colNames)
+        if cached is not None:
+            pulses, pulse_space, idxInfo, cachedColNames = cached
+            if self.lastExtent is None or self.lastExtent != self.extent:
+                self.lastPoints = None # cache will now be out of date
+
+            self.lastExtent = copy.copy(self.extent)
+            self.lastPulses = pulses
+            self.lastPulsesSpace = pulse_space
+            self.lastPulsesIdxInfo = idxInfo
+            self.lastPulsesColumns = colNames if exact else cachedColNames
+            if self.extentAlignedWithSpatialIndex:
+                self.setPulsesHalo(pulse_space, idxInfo, pulses, 
+                                cachedColNames)
+            if not exact:
+                pulses = self.subsetColumns(pulses, colNames)
+            return pulses
+        
+        spaceKey = ('PULSESPACE', location)
+        spaceInfo = self.blockCache.get(spaceKey)
+        if spaceInfo is None:
+            spaceInfo = self.si_handler.getPulsesSpaceForExtent(self.extent, 
                                     self.controls.overlap, 
-                                    self.extentAlignedWithSpatialIndex))
+                                    self.extentAlignedWithSpatialIndex)
+            self.blockCache.put(spaceKey, spaceInfo)
+        pulse_space, idxInfo = spaceInfo
 
-        pulses = self.readFieldsAndUnScale(pulsesHandle, colNames, pulse_space)
+        if self.extentAlignedWithSpatialIndex:
+            pulses = self.readFieldsReusingHalo(pulsesHandle, colNames, 
+                                pulse_space, self.haloPulses)
+        else:
+            pulses = self.readFieldsAndUnScale(pulsesHandle, colNames, 
+                                pulse_space)
         
         if not self.extentAlignedWithSpatialIndex:
             # need to recompute subset of spatial index to bins
@@ -879,24 +1322,37 @@ spatial index will be recomputed on the fly"""
                     SPDV4_SIMPLEGRID_INDEX_DTYPE, SPDV4_SIMPLEGRID_COUNT_DTYPE)
             # ok calculate indices on new spatial indexes
             nOut = self.fileHandle['DATA']['PULSES']['PULSE_ID'].shape[0]
-            pulse_space, idx, mask_idx = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
+            pulse_space = gridindexutils.convertSPDIdxToReadSpace(
                             new_idx, new_cnt, nOut)
+            idxInfo = gridindexutils.SPDIdxInfo(new_idx, new_cnt)
             # re-sort the pulses to match the new spatial index
             pulses = pulses[mask]
             pulses = pulses[sortedbins]
 
+        cachedColNames = blockcache.getColumnsKey(colNames)
+        self.blockCache.putArray((generic.ARRAY_TYPE_PULSES, location, 
+                        cachedColNames), 
+                        (pulses, pulse_space, idxInfo, cachedColNames))
+
+        if self.lastExtent is None or self.lastExtent != self.extent:
+            self.lastPoints = None # cache will now be out of date
+
         self.lastExtent = copy.copy(self.extent)
         self.lastPulses = pulses
         self.lastPulsesSpace = pulse_space
-        self.lastPulses_Idx = idx
-        self.lastPulses_IdxMask = mask_idx
+        self.lastPulsesIdxInfo = idxInfo
         self.lastPulsesColumns = colNames
-        self.lastPoints = None # cache will now be out of date
+        if self.extentAlignedWithSpatialIndex:
+            # re-sorted otherwise
+            self.setPulsesHalo(pulse_space, idxInfo, pulses, cachedColNames)
         return pulses
     
-    def readPulsesForExtentByBins(self, extent=None, colNames=None):
+    def readPulsesForExtentByBins(self, extent=None, colNames=None, 
+                    ragged=False):
         """
         Return the pulses as a 3d structured masked array.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         # if they have given us a new extent then use that
         if extent is not None:
@@ -905,29 +1361,39 @@ spatial index will be recomputed on the fly"""
         # go and get the pulses - should returned cached if 
         # already got.
         pulses = self.readPulsesForExtent(colNames)
-        # get these 'last' indices which map spatial index to pulses
-        idx = self.lastPulses_Idx
-        idxMask = self.lastPulses_IdxMask 
-        # re-map into 3d
-        pulsesByBins = pulses[idx]
-        
+        # get the info which maps spatial index to pulses
+        idxInfo = self.lastPulsesIdxInfo
+
         # set extent back to the 'normal' one for this block
         # in case they call this again without the extent param
         if extent is not None:
             self.setExtent(oldExtent)
+
+        if ragged:
+            # pulses are already grouped by bin
+            start, count = idxInfo.getRaggedStartAndCount()
+            return gridindexutils.RaggedArray(pulses, start, count)
+
+        idx, idxMask = idxInfo.getIdxAndMask()
+
+        # re-map into 3d
+        pulsesByBins = pulses[idx]
             
         # make masked array
         pulses = numpy.ma.array(pulsesByBins, mask=idxMask)
         return pulses
 
     def readPointsForExtentByBins(self, extent=None, colNames=None, 
-                    indexByPulse=False, returnPulseIndex=False):
+                    indexByPulse=False, returnPulseIndex=False, ragged=False):
         """
         Return the points as a 3d structured masked array.
         
-        Note that because the spatial index on a SPDV4 file currently is on pulses
+        Note that because the spatial index on a SPDV4 file is on pulses
         this may miss points that are attached to pulses outside the current
         extent. If this is a problem then select an overlap large enough.
+        Files created with the POINT_SPATIAL_INDEX option also have an index
+        of the points, which is used when reading (and not indexByPulse) with
+        an extent on its grid, so all the points in each bin are returned.
         
         Pass indexByPulse=True to bin the points by the locations of the pulses
             (using X_IDX and Y_IDX rather than the locations of the points)
@@ -935,12 +1401,25 @@ spatial index will be recomputed on the fly"""
         Pass returnPulseIndex=True to also return a masked 3d array of 
             the indices into the 1d pulse array (as returned by 
             readPulsesForExtent())
+        Pass ragged=True to return gridindexutils.RaggedArray instances
+            instead of masked arrays.
             
         """
         # if they have given us a new extent then use that
         if extent is not None:
             oldExtent = self.lastExtent
             self.setExtent(extent)
+
+        if (not indexByPulse and self.mode == generic.READ and
+                self.si_handler.indexType == SPDV4_INDEX_CARTESIAN and
+                self.si_handler.hasPointIndex() and 
+                self.extentAlignedWithSpatialIndex and
+                self.extent.binSize == self.si_handler.pixelGrid.xRes):
+            points = self.readPointsByBinsFromPointIndex(colNames, ragged)
+            if extent is not None:
+                self.setExtent(oldExtent)
+            return points
+
         # have to spatially index the points 
         # since SPDV4 files have only a spatial index on pulses currently.
         points = self.readPointsForExtent(colNames)
@@ -976,21 +1455,32 @@ spatial index will be recomputed on the fly"""
                 y_idx, x_idx, self.lastExtent.binSize, 
                 yMax, xMin, nrows, ncols, SPDV4_SIMPLEGRID_INDEX_DTYPE, 
                 SPDV4_SIMPLEGRID_COUNT_DTYPE)
-                
-        nOut = len(points)
-        pts_space, pts_idx, pts_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
-                                idx, cnt, nOut)
 
+        nOut = len(points)
         points = points[mask]                  
         sortedPoints = points[sortedbins]
-        
-        pointsByBins = sortedPoints[pts_idx]
 
         # set extent back to the 'normal' one for this block
         # in case they call this again without the extent param
         if extent is not None:
             self.setExtent(oldExtent)
 
+        if ragged:
+            # the sorted points are already grouped by bin
+            points = gridindexutils.RaggedArray(sortedPoints, idx, cnt)
+            if indexByPulse and returnPulseIndex:
+                pulse_idx_1d = numpy.repeat(numpy.arange(0, nreturns.size),
+                                nreturns)
+                pulse_idx_1d = pulse_idx_1d[mask][sortedbins]
+                return points, gridindexutils.RaggedArray(pulse_idx_1d, 
+                                idx, cnt)
+            return points
+                
+        pts_space, pts_idx, pts_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
+                                idx, cnt, nOut)
+        
+        pointsByBins = sortedPoints[pts_idx]
+
         self.lastPoints3d_Idx = pts_idx
         self.lastPoints3d_IdxMask = pts_idx_mask
         self.lastPoints3d_InRegionMask = mask
@@ -1020,20 +1510,58 @@ spatial index will be recomputed on the fly"""
             # just return the points
             return points
         
-    def readPointsByPulse(self, colNames=None):
+    def readPointsByBinsFromPointIndex(self, colNames, ragged):
+        """
+        Internal method. Does readPointsForExtentByBins() for the current
+        extent using the index of the points in the file rather than 
+        binning them.
+        """
+        pointIdx, idx, cnt = self.si_handler.getPointIndexForExtent(
+                                self.extent, self.controls.overlap)
+
+        pointsHandle = self.fileHandle['DATA']['POINTS']
+        if colNames is None:
+            # get all names
+            colNames = pointsHandle.keys()
+
+        # read them in the order they are in the file, then put 
+        # them in the order of the bins. With an overlap the points can 
+        # be spread through the file so read each group that are close 
+        # together separately.
+        sortedIdx = numpy.sort(pointIdx)
+        nOut = pointsHandle['RETURN_NUMBER'].shape[0]
+        spaces = h5space.createSpacesFromIndices(sortedIdx, nOut)
+        points = numpy.concatenate([self.readFieldsAndUnScale(pointsHandle, 
+                        colNames, space) for space in spaces])
+        self.recodeClassification(points, generic.RECODE_TO_LAS, colNames)
+        sortedPoints = points[numpy.searchsorted(sortedIdx, pointIdx)]
+
+        if ragged:
+            return gridindexutils.RaggedArray(sortedPoints, idx, cnt)
+
+        pts_idx, pts_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
+                                idx, cnt)
+        return numpy.ma.array(sortedPoints[pts_idx], mask=pts_idx_mask)
+
+    def readPointsByPulse(self, colNames=None, ragged=False):
         """
         Return a 2d masked structured array of point that matches
         the pulses.
+        
+        Pass ragged=True to return a gridindexutils.RaggedArray instead.
         """
         if self.controls.spatialProcessing:
             points = self.readPointsForExtent(colNames)
         else:
             points = self.readPointsForRange(colNames)
-        idx = self.lastPoints_Idx
-        idxMask = self.lastPoints_IdxMask
 
         if points is None:
-            return None        
+            return None
+        if ragged:
+            start, count = self.lastPointsIdxInfo.getRaggedStartAndCount()
+            return gridindexutils.RaggedArray(points, start, count)
+
+        idx, idxMask = self.lastPointsIdxInfo.getIdxAndMask()
         pointsByPulse = points[idx]
         points = numpy.ma.array(pointsByPulse, mask=idxMask)
         return points
@@ -1284,9 +1812,7 @@ spatial index will be recomputed on the fly"""
                 
                 nreturns = points[firstField].count(axis=0)
                 pointsHandle = self.fileHandle['DATA']['POINTS']
-                currPointsCount = 0
-                if firstField in pointsHandle:
-                    currPointsCount = pointsHandle[firstField].shape[0]
+                currPointsCount = self.getColumnSize(pointsHandle, firstField)
                     
                 # cumsum gives us the end of the points
                 # so need roll to move to the start
@@ -1421,10 +1947,8 @@ spatial index will be recomputed on the fly"""
             flattened =  numpy.empty(transmitted.count(), dtype=transmitted.dtype)
             
             flatten3dWaveformData(transmitted.data, transmitted.mask, ntrans, flattened)
-            currTransCount = 0
-            if 'TRANSMITTED' in self.fileHandle['DATA']:
-                transHandle = self.fileHandle['DATA']['TRANSMITTED']
-                currTransCount = transHandle.shape[0]
+            currTransCount = self.getColumnSize(self.fileHandle['DATA'], 
+                                'TRANSMITTED')
 
             trans_start = numpy.cumsum(ntrans)
             trans_start = numpy.roll(trans_start, 1)
@@ -1479,10 +2003,8 @@ spatial index will be recomputed on the fly"""
             flattened =  numpy.empty(received.count(), dtype=received.dtype)
             
             flatten3dWaveformData(received.data, received.mask, nrecv, flattened)
-            currRecvCount = 0
-            if 'RECEIVED' in self.fileHandle['DATA']:
-                recvHandle = self.fileHandle['DATA']['RECEIVED']
-                currRecvCount = recvHandle.shape[0]
+            currRecvCount = self.getColumnSize(self.fileHandle['DATA'], 
+                                'RECEIVED')
             
             recv_start = numpy.cumsum(nrecv)
             recv_start = numpy.roll(recv_start, 1)
@@ -1503,9 +2025,7 @@ spatial index will be recomputed on the fly"""
         
         nwaveforms = waveformInfo[firstField].count(axis=0)
         waveHandle = self.fileHandle['DATA']['WAVEFORMS']
-        currWaveformsCount = 0
-        if firstField in waveHandle:
-            currWaveformsCount = waveHandle[firstField].shape[0]
+        currWaveformsCount = self.getColumnSize(waveHandle, firstField)
 
         # cumsum gives us the end of the points
         # so need roll to move to the start
@@ -1537,7 +2057,7 @@ spatial index will be recomputed on the fly"""
                     
         return outWave, wfm_start, nwaveforms
         
-    def createDataColumn(self, groupHandle, name, data):
+    def createDataColumn(self, groupHandle, name, data, arrayType):
         """
         Creates a new data column under groupHandle with the
         given name with standard HDF5 params.
@@ -1545,14 +2065,15 @@ spatial index will be recomputed on the fly"""
         The type is the same as the numpy array data and data
         is written to the column
 
-        sets the chunk size to self.hdf5ChunkSize which can be
-        overridden in the driver options.
+        sets the chunk size to self.hdf5ChunkSize and the compression
+        to that for arrayType (one of the ARRAY_TYPE values from .generic),
+        both of which can be overridden in the driver options.
         """
-        # From SPDLib
         dset = groupHandle.create_dataset(name, data.shape, 
-                chunks=self.hdf5ChunkSize, dtype=data.dtype, shuffle=True, 
-                compression="gzip", compression_opts=1, maxshape=(None,))
-        dset[:] = data
+                chunks=self.hdf5ChunkSize, dtype=data.dtype, 
+                maxshape=(None,), **self.compressionArgs[arrayType])
+        if data.size > 0:
+            dset[:] = data
         
     def prepareDataForWriting(self, data, name, arrayType):
         """
@@ -1647,35 +2168,48 @@ spatial index will be recomputed on the fly"""
 
         Only use for file creation.
         """
-        firstField = structArray.dtype.names[0]
-        if firstField in hdfHandle:
-            oldSize = hdfHandle[firstField].shape[0]
-        else:
-            oldSize = 0
-        newSize = oldSize + len(structArray)
-        
         for name in structArray.dtype.names:
             # don't bother writing out the ones we generate ourselves
             if name not in generatedColumns:
                 data, hdfname = self.prepareDataForWriting(
                             structArray[name], name, arrayType)
-                    
-                if hdfname in hdfHandle:
-                    hdfHandle[hdfname].resize((newSize,))
-                    hdfHandle[hdfname][oldSize:newSize+1] = data
-                else:
-                    self.createDataColumn(hdfHandle, hdfname, data)
+                self.appendToColumn(hdfHandle, hdfname, data, arrayType)
                     
         # now write the generated ones
         for name in generatedColumns.keys():
             data, hdfname = self.prepareDataForWriting(
                 generatedColumns[name], name, arrayType)
-                        
-            if hdfname in hdfHandle:
-                hdfHandle[hdfname].resize((newSize,))
-                hdfHandle[hdfname][oldSize:newSize+1] = data
-            else:
-                self.createDataColumn(hdfHandle, hdfname, data)
+            self.appendToColumn(hdfHandle, hdfname, data, arrayType)
+
+    def appendToColumn(self, groupHandle, name, data, arrayType):
+        """
+        Appends data to the column under groupHandle with the given name,
+        creating it if needed. The data goes through a ColumnAppender so 
+        may not be written until later. 
+
+        Only use for file creation.
+        """
+        if name not in groupHandle:
+            self.createDataColumn(groupHandle, name, data[:0], arrayType)
+
+        dset = groupHandle[name]
+        if dset.name not in self.appenders:
+            self.appenders[dset.name] = ColumnAppender(dset,
+                                self.expectedSizes.get(arrayType))
+        self.appenders[dset.name].append(data)
+
+    def getColumnSize(self, groupHandle, name):
+        """
+        Returns the number of elements in the column under groupHandle
+        with the given name, including any not yet written by its 
+        ColumnAppender. 0 if it doesn't exist yet.
+        """
+        if name not in groupHandle:
+            return 0
+        dset = groupHandle[name]
+        if dset.name in self.appenders:
+            return self.appenders[dset.name].size
+        return dset.shape[0]
         
     def writeData(self, pulses=None, points=None, transmitted=None, 
                 received=None, waveformInfo=None):
@@ -1837,6 +2371,16 @@ spatial index will be recomputed on the fly"""
                 
                 self.writeStructuredArray(pointsHandle, points, 
                         generatedColumns, generic.ARRAY_TYPE_POINTS)
+
+                if self.indexPoints and self.hasSpatialIndex():
+                    names = points.dtype.names
+                    if 'X' in names and 'Y' in names:
+                        self.si_handler.setPointsForExtent(points['X'], 
+                                        points['Y'])
+                    else:
+                        # not in any bin
+                        missing = numpy.full(len(points), numpy.nan)
+                        self.si_handler.setPointsForExtent(missing, missing)
                 
             if waveformInfo is not None and len(waveformInfo) > 0:
             
@@ -1850,26 +2394,12 @@ spatial index will be recomputed on the fly"""
                         generatedColumns, generic.ARRAY_TYPE_WAVEFORMS)
                 
             if transmitted is not None and len(transmitted) > 0:
-                if 'TRANSMITTED' in self.fileHandle['DATA']:
-                    tHandle = self.fileHandle['DATA']['TRANSMITTED']
-                    oldSize = tHandle.shape[0]
-                    newSize = oldSize + len(transmitted)
-                    tHandle.resize((newSize,))
-                    tHandle[oldSize:newSize+1] = transmitted
-                else:
-                    self.createDataColumn(self.fileHandle['DATA'], 
-                                'TRANSMITTED', transmitted)
+                self.appendToColumn(self.fileHandle['DATA'], 'TRANSMITTED', 
+                                transmitted, generic.ARRAY_TYPE_WAVEFORMS)
 
             if received is not None and len(received) > 0:
-                if 'RECEIVED' in self.fileHandle['DATA']:
-                    rHandle = self.fileHandle['DATA']['RECEIVED']
-                    oldSize = rHandle.shape[0]
-                    newSize = oldSize + len(received)
-                    rHandle.resize((newSize,))
-                    rHandle[oldSize:newSize+1] = received
-                else:
-                    self.createDataColumn(self.fileHandle['DATA'], 
-                                'RECEIVED', received)
+                self.appendToColumn(self.fileHandle['DATA'], 'RECEIVED', 
+                                received, generic.ARRAY_TYPE_WAVEFORMS)
                 
         else:
             # TODO: should we be re-writing the generated columns??
@@ -1886,7 +2416,8 @@ spatial index will be recomputed on the fly"""
                             # without the copy
                             self.lastPointsSpace.write(pointsHandle[hdfname], data.copy())
                         else:
-                            self.createDataColumn(pointsHandle, hdfname, data)
+                            self.createDataColumn(pointsHandle, hdfname, data,
+                                        generic.ARRAY_TYPE_POINTS)
                     
             if pulses is not None:
                 pulsesHandle = self.fileHandle['DATA']['PULSES']
@@ -1901,7 +2432,8 @@ spatial index will be recomputed on the fly"""
                                 # without the copy
                                 self.lastPulsesSpace.write(pulsesHandle[hdfname], data.copy())
                             else:
-                                self.createDataColumn(pulsesHandle, hdfname, data)
+                                self.createDataColumn(pulsesHandle, hdfname, data,
+                                            generic.ARRAY_TYPE_PULSES)
 
             if waveformInfo is not None:
                 waveHandle = self.fileHandle['DATA']['WAVEFORMS']
@@ -1912,7 +2444,8 @@ spatial index will be recomputed on the fly"""
                         if hdfname in waveHandle:
                             self.lastWaveSpace.write(waveHandle[hdfname], data.copy())
                         else:
-                            self.createDataColumn(waveHandle, hdfname, data)
+                            self.createDataColumn(waveHandle, hdfname, data,
+                                        generic.ARRAY_TYPE_WAVEFORMS)
                                     
             if transmitted is not None:
                 self.lastTransSpace.write(self.fileHandle['DATA']['TRANSMITTED'], 
@@ -2017,41 +2550,65 @@ spatial index will be recomputed on the fly"""
                     colNames in self.lastPoints.dtype.names):
                 return self.lastPoints[colNames]
 
+        location = blockcache.getLocationForRange(self.pulseRange)
         if (self.lastPulseRange is None or 
                     self.lastPulseRange != self.pulseRange or
                     self.lastPointsSpace is None):
             # otherwise we can re-use the self.lastPointsSpace
-            nReturns = self.readPulsesForRange('NUMBER_OF_RETURNS')
-            startIdxs = self.readPulsesForRange('PTS_START_IDX')
-
-            if 'RETURN_NUMBER' not in pointsHandle:
-                # not much else we can do...
-                # means to points were written to the file, 
-                # although there might be pulses
-                # TODO: is this correct?
-                return None
-        
-            nOut = pointsHandle['RETURN_NUMBER'].shape[0]
-            point_space, point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
-                        startIdxs, nReturns, nOut)
+            spaceKey = ('POINTSPACE', location)
+            spaceInfo = self.blockCache.get(spaceKey)
+            if spaceInfo is None:
+                nReturns = self.readPulsesForRange('NUMBER_OF_RETURNS')
+                startIdxs = self.readPulsesForRange('PTS_START_IDX')
+
+                if 'RETURN_NUMBER' not in pointsHandle:
+                    # not much else we can do...
+                    # means to points were written to the file, 
+                    # although there might be pulses
+                    # TODO: is this correct?
+                    return None
+        
+                nOut = pointsHandle['RETURN_NUMBER'].shape[0]
+                spaceInfo = (gridindexutils.convertSPDIdxToReadSpace(
+                        startIdxs, nReturns, nOut), 
+                        gridindexutils.SPDIdxInfo(startIdxs, nReturns))
+                self.blockCache.put(spaceKey, spaceInfo)
+            elif (self.lastPulseRange is None or 
+                    self.lastPulseRange != self.pulseRange):
+                # do what readPulsesForRange() would have
+                self.lastPulseRange = copy.copy(self.pulseRange)
+                self.lastPulses = None
+                self.lastPulsesSpace = None
 
             # keep these indices from pulses to points - handy for the indexing 
             # functions.
-            self.lastPointsSpace = point_space
-            self.lastPoints_Idx = point_idx
-            self.lastPoints_IdxMask = point_idx_mask
+            self.lastPointsSpace, self.lastPointsIdxInfo = spaceInfo
         #    print('new range')
         #else:
         #    print('reuse range')
-        
-        points = self.readFieldsAndUnScale(pointsHandle, colNames, self.lastPointsSpace)
 
-        # translate any classifications
-        self.recodeClassification(points, generic.RECODE_TO_LAS, colNames)
+        cached, exact = self.blockCache.getArrayWithColumns(
+                        generic.ARRAY_TYPE_POINTS, location, colNames)
+        if cached is not None:
+            points, cachedColNames = cached
+        else:
+            points = self.readFieldsAndUnScale(pointsHandle, colNames, 
+                        self.lastPointsSpace)
+
+            # translate any classifications
+            self.recodeClassification(points, generic.RECODE_TO_LAS, colNames)
+            
+            cachedColNames = blockcache.getColumnsKey(colNames)
+            self.blockCache.putArray((generic.ARRAY_TYPE_POINTS, location, 
+                        cachedColNames), (points, cachedColNames))
         
         self.lastPoints = points
         self.lastPointsColumns = colNames
         # self.lastPulseRange copied in readPulsesForRange()
+        if cached is not None and not exact:
+            # cached array has more columns than asked for
+            self.lastPointsColumns = cachedColNames
+            points = self.subsetColumns(points, colNames)
         return points
     
     def readPulsesForRange(self, colNames=None):
@@ -2081,28 +2638,41 @@ spatial index will be recomputed on the fly"""
             space = h5space.createSpaceFromRange(self.pulseRange.startPulse, 
                         self.pulseRange.endPulse, nOut)
 
+            if (self.lastPulseRange is None or 
+                    self.lastPulseRange != self.pulseRange):
+                self.lastPoints = None # now invalid
+                self.lastPointsSpace = None
             self.lastPulsesSpace = space
             self.lastPulseRange = copy.copy(self.pulseRange)
-            self.lastPoints = None # now invalid
-            self.lastPointsSpace = None
 
-        pulses = self.readFieldsAndUnScale(pulsesHandle, colNames, 
-                self.lastPulsesSpace)
+        location = blockcache.getLocationForRange(self.pulseRange)
+        cached, exact = self.blockCache.getArrayWithColumns(
+                        generic.ARRAY_TYPE_PULSES, location, colNames)
+        if cached is not None:
+            pulses, cachedColNames = cached
+        else:
+            pulses = self.readFieldsAndUnScale(pulsesHandle, colNames, 
+                    self.lastPulsesSpace)
+            cachedColNames = blockcache.getColumnsKey(colNames)
+            self.blockCache.putArray((generic.ARRAY_TYPE_PULSES, location, 
+                        cachedColNames), (pulses, cachedColNames))
 
         self.lastPulses = pulses
         self.lastPulsesColumns = colNames
+        if cached is not None and not exact:
+            # cached array has more columns than asked for
+            self.lastPulsesColumns = cachedColNames
+            pulses = self.subsetColumns(pulses, colNames)
         return pulses
 
     def getTotalNumberPulses(self):
         """
         Return the total number of pulses
         """
-        # PULSE_ID is always present.
+        # PULSE_ID is always present. When creating the dataset may be
+        # bigger than what has been written, or not yet have it all.
         pulseHandle = self.fileHandle['DATA']['PULSES']
-        if 'PULSE_ID' in pulseHandle:
-            return pulseHandle['PULSE_ID'].shape[0]
-        else:
-            return 0
+        return self.getColumnSize(pulseHandle, 'PULSE_ID')
         
     def getHeader(self):
         """
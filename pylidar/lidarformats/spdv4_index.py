@@ -23,6 +23,7 @@ import os
 import sys
 import abc
 import copy
+import tempfile
 import numpy
 from rios import pixelgrid
 from . import generic
@@ -42,12 +43,35 @@ SPDV4_INDEX_SCAN = 5
 
 SPDV4_INDEXTYPE_SIMPLEGRID = 0
 "types of spatial indices"
+SPDV4_INDEXTYPE_PYRAMIDGRID = 1
+"types of spatial indices"
 
 SPDV4_SIMPLEGRID_COUNT_DTYPE = numpy.uint32
 "data types for the spatial index"
 SPDV4_SIMPLEGRID_INDEX_DTYPE = numpy.uint64
 "data types for the spatial index"
 
+SPDV4_SIMPLEGRID_CACHE_MARGIN = 16
+"""
+Number of bins around the region of the simple grid spatial index asked 
+for that are also read and kept in memory when reading. The index itself 
+stays on disk.
+"""
+
+SPDV4_POINTGRID_CHUNK_SIZE = 65536
+"HDF5 chunk size of the POINT_IDX dataset of the point index"
+SPDV4_POINTGRID_BAND_SIZE = 4 * 1024 * 1024
+"""
+Approximate number of points sorted at once when writing the point index.
+Rows of bins are sorted together until they have this many points.
+"""
+SPDV4_POINTGRID_RUN_DTYPE = numpy.dtype([('BIN', numpy.uint64), 
+                        ('POINT', numpy.uint64)])
+"""
+Type of the records of the bin and index of each point that are written to 
+a temporary file, sorted by bin for each block, when creating a point index.
+"""
+
 class SPDV4SpatialIndex(object):
     """
     Class that hides the details of different Spatial Indices
@@ -57,6 +81,11 @@ class SPDV4SpatialIndex(object):
     def __init__(self, fileHandle, mode):
         self.fileHandle = fileHandle
         self.mode = mode
+        # keyword arguments to create_dataset() for the compression
+        # of any datasets created. The driver sets this from its
+        # COMPRESSION option.
+        self.compressionArgs = {'shuffle' : True, 'compression' : 'gzip',
+                    'compression_opts' : 1}
         
         # read the pixelgrid info out of the header
         # this is same for all spatial indices on SPD V4
@@ -98,6 +127,17 @@ class SPDV4SpatialIndex(object):
         
         self.fileHandle = None
         
+    def getPixelGridForBinSize(self, binSize):
+        """
+        Returns a PixelGridDefn for the grid that extents of the given bin 
+        size can be read at without the pulses being re-binned, or None 
+        if there isn't one. Indices with a single resolution return 
+        self.pixelGrid if the bin size matches.
+        """
+        if self.pixelGrid is not None and binSize == self.pixelGrid.xRes:
+            return self.pixelGrid
+        return None
+
     @abc.abstractmethod
     def getPulsesSpaceForExtent(self, extent, overlap, extentAlignedWithIndex):
         raise NotImplementedError()
@@ -109,6 +149,14 @@ class SPDV4SpatialIndex(object):
     @abc.abstractmethod
     def createNewIndex(self, pixelGrid):
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def getPulseCountsForExtent(self, extent):
+        """
+        Return a 2d array of the number of pulses in each bin of 
+        the index that covers the given extent.
+        """
+        raise NotImplementedError()
         
     @abc.abstractmethod
     def setPulsesForExtent(self, extent, pulses, lastPulseID, 
@@ -139,6 +187,21 @@ class SPDV4SpatialIndex(object):
         """
         raise NotImplementedError()
 
+    def hasPointIndex(self):
+        """
+        Return True if the file also has an index of the points by
+        their own location. By default no.
+        """
+        return False
+
+    def startPointIndex(self):
+        """
+        When creating, request that an index of the points by their own
+        location is also written.
+        """
+        msg = 'This spatial index type does not support indexing points'
+        raise generic.LiDARFunctionUnsupported(msg)
+
     @staticmethod
     def getClassForType(indexType):
         """
@@ -146,6 +209,8 @@ class SPDV4SpatialIndex(object):
         """
         if indexType == SPDV4_INDEXTYPE_SIMPLEGRID:
             cls = SPDV4SimpleGridSpatialIndex
+        elif indexType == SPDV4_INDEXTYPE_PYRAMIDGRID:
+            cls = SPDV4PyramidGridSpatialIndex
         else:
             msg = 'Unknown indextype %d' % indexType
             raise generic.LiDARInvalidSetting(msg)
@@ -169,7 +234,8 @@ class SPDV4SpatialIndex(object):
         handler = None
 
         # in order of preference
-        availableIndices = [SPDV4_INDEXTYPE_SIMPLEGRID]
+        availableIndices = [SPDV4_INDEXTYPE_SIMPLEGRID, 
+                        SPDV4_INDEXTYPE_PYRAMIDGRID]
 
         cls = SPDV4SpatialIndex.getClassForType(prefType)
         availableIndices.remove(prefType)
@@ -195,38 +261,70 @@ class SPDV4SpatialIndex(object):
         
 SPATIALINDEX_GROUP = 'SPATIALINDEX'
 SIMPLEPULSEGRID_GROUP = 'SIMPLEPULSEGRID'
+PYRAMIDPULSEGRID_GROUP = 'PYRAMIDPULSEGRID'
+SIMPLEPOINTGRID_GROUP = 'SIMPLEPOINTGRID'
         
 class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
     """
-    Implementation of a simple grid index, which is currently
-    the only type used in SPD V4 files.
+    Implementation of a simple grid index. The pulses in each bin are
+    written one after the other, with the bins in row major order within 
+    each block that is written.
     """
+    groupName = SIMPLEPULSEGRID_GROUP
+    "name of the group under SPATIALINDEX_GROUP the index is in"
+
     def __init__(self, fileHandle, mode):
         SPDV4SpatialIndex.__init__(self, fileHandle, mode)
+        # when reading these are the h5py datasets, so only the parts 
+        # that are needed are read. When creating they are numpy arrays.
         self.si_cnt = None
         self.si_idx = None
+        # region of each grid last read from the file - a dictionary keyed
+        # on the name of the counts dataset, of tuples of the row and column 
+        # slices, and the counts and offsets for them.
+        self.regionCache = {}
         self.si_xPulseColName = 'X_IDX'
         self.si_yPulseColName = 'Y_IDX'
         self.indexType = SPDV4_INDEX_CARTESIAN
         # for caching
         self.lastExtent = None
         self.lastPulseSpace = None
-        self.lastPulseIdx = None
-        self.lastPulseIdxMask = None
+        self.lastPulseIdxInfo = None
+        # index of the points by their own location on the same grid. 
+        # When reading these are the h5py datasets if the file has one.
+        self.pt_cnt = None
+        self.pt_idx = None
+        self.pt_order = None
+        # when creating, if a point index is to be created, the 
+        # temporary file the runs of points sorted by bin are written to.
+        # See startPointIndex().
+        self.pointRunFile = None
+        self.pointRunFileName = None
+        # tuples of the start, length and first and last bin of each run
+        self.pointRuns = None
+        # number of points in each row of bins
+        self.pointRowCounts = None
+        # number of points passed to setPointsForExtent() so far
+        self.nPointsIndexed = 0
         
         if mode == generic.READ or mode == generic.UPDATE:
             # read it in if it exists.
             group = None
             if SPATIALINDEX_GROUP in fileHandle:
                 group = fileHandle[SPATIALINDEX_GROUP]
-            if group is not None and SIMPLEPULSEGRID_GROUP in group:
-                group = group[SIMPLEPULSEGRID_GROUP]
+            if group is not None and self.groupName in group:
+                group = group[self.groupName]
+            else:
+                group = None
             
             if group is None:
                 raise generic.LiDARSpatialIndexNotAvailable()
             else:
-                self.si_cnt = group['PLS_PER_BIN'][...]
-                self.si_idx = group['BIN_OFFSETS'][...]
+                self.openIndex(group)
+
+                indexGroup = fileHandle[SPATIALINDEX_GROUP]
+                if SIMPLEPOINTGRID_GROUP in indexGroup:
+                    self.openPointIndex(indexGroup[SIMPLEPOINTGRID_GROUP])
                     
                 # define the pulse data columns to use for the spatial index
                 self.indexType = self.fileHandle.attrs['INDEX_TYPE']
@@ -251,36 +349,279 @@ class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
             else:
                 group = self.fileHandle[SPATIALINDEX_GROUP]
                 
-            if SIMPLEPULSEGRID_GROUP not in group:
-                group = group.create_group(SIMPLEPULSEGRID_GROUP)
+            if self.groupName not in group:
+                group = group.create_group(self.groupName)
             else:
-                group = group[SIMPLEPULSEGRID_GROUP]
-                
-            nrows, ncols = self.pixelGrid.getDimensions()
-            # params adapted from SPDLib
-            countDataset = group.create_dataset('PLS_PER_BIN', 
-                    (nrows, ncols), 
-                    chunks=(1, ncols), dtype=SPDV4_SIMPLEGRID_COUNT_DTYPE,
-                    shuffle=True, compression="gzip", compression_opts=1)
-            if self.si_cnt is not None:
-                countDataset[...] = self.si_cnt
-                    
-            offsetDataset = group.create_dataset('BIN_OFFSETS', 
-                    (nrows, ncols), 
-                    chunks=(1, ncols), dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE,
-                    shuffle=True, compression="gzip", compression_opts=1)
-            if self.si_idx is not None:
-                offsetDataset[...] = self.si_idx
+                group = group[self.groupName]
+
+            self.writeIndex(group)
+
+            if self.pointRuns is not None:
+                group = self.fileHandle[SPATIALINDEX_GROUP].create_group(
+                                SIMPLEPOINTGRID_GROUP)
+                self.writePointIndex(group)
                     
+        self.regionCache = {}
+        self.removePointRunFile()
         SPDV4SpatialIndex.close(self)
         
+    def openIndex(self, group):
+        """
+        Internal method. Sets up reading the index from the given 
+        h5py group.
+        """
+        # don't read these in - could be huge
+        self.si_cnt = group['PLS_PER_BIN']
+        self.si_idx = group['BIN_OFFSETS']
+
+    def writeIndex(self, group):
+        """
+        Internal method. Writes the index into the given h5py group when
+        creating.
+        """
+        self.writeGrid(group, self.si_cnt, self.si_idx)
+
+    def writeGrid(self, group, siCnt, siIdx, countName='PLS_PER_BIN'):
+        """
+        Internal method. Writes a grid of counts and offsets as the 
+        countName and BIN_OFFSETS datasets of the given h5py group.
+        """
+        nrows, ncols = siCnt.shape
+        # params adapted from SPDLib
+        countDataset = group.create_dataset(countName, 
+                (nrows, ncols), 
+                chunks=(1, ncols), dtype=SPDV4_SIMPLEGRID_COUNT_DTYPE,
+                **self.compressionArgs)
+        countDataset[...] = siCnt
+                
+        offsetDataset = group.create_dataset('BIN_OFFSETS', 
+                (nrows, ncols), 
+                chunks=(1, ncols), dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE,
+                **self.compressionArgs)
+        offsetDataset[...] = siIdx
+        
+    def openPointIndex(self, group):
+        """
+        Internal method. Sets up reading the point index from the 
+        given h5py group.
+        """
+        self.pt_cnt = group['PTS_PER_BIN']
+        self.pt_idx = group['BIN_OFFSETS']
+        self.pt_order = group['POINT_IDX']
+
+    def hasPointIndex(self):
+        """
+        Return True if the file has an index of the points by their
+        own location.
+        """
+        return self.pt_cnt is not None
+
+    def startPointIndex(self):
+        """
+        When creating, request that an index of the points by their own
+        location is also written. setPointsForExtent() must then be 
+        called for all the points written.
+
+        So the bins of all the points don't have to be held in memory the 
+        points passed to each call of setPointsForExtent() are sorted by 
+        bin and written to a temporary file (in the same directory as the
+        file being created) as one run. writePointIndex() merges the runs.
+        """
+        dirName = os.path.dirname(os.path.abspath(self.fileHandle.filename))
+        fd, self.pointRunFileName = tempfile.mkstemp(prefix='pointindex', 
+                        suffix='.tmp', dir=dirName)
+        self.pointRunFile = os.fdopen(fd, 'wb')
+        self.pointRuns = []
+        nrows, ncols = self.si_cnt.shape
+        self.pointRowCounts = numpy.zeros((nrows,), dtype=numpy.uint64)
+        self.nPointsIndexed = 0
+
+    def removePointRunFile(self):
+        """
+        Internal method. Closes and removes the temporary file created
+        by startPointIndex() if there is one.
+        """
+        if self.pointRunFile is not None:
+            self.pointRunFile.close()
+        if self.pointRunFileName is not None:
+            os.remove(self.pointRunFileName)
+        self.pointRunFile = None
+        self.pointRunFileName = None
+        self.pointRuns = None
+        self.pointRowCounts = None
+
+    def setPointsForExtent(self, x, y):
+        """
+        When creating, records the bin of the whole index that each of 
+        the points with the given coordinates is in. They are assumed to
+        follow on from the points passed last time, so they must be
+        passed in the order they are written.
+        """
+        if self.pointRuns is None:
+            return
+
+        pixGrid = self.pixelGrid
+        nrows, ncols = self.si_cnt.shape
+        row = numpy.floor((pixGrid.yMax - y) / pixGrid.yRes)
+        col = numpy.floor((x - pixGrid.xMin) / pixGrid.xRes)
+        # points outside the grid aren't indexed
+        valid = numpy.nonzero((row >= 0) & (col >= 0) & (row < nrows) & 
+                        (col < ncols))[0]
+        firstPoint = self.nPointsIndexed
+        self.nPointsIndexed += len(x)
+        if valid.size == 0:
+            return
+
+        row = row[valid].astype(numpy.uint64)
+        bins = row * numpy.uint64(ncols) + col[valid].astype(numpy.uint64)
+        # stable so the points in each bin stay in order
+        order = numpy.argsort(bins, kind='mergesort')
+        run = numpy.empty(valid.shape, dtype=SPDV4_POINTGRID_RUN_DTYPE)
+        run['BIN'] = bins[order]
+        run['POINT'] = valid[order] + firstPoint
+        run.tofile(self.pointRunFile)
+
+        runStart = 0
+        if len(self.pointRuns) > 0:
+            lastStart, lastSize, lastFirstBin, lastLastBin = self.pointRuns[-1]
+            runStart = lastStart + lastSize
+        self.pointRuns.append((runStart, run.size, int(run['BIN'][0]),
+                        int(run['BIN'][-1])))
+
+        minRow = int(row.min())
+        rowCounts = numpy.bincount((row - numpy.uint64(minRow)).astype(
+                        numpy.intp))
+        self.pointRowCounts[minRow:minRow + rowCounts.size] += (
+                        rowCounts.astype(numpy.uint64))
+
+    def writePointIndex(self, group):
+        """
+        Internal method. Writes the index of the points by the bins 
+        recorded by setPointsForExtent() into the given h5py group.
+        POINT_IDX has the indices of the points sorted by bin (and by 
+        index within a bin). PTS_PER_BIN and BIN_OFFSETS are the number 
+        in each bin and where they start in POINT_IDX.
+
+        The runs written by setPointsForExtent() are merged for bands of
+        rows with about SPDV4_POINTGRID_BAND_SIZE points at a time.
+        """
+        nrows, ncols = self.si_cnt.shape
+        self.pointRunFile.close()
+        self.pointRunFile = None
+        nIndexed = int(self.pointRowCounts.sum())
+        countDataset = group.create_dataset('PTS_PER_BIN', (nrows, ncols), 
+                chunks=(1, ncols), dtype=SPDV4_SIMPLEGRID_COUNT_DTYPE,
+                **self.compressionArgs)
+        offsetDataset = group.create_dataset('BIN_OFFSETS', (nrows, ncols), 
+                chunks=(1, ncols), dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE,
+                **self.compressionArgs)
+        chunkSize = min(max(nIndexed, 1), SPDV4_POINTGRID_CHUNK_SIZE)
+        orderDataset = group.create_dataset('POINT_IDX', (nIndexed,),
+                chunks=(chunkSize,), dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE, 
+                **self.compressionArgs)
+
+        runs = None
+        if nIndexed > 0:
+            runs = numpy.memmap(self.pointRunFileName, 
+                        dtype=SPDV4_POINTGRID_RUN_DTYPE, mode='r')
+
+        nWritten = 0
+        startRow = 0
+        while startRow < nrows:
+            # take rows until there are enough points to sort
+            endRow = startRow + 1
+            nBand = int(self.pointRowCounts[startRow])
+            while (endRow < nrows and nBand + int(self.pointRowCounts[endRow])
+                    <= SPDV4_POINTGRID_BAND_SIZE):
+                nBand += int(self.pointRowCounts[endRow])
+                endRow += 1
+
+            firstBin = startRow * ncols
+            endBin = endRow * ncols
+            pieces = []
+            if nBand > 0:
+                for runStart, runSize, runFirstBin, runLastBin in self.pointRuns:
+                    if runLastBin < firstBin or runFirstBin >= endBin:
+                        continue
+                    run = runs[runStart:runStart + runSize]
+                    runBins = run['BIN']
+                    lo = numpy.searchsorted(runBins, numpy.uint64(firstBin))
+                    hi = numpy.searchsorted(runBins, numpy.uint64(endBin))
+                    pieces.append(numpy.array(run[lo:hi]))
+
+            if len(pieces) > 0:
+                band = numpy.concatenate(pieces)
+                # runs are in point order, so stable sort keeps the points 
+                # in each bin in order
+                order = numpy.argsort(band['BIN'], kind='mergesort')
+                counts = numpy.bincount((band['BIN'] - 
+                        numpy.uint64(firstBin)).astype(numpy.intp), 
+                        minlength=endBin - firstBin)
+                orderDataset[nWritten:nWritten + band.size] = (
+                        band['POINT'][order])
+            else:
+                counts = numpy.zeros((endBin - firstBin,), dtype=numpy.intp)
+
+            starts = numpy.cumsum(counts) - counts + nWritten
+            countDataset[startRow:endRow] = counts.reshape(
+                (endRow - startRow, ncols)).astype(SPDV4_SIMPLEGRID_COUNT_DTYPE)
+            offsetDataset[startRow:endRow] = starts.reshape(
+                (endRow - startRow, ncols)).astype(SPDV4_SIMPLEGRID_INDEX_DTYPE)
+            nWritten += int(counts.sum())
+            startRow = endRow
+
+        del runs
+        self.removePointRunFile()
+
+    def getPointIndexForExtent(self, extent, overlap):
+        """
+        Reads the point index for the given extent, which must be aligned
+        with the index. Returns the indices of the points in each bin 
+        sorted by bin, followed by the offsets into them and counts for 
+        each bin (including the overlap) as for the pulse index.
+        """
+        pixGrid = self.pixelGrid
+        nrows = int(numpy.round((extent.yMax - extent.yMin) / pixGrid.yRes))
+        ncols = int(numpy.round((extent.xMax - extent.xMin) / pixGrid.xRes))
+        nrows += (overlap * 2)
+        ncols += (overlap * 2)
+
+        cnt_subset = numpy.zeros((nrows, ncols), dtype=SPDV4_SIMPLEGRID_COUNT_DTYPE)
+        idx_subset = numpy.zeros((nrows, ncols), dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE)
+
+        imageSlice, siSlice = gridindexutils.getSlicesForExtent(pixGrid, 
+             self.pt_cnt.shape, overlap, extent.xMin, extent.xMax, 
+             extent.yMin, extent.yMax)
+
+        pointIdx = numpy.empty((0,), dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE)
+        if imageSlice is not None and siSlice is not None:
+            cnt = self.pt_cnt[siSlice]
+            idx = self.pt_idx[siSlice]
+            cnt_subset[imageSlice] = cnt
+            idx_subset[imageSlice] = idx
+
+            # the bins in each row are one run of POINT_IDX
+            if cnt.size > 0:
+                rowStarts = idx[:, 0]
+                rowEnds = idx[:, -1] + cnt[:, -1]
+                runs = [self.pt_order[start:end] for start, end 
+                            in zip(rowStarts, rowEnds) if end > start]
+                if len(runs) > 0:
+                    pointIdx = numpy.concatenate(runs)
+
+        # offsets into pointIdx
+        idx_subset = (numpy.cumsum(cnt_subset, dtype=numpy.uint64).reshape(
+                cnt_subset.shape) - cnt_subset).astype(SPDV4_SIMPLEGRID_INDEX_DTYPE)
+        return pointIdx, idx_subset, cnt_subset
+
     def getSISubset(self, extent, overlap, extentAlignedWithIndex):
         """
         Internal method. Reads the required block out of the spatial
         index for the requested extent.
         """
+        pixGrid, siCnt, siIdx = self.getGridForExtent(extent)
+
         # snap the extent to the grid of the spatial index
-        pixGrid = self.pixelGrid
         if extentAlignedWithIndex:
             xMin = extent.xMin
             xMax = extent.xMax
@@ -299,8 +640,8 @@ class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
         # size of spatial index we need to read
         # round() ok since points should already be on the grid, nasty 
         # rounding errors propogated with ceil()                                    
-        nrows = int(numpy.round((yMax - yMin) / self.pixelGrid.yRes))
-        ncols = int(numpy.round((xMax - xMin) / self.pixelGrid.xRes))
+        nrows = int(numpy.round((yMax - yMin) / pixGrid.yRes))
+        ncols = int(numpy.round((xMax - xMin) / pixGrid.xRes))
         # add overlap 
         nrows += (overlap * 2)
         ncols += (overlap * 2)
@@ -310,44 +651,104 @@ class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
         idx_subset = numpy.zeros((nrows, ncols), dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE)
         
         imageSlice, siSlice = gridindexutils.getSlicesForExtent(pixGrid, 
-             self.si_cnt.shape, overlap, xMin, xMax, yMin, yMax)
+             siCnt.shape, overlap, xMin, xMax, yMin, yMax)
              
         if imageSlice is not None and siSlice is not None:
 
-            cnt_subset[imageSlice] = self.si_cnt[siSlice]
-            idx_subset[imageSlice] = self.si_idx[siSlice]
+            cnt, idx = self.readSIRegion(siSlice, siCnt, siIdx)
+            cnt_subset[imageSlice] = cnt
+            idx_subset[imageSlice] = idx
 
         return idx_subset, cnt_subset
 
+    def getGridForExtent(self, extent):
+        """
+        Internal method. Returns the PixelGridDefn and the counts and 
+        offsets (h5py datasets when reading, numpy arrays when creating) 
+        of the grid to use when reading extent. Always the one grid
+        for this index.
+        """
+        return self.pixelGrid, self.si_cnt, self.si_idx
+
+    def readSIRegion(self, siSlice, siCnt, siIdx):
+        """
+        Internal method. Returns the counts and offsets in siCnt and siIdx
+        (as returned by getGridForExtent()) for the given tuple of row and 
+        column slices.
+
+        When reading from file the region is read with a margin of 
+        SPDV4_SIMPLEGRID_CACHE_MARGIN bins on each side and kept (one 
+        region per grid), so requests for much the same area (eg with a 
+        different overlap, or not aligned with the index) are read from 
+        memory.
+        """
+        if isinstance(siCnt, numpy.ndarray):
+            # creating
+            return siCnt[siSlice], siIdx[siSlice]
+
+        rowSlice, colSlice = siSlice
+        cached = self.regionCache.get(siCnt.name)
+        if (cached is None or rowSlice.start < cached[0].start or 
+                rowSlice.stop > cached[0].stop or 
+                colSlice.start < cached[1].start or 
+                colSlice.stop > cached[1].stop):
+            nrows, ncols = siCnt.shape
+            margin = SPDV4_SIMPLEGRID_CACHE_MARGIN
+            cacheRows = slice(max(rowSlice.start - margin, 0), 
+                            min(rowSlice.stop + margin, nrows))
+            cacheCols = slice(max(colSlice.start - margin, 0), 
+                            min(colSlice.stop + margin, ncols))
+            cached = (cacheRows, cacheCols, siCnt[cacheRows, cacheCols],
+                            siIdx[cacheRows, cacheCols])
+            self.regionCache[siCnt.name] = cached
+
+        cacheRows, cacheCols, cacheCnt, cacheIdx = cached
+        subset = (slice(rowSlice.start - cacheRows.start, 
+                        rowSlice.stop - cacheRows.start),
+                slice(colSlice.start - cacheCols.start,
+                        colSlice.stop - cacheCols.start))
+        return cacheCnt[subset], cacheIdx[subset]
+
+    def getPulseCountsForExtent(self, extent):
+        """
+        Return a 2d array of the number of pulses in each bin of 
+        the index that covers the given extent. Bins outside the
+        index are zero.
+        """
+        idx_subset, cnt_subset = self.getSISubset(extent, 0, False)
+        return cnt_subset
+
     def getPulsesSpaceForExtent(self, extent, overlap, extentAlignedWithIndex):
         """
-        Get the space and indexes for pulses of the given extent.
+        Get the space (h5space.H5Space) and index information 
+        (gridindexutils.SPDIdxInfo) for pulses of the given extent.
         """
         # return cache
         if self.lastExtent is not None and self.lastExtent == extent:
-            return self.lastPulseSpace, self.lastPulseIdx, self.lastPulseIdxMask
+            return self.lastPulseSpace, self.lastPulseIdxInfo
         
         idx_subset, cnt_subset = self.getSISubset(extent, overlap,
                 extentAlignedWithIndex)
         nOut = self.fileHandle['DATA']['PULSES']['PULSE_ID'].shape[0]
-        pulse_space, pulse_idx, pulse_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
+        pulse_space = gridindexutils.convertSPDIdxToReadSpace(
                 idx_subset, cnt_subset, nOut)
+        pulse_idx_info = gridindexutils.SPDIdxInfo(idx_subset, cnt_subset)
                 
         self.lastPulseSpace = pulse_space
-        self.lastPulseIdx = pulse_idx
-        self.lastPulseIdxMask = pulse_idx_mask
+        self.lastPulseIdxInfo = pulse_idx_info
         self.lastExtent = copy.copy(extent)
                 
-        return pulse_space, pulse_idx, pulse_idx_mask
+        return pulse_space, pulse_idx_info
 
     def getPointsSpaceForExtent(self, extent, overlap, extentAlignedWithIndex):
         """
-        Get the space and indexes for points of the given extent.
+        Get the space (h5space.H5Space) and index information 
+        (gridindexutils.SPDIdxInfo) for points of the given extent.
         """
         # TODO: cache
     
         # should return cached if exists
-        pulse_space, pulse_idx, pulse_idx_mask = self.getPulsesSpaceForExtent(
+        pulse_space, pulse_idx_info = self.getPulsesSpaceForExtent(
                                     extent, overlap, extentAlignedWithIndex)
         
         pulsesHandle = self.fileHandle['DATA']['PULSES']
@@ -355,10 +756,10 @@ class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
         startIdxs = pulse_space.read(pulsesHandle['PTS_START_IDX'])
 
         nOut = self.fileHandle['DATA']['POINTS']['RETURN_NUMBER'].shape[0]
-        point_space, point_idx, point_idx_mask = gridindexutils.convertSPDIdxToReadIdxAndMaskInfo(
-                        startIdxs, nReturns, nOut)
+        point_space = gridindexutils.convertSPDIdxToReadSpace(startIdxs, 
+                        nReturns, nOut)
 
-        return point_space, point_idx, point_idx_mask
+        return point_space, gridindexutils.SPDIdxInfo(startIdxs, nReturns)
 
     def createNewIndex(self, pixelGrid):
         """
@@ -408,6 +809,9 @@ class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
                 nrows, ncols, SPDV4_SIMPLEGRID_INDEX_DTYPE, 
                 SPDV4_SIMPLEGRID_COUNT_DTYPE)
                 
+        sortedBins, idx_subset = self.orderPulses(sortedBins, idx_subset, 
+                cnt_subset, xMin, yMax)
+
         # so we have unique indexes
         idx_subset = idx_subset + lastPulseID
                    
@@ -430,6 +834,15 @@ class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
         # and the bin index to sort points, waveforms, etc
         return pulses, mask, sortedBins
 
+    def orderPulses(self, sortedBins, idx_subset, cnt_subset, xMin, yMax):
+        """
+        Internal method. Given the sortedBins and spatial index returned 
+        by gridindexutils.CreateSpatialIndex() for the block with its top 
+        left at (xMin, yMax), returns the order to write the pulses in and 
+        the index for that. The pulses are left in row major order of bin.
+        """
+        return sortedBins, idx_subset
+
     def canUpdateInPlace(self):
         "Data must always be sorted"
         return False
@@ -438,3 +851,174 @@ class SPDV4SimpleGridSpatialIndex(SPDV4SpatialIndex):
         "Requests must always be aligned with index"
         return False
 
+
+SPDV4_PYRAMIDGRID_MAX_LEVELS = 16
+"Maximum number of levels (including the finest) in a pyramid grid index"
+
+class SPDV4PyramidGridSpatialIndex(SPDV4SimpleGridSpatialIndex):
+    """
+    A pyramid of grids. The finest (LEVEL0) is the same as the simple grid
+    index. Each bin of LEVEL<n> covers 2x2 bins of LEVEL<n-1>. 
+
+    Within each block that is written the bins are in Morton (Z) order
+    rather than row major order, so the pulses in any square of 2^n x 2^n
+    bins that is aligned with the grid (and doesn't cross a block) are 
+    written together. This means an extent with a bin size that is a 
+    power of 2 times the index's bin size, that is on the same grid, can 
+    be read straight from the matching level without the pulses being
+    re-binned.
+
+    Levels are only created while all their bins refer to a single run of 
+    pulses. Using a window size that is a power of 2 when creating the
+    file allows levels up to the size of a block.
+    """
+    groupName = PYRAMIDPULSEGRID_GROUP
+    "name of the group under SPATIALINDEX_GROUP the index is in"
+
+    def __init__(self, fileHandle, mode):
+        # list of (PixelGridDefn, counts, offsets) for each level
+        # from the finest when reading
+        self.levels = []
+        SPDV4SimpleGridSpatialIndex.__init__(self, fileHandle, mode)
+
+    def openIndex(self, group):
+        """
+        Internal method. Sets up reading the levels of the index from 
+        the given h5py group.
+        """
+        nLevels = group.attrs['NUMBER_OF_LEVELS']
+        for level in range(nLevels):
+            levelGroup = group['LEVEL%d' % level]
+            siCnt = levelGroup['PLS_PER_BIN']
+            siIdx = levelGroup['BIN_OFFSETS']
+            pixGrid = self.getPixelGridForLevel(level, siCnt.shape)
+            self.levels.append((pixGrid, siCnt, siIdx))
+
+        self.si_cnt = self.levels[0][1]
+        self.si_idx = self.levels[0][2]
+
+    def getPixelGridForLevel(self, level, shape):
+        """
+        Internal method. Returns the PixelGridDefn for the given level
+        which has a grid of the given shape.
+        """
+        res = self.pixelGrid.xRes * (2 ** level)
+        return pixelgrid.PixelGridDefn(projection=self.pixelGrid.projection, 
+                xMin=self.pixelGrid.xMin, xMax=self.pixelGrid.xMin + shape[1] * res,
+                yMin=self.pixelGrid.yMax - shape[0] * res, 
+                yMax=self.pixelGrid.yMax, xRes=res, yRes=res)
+
+    def getPixelGridForBinSize(self, binSize):
+        """
+        Returns the PixelGridDefn for the level with the given bin size
+        or None if there isn't one.
+        """
+        for pixGrid, siCnt, siIdx in self.levels:
+            if pixGrid.xRes == binSize:
+                return pixGrid
+        return SPDV4SimpleGridSpatialIndex.getPixelGridForBinSize(self, 
+                        binSize)
+
+    def getGridForExtent(self, extent):
+        """
+        Internal method. Returns the PixelGridDefn and the counts and 
+        offsets for the level that matches the bin size of the extent
+        and that it is aligned with. Otherwise the finest level.
+        """
+        for pixGrid, siCnt, siIdx in self.levels:
+            if pixGrid.xRes == extent.binSize:
+                extentPixGrid = pixelgrid.PixelGridDefn(xMin=extent.xMin, 
+                    xMax=extent.xMax, yMin=extent.yMin, yMax=extent.yMax,
+                    xRes=extent.binSize, yRes=extent.binSize, 
+                    projection=pixGrid.projection)
+                if extentPixGrid.alignedWith(pixGrid):
+                    return pixGrid, siCnt, siIdx
+                break
+        return self.pixelGrid, self.si_cnt, self.si_idx
+
+    def orderPulses(self, sortedBins, idx_subset, cnt_subset, xMin, yMax):
+        """
+        Internal method. Puts the pulses (sorted by bin in row major order
+        by sortedBins) in Morton order of bin and returns the new order 
+        and spatial index for the block with its top left at (xMin, yMax).
+        """
+        pixGrid = self.pixelGrid
+        rowOff = int(numpy.round((pixGrid.yMax - yMax) / pixGrid.yRes))
+        colOff = int(numpy.round((xMin - pixGrid.xMin) / pixGrid.xRes))
+        nrows, ncols = cnt_subset.shape
+        rows, cols = numpy.mgrid[0:nrows, 0:ncols]
+        # position of each bin along the curve for the whole index
+        # so the squares are aligned with the index. Any bins outside 
+        # (negative) will just stop the coarser levels being built.
+        codes = gridindexutils.getMortonCodes(
+                    numpy.maximum(cols.ravel() + colOff, 0),
+                    numpy.maximum(rows.ravel() + rowOff, 0))
+
+        counts = cnt_subset.ravel()
+        binOrder = numpy.argsort(codes, kind='mergesort')
+        # bin of each of the pulses in the order given by sortedBins
+        pulseBins = numpy.repeat(numpy.arange(counts.size), counts)
+        pulseOrder = numpy.argsort(codes[pulseBins], kind='mergesort')
+
+        orderedCounts = counts[binOrder].astype(SPDV4_SIMPLEGRID_INDEX_DTYPE)
+        starts = numpy.empty(counts.size, dtype=SPDV4_SIMPLEGRID_INDEX_DTYPE)
+        starts[binOrder] = numpy.cumsum(orderedCounts) - orderedCounts
+
+        return sortedBins[pulseOrder], starts.reshape(cnt_subset.shape)
+
+    def writeIndex(self, group):
+        """
+        Internal method. Writes LEVEL0 from the index built while 
+        creating, then as many coarser levels as possible.
+        """
+        siCnt = self.si_cnt
+        siIdx = self.si_idx
+        level = 0
+        while True:
+            levelGroup = group.create_group('LEVEL%d' % level)
+            self.writeGrid(levelGroup, siCnt, siIdx)
+            level += 1
+            if (level == SPDV4_PYRAMIDGRID_MAX_LEVELS or 
+                    (siCnt.shape[0] <= 1 and siCnt.shape[1] <= 1)):
+                break
+            coarser = self.makeCoarserGrid(siCnt, siIdx)
+            if coarser is None:
+                break
+            siCnt, siIdx = coarser
+
+        group.attrs['NUMBER_OF_LEVELS'] = level
+
+    @staticmethod
+    def makeCoarserGrid(siCnt, siIdx):
+        """
+        Internal method. Returns the counts and offsets for a grid where 
+        each bin covers 2x2 bins of the given one. Returns None if the 
+        pulses for any of the new bins are not a single run.
+        """
+        nrows, ncols = siCnt.shape
+        nrows2 = (nrows + 1) // 2
+        ncols2 = (ncols + 1) // 2
+        cnt = numpy.zeros((nrows2 * 2, ncols2 * 2), dtype=numpy.uint64)
+        cnt[:nrows, :ncols] = siCnt
+        start = numpy.zeros_like(cnt)
+        start[:nrows, :ncols] = siIdx
+        end = start + cnt
+        empty = cnt == 0
+        # so empty bins don't affect the min and max
+        start[empty] = numpy.iinfo(numpy.uint64).max
+        end[empty] = 0
+
+        shape = (nrows2, 2, ncols2, 2)
+        cnt2 = cnt.reshape(shape).sum(axis=(1, 3))
+        start2 = start.reshape(shape).min(axis=(1, 3))
+        end2 = end.reshape(shape).max(axis=(1, 3))
+
+        nonEmpty = cnt2 > 0
+        if (cnt2[nonEmpty] != (end2[nonEmpty] - start2[nonEmpty])).any():
+            return None
+
+        start2[~nonEmpty] = 0
+        if cnt2.max() > numpy.iinfo(SPDV4_SIMPLEGRID_COUNT_DTYPE).max:
+            return None
+        return (cnt2.astype(SPDV4_SIMPLEGRID_COUNT_DTYPE), 
+                start2.astype(SPDV4_SIMPLEGRID_INDEX_DTYPE))
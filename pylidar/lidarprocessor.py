@@ -22,13 +22,25 @@ And the doProcessing function itself
 from __future__ import print_function, division
 
 import os
+import copy
+import time
+import threading
+import multiprocessing
+import multiprocessing.util
 import numpy
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
 from rios import imageio
 from rios import pixelgrid
 from rios import cuiprogress
 from . import basedriver
 from . import gdaldriver
+from . import profiling
 from .lidarformats import generic
+from .lidarformats import gridindexutils
 # import modules implementing subclasses here so 
 # we can use the __subclasses__() python feature
 from .lidarformats import spdv3
@@ -99,6 +111,13 @@ to be passed to message handler function set with
 Controls.setMessageHandler
 """
 
+BLOCKORDER_ROWMAJOR = gridindexutils.BLOCKORDER_ROWMAJOR
+"to be passed to Controls.setBlockOrder()"
+BLOCKORDER_MORTON = gridindexutils.BLOCKORDER_MORTON
+"to be passed to Controls.setBlockOrder()"
+BLOCKORDER_HILBERT = gridindexutils.BLOCKORDER_HILBERT
+"to be passed to Controls.setBlockOrder()"
+
 DEFAULT_WINDOW_SIZE = 256 # bins
 "Size of the default window size in bins"
 
@@ -236,6 +255,50 @@ class OtherArgs(object):
     contents happens.
     """
     pass
+
+class Accumulator(object):
+    """
+    Holds a result that is built up over all the blocks, such as a total
+    or histogram for the whole file. Set instances as fields of your 
+    OtherArgs and update the value attribute in place from your function.
+
+    This allows the processing to be split between worker processes (see
+    Controls.setNumWorkers()). Each block processed by a worker starts 
+    with value set to a copy of initial, and the result for each block 
+    is combined into value in the main process, in block order, by 
+    calling merge(value, blockValue) which must return the combined value. 
+    The default merge adds them together, so initial should be the starting
+    point of merge (ie zeros for the default).
+    """
+    def __init__(self, initial, merge=numpy.add):
+        self.initial = initial
+        self.merge = merge
+        self.value = copy.deepcopy(initial)
+
+    def reset(self):
+        """
+        For internal use. Set value back to a copy of initial.
+        """
+        self.value = copy.deepcopy(self.initial)
+
+    def mergeValue(self, blockValue):
+        """
+        For internal use. Combine the value from a worker into value.
+        """
+        self.value = self.merge(self.value, blockValue)
+
+def getAccumulators(otherArgs):
+    """
+    Returns a list of the Accumulator instances that are fields of
+    otherArgs, sorted by field name. Empty list if otherArgs is None.
+    """
+    accumulators = []
+    if otherArgs is not None:
+        for name in sorted(otherArgs.__dict__.keys()):
+            value = getattr(otherArgs, name)
+            if isinstance(value, Accumulator):
+                accumulators.append(value)
+    return accumulators
     
 def defaultMessageFn(message, level):
     """
@@ -267,6 +330,13 @@ class Controls(object):
         self.snapGrid = False
         self.progress = cuiprogress.SilentProgress()
         self.messageHandler = defaultMessageFn
+        self.numWorkers = 1
+        self.prefetchDepth = 0
+        self.writeBehindDepth = 0
+        self.profiler = None
+        self.skipEmptyBlocks = False
+        self.pulseBudget = None
+        self.blockOrder = BLOCKORDER_ROWMAJOR
         
     def setFootprint(self, footprint):
         """
@@ -292,6 +362,9 @@ class Controls(object):
     def setOverlap(self, overlap):
         """
         Sets the overlap between each window. In bins.
+        
+        The SPDV3 and SPDV4 drivers don't read the data that overlaps with
+        the previous block again, so overlaps don't cost much extra I/O.
 
         Note: setting spatial processing to True now deprecated. Consider
         updating your code.
@@ -383,6 +456,137 @@ class Controls(object):
         MESSAGE_* constants).
         """
         self.messageHandler = messageHandler        
+
+    def setNumWorkers(self, numWorkers):
+        """
+        Set the number of worker processes used to run the user function.
+        The default is 1 which processes each block in turn within the
+        current process.
+
+        When greater than 1, blocks are handed out to a pool of worker
+        processes. Each worker opens its own copy of the input files and
+        calls the user function for the blocks it is given. Anything set 
+        on the output files is sent back to this process and written
+        strictly in block order so the outputs are identical to those 
+        from processing with one worker.
+
+        Note that this means the user function must be picklable (ie 
+        defined at the top level of a module) and that any changes it makes 
+        to otherArgs will not be seen by other blocks or by the caller. 
+        Use instances of Accumulator on otherArgs to build up results 
+        over all the blocks.
+        Files opened in UPDATE mode, and non spatial processing of 
+        files that cannot report their total number of pulses, fall
+        back to processing with one worker.
+        """
+        if numWorkers < 1:
+            msg = 'Number of workers must be at least 1'
+            raise generic.LiDARInvalidSetting(msg)
+        self.numWorkers = numWorkers
+
+    def setPrefetch(self, depth):
+        """
+        Set the number of blocks to read ahead in a background thread
+        while the user function is processing the current block. The
+        default of 0 means nothing is read ahead.
+
+        The background thread opens its own copy of each LiDAR file being 
+        read and reads all the columns of the pulses and points for the 
+        upcoming blocks. These are then returned by LidarData.getPulses() and
+        LidarData.getPoints(). Other data (eg getPointsByBins()) is still 
+        read when requested.
+
+        Uses more memory as up to depth extra blocks are held at once.
+        Ignored when processing with more than one worker.
+        """
+        if depth < 0:
+            msg = 'Prefetch depth cannot be negative'
+            raise generic.LiDARInvalidSetting(msg)
+        self.prefetchDepth = depth
+
+    def setWriteBehind(self, depth):
+        """
+        Set the number of blocks of output that can be waiting to be
+        written by a background thread. The default of 0 means output is
+        written as soon as the user function returns for each block.
+
+        When greater than 0, the writes to files being created happen
+        in a single background thread in the same order they would 
+        otherwise. Any other calls on these files (eg getHeader()) wait
+        for the pending writes to finish first. An error during writing is
+        raised in the main thread on the next call and the pending
+        writes are all finished before the files are closed.
+
+        Ignored when processing with more than one worker.
+        """
+        if depth < 0:
+            msg = 'Write behind depth cannot be negative'
+            raise generic.LiDARInvalidSetting(msg)
+        self.writeBehindDepth = depth
+
+    def setProfiler(self, profiler):
+        """
+        Set an instance of profiling.BlockProfiler to record the time
+        spent reading, building indexes, in the user function and writing
+        for each block, along with the number of pulses and points. 
+        Default is None which records nothing.
+        """
+        self.profiler = profiler
+
+    def setSkipEmptyBlocks(self, skip):
+        """
+        When processing spatially, set whether to skip blocks where the
+        spatial indexes of all the LiDAR inputs show there are no pulses 
+        (including the overlap). The user function is not called for these 
+        blocks and nothing is written to the outputs for them, so output 
+        images are left with whatever the format fills unwritten areas with
+        (usually 0). Default is False.
+
+        Only has an effect when all the inputs are LiDAR files whose
+        drivers support LiDARFile.getPulseCountsForExtent() (currently SPDV3
+        and SPDV4). Otherwise every block is processed.
+        """
+        self.skipEmptyBlocks = skip
+
+    def setPulseBudget(self, maxPulses):
+        """
+        When processing spatially, set the largest number of pulses
+        (including the overlap) that a block should contain. Blocks of the 
+        window size (see setWindowSize()) that the spatial indices of the
+        LiDAR inputs show have more pulses than this are split into four,
+        and so on, until they are under the budget or are a single bin.
+        Set a large window size so sparse areas are processed in a few big
+        blocks and dense areas in smaller ones. The blocks are always on the
+        working grid so the outputs are the same as for a fixed window size.
+
+        The default of None uses a fixed window size. As with 
+        setSkipEmptyBlocks() this requires drivers that support 
+        LiDARFile.getPulseCountsForExtent().
+        """
+        if maxPulses is not None and maxPulses < 1:
+            msg = 'Pulse budget must be at least 1'
+            raise generic.LiDARInvalidSetting(msg)
+        self.pulseBudget = maxPulses
+
+    def setBlockOrder(self, blockOrder):
+        """
+        Set the order the blocks are visited in when processing spatially.
+        One of BLOCKORDER_ROWMAJOR (the default - across each row, then
+        down), BLOCKORDER_MORTON or BLOCKORDER_HILBERT. The last two follow
+        a space filling curve so successive blocks are close together,
+        which means they are more likely to share the same chunks of the 
+        input files (particularly with an overlap). Files indexed with 
+        the same order (see gridindex.createGridSpatialIndex()) and a
+        window size matching the block size used for indexing benefit most.
+
+        The outputs are the same whichever order is used, although LiDAR
+        outputs have their pulses and points in the order they were written.
+        """
+        if blockOrder not in (BLOCKORDER_ROWMAJOR, BLOCKORDER_MORTON,
+                    BLOCKORDER_HILBERT):
+            msg = 'Unknown block order %s' % blockOrder
+            raise generic.LiDARInvalidSetting(msg)
+        self.blockOrder = blockOrder
     
 class LidarFile(object):
     """
@@ -396,6 +600,8 @@ class LidarFile(object):
         self.lidarDriver = DEFAULT_LIDARDRIVERNAME
         self.lidarDriverOptions = {}
         self.writeSpatialIndex = True
+        self.pointColumns = None
+        self.pulseColumns = None
         
     def setLiDARDriver(self, driverName):
         """
@@ -418,6 +624,28 @@ class LidarFile(object):
         Ignored for reading.
         """
         self.writeSpatialIndex = writeSpatialIndex
+
+    def setColumns(self, points=None, pulses=None):
+        """
+        Declare the point and pulse columns the user function needs. Each
+        is a list of column names, or None for all columns (the default).
+
+        Once declared, the data for each block is read from the driver 
+        once with just these columns. Calls to LidarData.getPoints() etc 
+        asking for any of them are subset from that read rather than going 
+        back to the file, and calls without colNames return just the 
+        declared columns. Asking for other columns still works but needs
+        another read.
+        """
+        if self.mode == CREATE:
+            msg = 'Only valid for reading or updating'
+            raise generic.LiDARInvalidSetting(msg)
+        if points is not None:
+            points = list(points)
+        if pulses is not None:
+            pulses = list(pulses)
+        self.pointColumns = points
+        self.pulseColumns = pulses
         
     
 class ImageFile(object):
@@ -469,6 +697,40 @@ def doProcessing(userFunc, dataFiles, otherArgs=None, controls=None):
     If controls (an instance of Controls) is not None then these controls
         are used for changing the behaviour of reading and writing.
     """
+    # nothing is yielded when there is a userFunc - it is called
+    # for each block from within generateBlocks()
+    for userContainer in generateBlocks(dataFiles, controls, userFunc, 
+                                otherArgs):
+        pass
+
+def iterBlocks(dataFiles, controls=None):
+    """
+    Generator that is an alternative to doProcessing() for when it is
+    more convenient to loop over the blocks than to pass a function. Yields 
+    the same object that doProcessing() passes to the user function for 
+    each block in turn::
+
+        for data in lidarprocessor.iterBlocks(dataFiles, controls):
+            points = data.input1.getPoints()
+            data.output1.setPoints(points)
+
+    Anything set on the outputs is written when the next block is asked
+    for and the files are closed after the last block. If the loop is left
+    early, call close() on the generator (or let it be garbage collected) 
+    to close the files - the output for the current block is not written.
+
+    Controls.setNumWorkers() is ignored as the blocks are all processed 
+    by the caller.
+    """
+    return generateBlocks(dataFiles, controls)
+
+def generateBlocks(dataFiles, controls=None, userFunc=None, otherArgs=None):
+    """
+    Internal generator that does the work of doProcessing() and iterBlocks().
+    If userFunc is None the DataContainer is yielded for each block, 
+    otherwise userFunc is called for each block (possibly in worker 
+    processes) and nothing is yielded.
+    """
     if controls is None:
         # default values
         controls = Controls()
@@ -507,32 +769,27 @@ To suppress this message call Controls.setSpatialProcessing(False)"""
         workingPixGrid = getWorkingPixGrid(controls, userContainer, 
                                 gridList, driverList)
             
-        # work out where the first block is
-        # controls.windowSize is in bins. Convert to meters
-        windowSizeWorld = controls.windowSize * workingPixGrid.xRes
-        currentExtent = basedriver.Extent(workingPixGrid.xMin, 
-                        workingPixGrid.xMin + windowSizeWorld,
-                        workingPixGrid.yMax - windowSizeWorld,
-                        workingPixGrid.yMax, workingPixGrid.xRes)
-                        
-        # handle the file being smaller than the block size
-        if currentExtent.xMax > workingPixGrid.xMax:
-            currentExtent.xMax = workingPixGrid.xMax
-        if currentExtent.yMin < workingPixGrid.yMin:
-            currentExtent.yMin = workingPixGrid.yMin
-
-        # work out number of pixels of workingPixGrid - allow 
-        # rounding error of up to half a pixel by using round
-        xsize = numpy.round((workingPixGrid.xMax - workingPixGrid.xMin) / 
-                        workingPixGrid.xRes)
-        ysize = numpy.round((workingPixGrid.yMax - workingPixGrid.yMin) /
-                        workingPixGrid.yRes)
-
-        # now work out total blocks - ceil() allows for partial blocks
-        xtotalblocks = int(numpy.ceil(xsize / controls.windowSize))
-        ytotalblocks = int(numpy.ceil(ysize / controls.windowSize))
-        nTotalBlocks = xtotalblocks * ytotalblocks
-        bMoreToDo = currentExtent.yMax > workingPixGrid.yMin
+        # work out the extent of each block in the order they are processed
+        if controls.pulseBudget is not None:
+            blockExtents = getAdaptiveBlockExtents(controls, driverList,
+                                workingPixGrid)
+        else:
+            blockExtents = getBlockExtents(workingPixGrid, controls.windowSize,
+                                controls.blockOrder)
+
+        nTotalBlocks = len(blockExtents)
+        bMoreToDo = nTotalBlocks > 0
+        if bMoreToDo:
+            currentExtent = blockExtents[0]
+
+        # block numbers that the spatial indices say have no data
+        emptyBlocks = set()
+        if controls.skipEmptyBlocks:
+            emptyBlocks = getEmptyBlocks(controls, driverList, blockExtents)
+
+        lastBlockNum = nTotalBlocks - 1
+        while lastBlockNum in emptyBlocks:
+            lastBlockNum -= 1
         
     else:
         windowSizeSq = controls.windowSize * controls.windowSize
@@ -557,85 +814,133 @@ To suppress this message call Controls.setSpatialProcessing(False)"""
     if nTotalBlocks != -1:
         controls.progress.setProgress(0)
 
-    # loop while we haven't fallen off the bottom of the pixelgrid region
-    while bMoreToDo:
-        # update the driver classes with the new extent
+    if (userFunc is not None and 
+            canProcessInWorkers(controls, driverList, nTotalBlocks)):
         if controls.spatialProcessing:
-            for driver in driverList:
-                driver.setExtent(currentExtent)
-            # update info class
-            userContainer.info.setExtent(currentExtent)
-            # last block yet?
-            userContainer.info.lastBlock = nBlocksSoFar == (nTotalBlocks - 1)            
+            blockList = [extent for blockNum, extent in enumerate(blockExtents)
+                            if blockNum not in emptyBlocks]
         else:
-            bMoreToDo = False # assume we have finished
-            for driver in driverList:
-                if (driver.mode != generic.CREATE and 
-                        driver.setPulseRange(currentRange)):
-                    # unless there is actually still more data
-                    bMoreToDo = True
-            # update info class
-            userContainer.info.setRange(currentRange)
-            # last block yet? we may not know how many pulses there are
-            userContainer.info.lastBlock = not bMoreToDo
+            blockList = getBlockRanges(nTotalPulses, windowSizeSq)
+        processBlocksInWorkers(userFunc, dataFiles, otherArgs, controls, 
+                    driverList, blockList, userContainer.info.getPixGrid())
+        bMoreToDo = False
+
+    prefetcher = None
+    if bMoreToDo and controls.prefetchDepth > 0:
+        if controls.spatialProcessing:
+            blockList = [extent for blockNum, extent in enumerate(blockExtents)
+                            if blockNum not in emptyBlocks]
+        else:
+            blockList = generateBlockRanges(windowSizeSq)
+        prefetcher = BlockPrefetcher(dataFiles, controls, blockList)
+        if not prefetcher.hasReaders():
+            # nothing to read ahead
+            prefetcher.close()
+            prefetcher = None
+
+    writer = None
+    if bMoreToDo and controls.writeBehindDepth > 0:
+        writer = startWriteBehind(dataFiles, userContainer, controls, 
+                        driverList)
+
+    profiler = controls.profiler
+    profiling.setActiveProfiler(profiler)
+    try:
+        # loop while we haven't fallen off the bottom of the pixelgrid region
+        while bMoreToDo:
+            # nothing is done for blocks with no data
+            skipBlock = (controls.spatialProcessing and 
+                            nBlocksSoFar in emptyBlocks)
+
+            if profiler is not None and not skipBlock:
+                if controls.spatialProcessing:
+                    profiler.startBlock(nBlocksSoFar, copy.copy(currentExtent))
+                else:
+                    profiler.startBlock(nBlocksSoFar, copy.copy(currentRange))
+
+            # update the driver classes with the new extent
+            if controls.spatialProcessing:
+                if not skipBlock:
+                    with profiling.timer(profiling.READ):
+                        for driver in driverList:
+                            driver.setExtent(currentExtent)
+                    # update info class
+                    userContainer.info.setExtent(currentExtent)
+                    # last block yet?
+                    userContainer.info.lastBlock = nBlocksSoFar == lastBlockNum
+            else:
+                bMoreToDo = False # assume we have finished
+                with profiling.timer(profiling.READ):
+                    for driver in driverList:
+                        if (driver.mode != generic.CREATE and 
+                                driver.setPulseRange(currentRange)):
+                            # unless there is actually still more data
+                            bMoreToDo = True
+                # update info class
+                userContainer.info.setRange(currentRange)
+                # last block yet? we may not know how many pulses there are
+                userContainer.info.lastBlock = not bMoreToDo
         
-        # build the function args which is one thing, unless
-        # there is user data
-        functionArgs = (userContainer,)
-        if not otherArgs is None:
-            functionArgs += (otherArgs, )
+            # build the function args which is one thing, unless
+            # there is user data
+            functionArgs = (userContainer,)
+            if not otherArgs is None:
+                functionArgs += (otherArgs, )
             
-        # call it if we still have data
-        if bMoreToDo:
-            userFunc(*functionArgs)
+            # call it if we still have data
+            if bMoreToDo and not skipBlock:
+                if prefetcher is not None:
+                    with profiling.timer(profiling.READ):
+                        prefetcher.setNextBlockData(userContainer)
+                with profiling.timer(profiling.USER):
+                    if userFunc is None:
+                        yield userContainer
+                    else:
+                        userFunc(*functionArgs)
         
-        # no longer first block. Was set to True in UserInfo constructor
-        userContainer.info.firstBlock = False
+            # no longer first block. Was set to True in UserInfo constructor
+            if not skipBlock:
+                userContainer.info.firstBlock = False
         
-        # write anything out that has been queued for output
-        if bMoreToDo:
-            for name in dataFiles.__dict__.keys():
-                userClass = getattr(userContainer, name)
-                if isinstance(userClass, list):
-                    for userClassItem in userClass:
-                        userClassItem.flush()
-                else:
-                    userClass.flush()
+            # write anything out that has been queued for output
+            if bMoreToDo and not skipBlock:
+                with profiling.timer(profiling.WRITE):
+                    flushUserClasses(dataFiles, userContainer)
+                if profiler is not None:
+                    profiler.endBlock()
 
-        # we have completed another one - this var is used below
-        # for calculating block location
-        nBlocksSoFar += 1
-        
-        if controls.spatialProcessing:
-            # update to read in next block
-            # try going across first
-            xblock = nBlocksSoFar % xtotalblocks
-            yblock = nBlocksSoFar // xtotalblocks
-            currentExtent.xMin = workingPixGrid.xMin + xblock * windowSizeWorld
-            currentExtent.xMax = workingPixGrid.xMin + (xblock+1) * windowSizeWorld
-            currentExtent.yMax = workingPixGrid.yMax - yblock * windowSizeWorld
-            currentExtent.yMin = workingPixGrid.yMax - (yblock+1) * windowSizeWorld
+            # we have completed another one - this var is used below
+            # for calculating block location
+            nBlocksSoFar += 1
         
-            # partial block
-            if currentExtent.xMax > workingPixGrid.xMax:
-                currentExtent.xMax = workingPixGrid.xMax
-        
-            # partial block
-            if currentExtent.yMin < workingPixGrid.yMin:
-                currentExtent.yMin = workingPixGrid.yMin
-            
-            # done?
-            bMoreToDo = (nBlocksSoFar < nTotalBlocks)
-        else:
-            currentRange.startPulse += windowSizeSq
-            currentRange.endPulse += windowSizeSq
-            # done?
-            # bMoreToDo is updated when the pulse range is set (above)
+            if controls.spatialProcessing:
+                # done?
+                bMoreToDo = (nBlocksSoFar < nTotalBlocks)
+                if bMoreToDo:
+                    # update to read in next block
+                    currentExtent = blockExtents[nBlocksSoFar]
+            else:
+                currentRange.startPulse += windowSizeSq
+                currentRange.endPulse += windowSizeSq
+                # done?
+                # bMoreToDo is updated when the pulse range is set (above)
 
-        # progress
-        if nTotalBlocks != -1:
-            percentProgress = int((nBlocksSoFar / nTotalBlocks) * 100)
-            controls.progress.setProgress(percentProgress)
+            # progress
+            if nTotalBlocks != -1:
+                percentProgress = int((nBlocksSoFar / nTotalBlocks) * 100)
+                controls.progress.setProgress(percentProgress)
+    except GeneratorExit:
+        # the caller of iterBlocks() has stopped early.
+        # Still close the files below.
+        pass
+    finally:
+        profiling.setActiveProfiler(None)
+        if prefetcher is not None:
+            prefetcher.close()
+        if writer is not None:
+            # don't raise any error here - if the loop succeeded
+            # it is raised when closing the drivers below
+            writer.stop()
 
     controls.progress.reset()
     
@@ -643,9 +948,729 @@ To suppress this message call Controls.setSpatialProcessing(False)"""
     for driver in driverList:
         driver.close()
 
-def openFiles(dataFiles, userContainer, controls):
+def getFileList(dataFiles):
+    """
+    Returns a flat list of all the LidarFile and ImageFile instances
+    in dataFiles. Same order as getUserClassList().
+    """
+    fileList = []
+    for name in dataFiles.__dict__.keys():
+        inputFiles = getattr(dataFiles, name)
+        if isinstance(inputFiles, list):
+            fileList.extend(inputFiles)
+        else:
+            fileList.append(inputFiles)
+    return fileList
+
+def getUserClassList(dataFiles, userContainer):
+    """
+    Returns a flat list of all the LidarData and ImageData instances
+    in userContainer. Same order as getFileList().
+    """
+    userClassList = []
+    for name in dataFiles.__dict__.keys():
+        userClass = getattr(userContainer, name)
+        if isinstance(userClass, list):
+            userClassList.extend(userClass)
+        else:
+            userClassList.append(userClass)
+    return userClassList
+
+def flushUserClasses(dataFiles, userContainer):
+    """
+    Write out anything that the user function has queued for output
+    on each of the user classes in userContainer
+    """
+    for userClass in getUserClassList(dataFiles, userContainer):
+        userClass.flush()
+
+def getBlockExtents(workingPixGrid, windowSize, 
+                    blockOrder=BLOCKORDER_ROWMAJOR):
+    """
+    Returns a list of basedriver.Extent instances, one for each block
+    of the workingPixGrid, in the order doProcessing visits them 
+    (one of the BLOCKORDER_* constants). windowSize is in bins.
+    """
+    windowSizeWorld = windowSize * workingPixGrid.xRes
+    xsize = numpy.round((workingPixGrid.xMax - workingPixGrid.xMin) / 
+                    workingPixGrid.xRes)
+    ysize = numpy.round((workingPixGrid.yMax - workingPixGrid.yMin) /
+                    workingPixGrid.yRes)
+    xtotalblocks = int(numpy.ceil(xsize / windowSize))
+    ytotalblocks = int(numpy.ceil(ysize / windowSize))
+
+    extentList = []
+    for xblock, yblock in getOrderedBlocks(xtotalblocks, ytotalblocks, 
+                                blockOrder):
+        extent = basedriver.Extent(
+            workingPixGrid.xMin + xblock * windowSizeWorld,
+            workingPixGrid.xMin + (xblock+1) * windowSizeWorld,
+            workingPixGrid.yMax - (yblock+1) * windowSizeWorld,
+            workingPixGrid.yMax - yblock * windowSizeWorld,
+            workingPixGrid.xRes)
+        # partial blocks
+        if extent.xMax > workingPixGrid.xMax:
+            extent.xMax = workingPixGrid.xMax
+        if extent.yMin < workingPixGrid.yMin:
+            extent.yMin = workingPixGrid.yMin
+        extentList.append(extent)
+
+    return extentList
+
+def getOrderedBlocks(xtotalblocks, ytotalblocks, blockOrder):
+    """
+    Returns a list of (xblock, yblock) tuples for a grid of 
+    xtotalblocks by ytotalblocks in the order given by blockOrder 
+    (one of the BLOCKORDER_* constants).
+    """
+    yblocks, xblocks = numpy.mgrid[0:ytotalblocks, 0:xtotalblocks]
+    xblocks = xblocks.flatten()
+    yblocks = yblocks.flatten()
+    order = gridindexutils.getBlockOrder(xblocks, yblocks, blockOrder)
+    return [(int(xblocks[idx]), int(yblocks[idx])) for idx in order]
+
+def getInputLiDARDrivers(driverList):
+    """
+    Returns a list of the drivers in driverList that are LiDAR files
+    being read or updated. Returns None if there are any image inputs.
+    """
+    inputDrivers = []
+    for driver in driverList:
+        if driver.mode == generic.CREATE:
+            continue
+        if not isinstance(driver, generic.LiDARFile):
+            return None
+        inputDrivers.append(driver)
+    return inputDrivers
+
+def getNumPulsesForBlock(controls, inputDrivers, extent):
+    """
+    Returns the total number of pulses the spatial indices of 
+    inputDrivers have within extent, plus the overlap around it.
+    Raises generic.LiDARFunctionUnsupported if a driver can't tell.
+    """
+    overlapWorld = controls.overlap * extent.binSize
+    overlapExtent = basedriver.Extent(extent.xMin - overlapWorld,
+            extent.xMax + overlapWorld, extent.yMin - overlapWorld,
+            extent.yMax + overlapWorld, extent.binSize)
+    nPulses = 0
+    for driver in inputDrivers:
+        nPulses += int(driver.getPulseCountsForExtent(overlapExtent).sum())
+    return nPulses
+
+def getEmptyBlocks(controls, driverList, extentList):
+    """
+    Returns a set of the indices into extentList of the blocks where
+    the spatial indices of all the LiDAR inputs in driverList have no 
+    pulses (including the overlap around the block). Returns an empty set
+    if there are image inputs or any of the LiDAR drivers cannot report
+    the counts from their spatial index.
+    """
+    inputDrivers = getInputLiDARDrivers(driverList)
+    if inputDrivers is None:
+        # images have data everywhere
+        return set()
+
+    emptyBlocks = set()
+    try:
+        for blockNum, extent in enumerate(extentList):
+            if getNumPulsesForBlock(controls, inputDrivers, extent) == 0:
+                emptyBlocks.add(blockNum)
+
+    except generic.LiDARFunctionUnsupported:
+        msg = 'Not all LiDAR inputs can report counts. Processing all blocks.'
+        controls.messageHandler(msg, MESSAGE_WARNING)
+        return set()
+
+    return emptyBlocks
+
+def getAdaptiveBlockExtents(controls, driverList, workingPixGrid):
+    """
+    Returns a list of basedriver.Extent instances for processing 
+    workingPixGrid with Controls.setPulseBudget(). Blocks of 
+    controls.windowSize are visited in controls.blockOrder and any
+    with more than controls.pulseBudget pulses are split into quarters 
+    (top left, top right, bottom left, bottom right) until they fit or are
+    a single bin. Falls back to getBlockExtents() if the inputs can't 
+    report their counts.
+    """
+    inputDrivers = getInputLiDARDrivers(driverList)
+    if inputDrivers is None:
+        msg = 'Pulse budget ignored as there are image inputs.'
+        controls.messageHandler(msg, MESSAGE_WARNING)
+        return getBlockExtents(workingPixGrid, controls.windowSize, 
+                    controls.blockOrder)
+
+    # size of workingPixGrid in bins
+    xsize = int(numpy.round((workingPixGrid.xMax - workingPixGrid.xMin) / 
+                    workingPixGrid.xRes))
+    ysize = int(numpy.round((workingPixGrid.yMax - workingPixGrid.yMin) /
+                    workingPixGrid.yRes))
+
+    def makeExtent(col, row, ncols, nrows):
+        # convert a block in bins to world coords
+        extent = basedriver.Extent(
+            workingPixGrid.xMin + col * workingPixGrid.xRes,
+            workingPixGrid.xMin + (col + ncols) * workingPixGrid.xRes,
+            workingPixGrid.yMax - (row + nrows) * workingPixGrid.xRes,
+            workingPixGrid.yMax - row * workingPixGrid.xRes,
+            workingPixGrid.xRes)
+        # partial blocks
+        if extent.xMax > workingPixGrid.xMax:
+            extent.xMax = workingPixGrid.xMax
+        if extent.yMin < workingPixGrid.yMin:
+            extent.yMin = workingPixGrid.yMin
+        return extent
+
+    windowSize = controls.windowSize
+    xtotalblocks = int(numpy.ceil(xsize / windowSize))
+    ytotalblocks = int(numpy.ceil(ysize / windowSize))
+
+    extentList = []
+    try:
+        for xblock, yblock in getOrderedBlocks(xtotalblocks, ytotalblocks,
+                                    controls.blockOrder):
+            col = xblock * windowSize
+            row = yblock * windowSize
+            # stack of blocks still to check. Pushed in reverse
+            # so they are popped in the order they are processed.
+            blockStack = [(col, row, min(windowSize, xsize - col),
+                            min(windowSize, ysize - row))]
+            while len(blockStack) > 0:
+                bcol, brow, ncols, nrows = blockStack.pop()
+                extent = makeExtent(bcol, brow, ncols, nrows)
+                if ((ncols == 1 and nrows == 1) or 
+                        getNumPulsesForBlock(controls, inputDrivers, 
+                            extent) <= controls.pulseBudget):
+                    extentList.append(extent)
+                else:
+                    leftCols = max(ncols // 2, 1)
+                    topRows = max(nrows // 2, 1)
+                    quarters = [(bcol, brow, leftCols, topRows),
+                        (bcol + leftCols, brow, ncols - leftCols, topRows),
+                        (bcol, brow + topRows, leftCols, nrows - topRows),
+                        (bcol + leftCols, brow + topRows, ncols - leftCols,
+                            nrows - topRows)]
+                    for quarter in reversed(quarters):
+                        if quarter[2] > 0 and quarter[3] > 0:
+                            blockStack.append(quarter)
+
+    except generic.LiDARFunctionUnsupported:
+        msg = 'Not all LiDAR inputs can report counts. Pulse budget ignored.'
+        controls.messageHandler(msg, MESSAGE_WARNING)
+        return getBlockExtents(workingPixGrid, controls.windowSize,
+                    controls.blockOrder)
+
+    return extentList
+
+def getBlockRanges(nTotalPulses, windowSizeSq):
+    """
+    Returns a list of generic.PulseRange instances, one for each block
+    of a non spatial run over nTotalPulses.
+    """
+    rangeList = []
+    for startPulse in range(0, nTotalPulses, windowSizeSq):
+        rangeList.append(generic.PulseRange(startPulse, 
+                                startPulse + windowSizeSq))
+    return rangeList
+
+def generateBlockRanges(windowSizeSq):
+    """
+    Generator that yields generic.PulseRange instances for successive
+    blocks of a non spatial run. Does not stop - the caller needs to
+    check whether the drivers have any data for each range.
+    """
+    startPulse = 0
+    while True:
+        yield generic.PulseRange(startPulse, startPulse + windowSizeSq)
+        startPulse += windowSizeSq
+
+class BlockPrefetcher(object):
+    """
+    Reads the pulses and points of upcoming blocks in a background thread
+    so this is overlapped with the user function processing the current 
+    block. See Controls.setPrefetch().
+
+    The thread has its own copy of each LiDAR file open for reading and
+    visits the blocks in blockList (extents or pulse ranges) in order, 
+    putting the data into a queue that holds at most 
+    controls.prefetchDepth blocks. END_OF_DATA is put in the queue once 
+    there are no more blocks.
+    """
+    END_OF_DATA = 'END_OF_DATA'
+    "put in the queue after the last block"
+
+    def __init__(self, dataFiles, controls, blockList):
+        self.dataFiles = dataFiles
+        self.controls = controls
+        self.queue = queue.Queue(controls.prefetchDepth)
+        self.stopEvent = threading.Event()
+
+        # one entry for each file in getFileList(). None for files
+        # that are not being read ahead.
+        self.fileList = getFileList(dataFiles)
+        self.readers = []
+        for inputFile in self.fileList:
+            reader = None
+            if isinstance(inputFile, LidarFile) and inputFile.mode == READ:
+                reader = generic.getReaderForLiDARFile(inputFile.fname,
+                                    inputFile.mode, controls, inputFile)
+            self.readers.append(reader)
+
+        # set once END_OF_DATA has been taken from the queue
+        self.finished = False
+        self.thread = None
+        if self.hasReaders():
+            self.thread = threading.Thread(target=self.readBlocks, 
+                                    args=(blockList,))
+            self.thread.daemon = True
+            self.thread.start()
+
+    def hasReaders(self):
+        """
+        Returns True if any of the files are being read ahead
+        """
+        return any(reader is not None for reader in self.readers)
+
+    def readBlocks(self, blockList):
+        """
+        Run by the background thread. Reads each block in turn and
+        puts a list of (pulses, points) tuples into the queue - one for
+        each reader, followed by END_OF_DATA. If an exception happens 
+        it is put into the queue instead and the thread exits.
+        """
+        try:
+            for block in blockList:
+                blockData = []
+                bMoreToDo = False
+                for inputFile, reader in zip(self.fileList, self.readers):
+                    pulses = None
+                    points = None
+                    if reader is None:
+                        pass
+                    elif self.controls.spatialProcessing:
+                        reader.setExtent(block)
+                        pulses = reader.readPulsesForExtent(
+                                            inputFile.pulseColumns)
+                        points = reader.readPointsForExtent(
+                                            inputFile.pointColumns)
+                        bMoreToDo = True
+                    elif reader.setPulseRange(block):
+                        pulses = reader.readPulsesForRange(
+                                            inputFile.pulseColumns)
+                        points = reader.readPointsForRange(
+                                            inputFile.pointColumns)
+                        bMoreToDo = True
+                    blockData.append((pulses, points))
+
+                if not bMoreToDo:
+                    break
+                if not self.putItem(blockData):
+                    # close() was called
+                    return
+
+            self.putItem(self.END_OF_DATA)
+
+        except Exception as e:
+            self.putItem(e)
+
+    def putItem(self, item):
+        """
+        Put an item in the queue, waiting for space. Returns False 
+        if close() was called while waiting.
+        """
+        while not self.stopEvent.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def setNextBlockData(self, userContainer):
+        """
+        Wait for the next block to be read and pass the data to 
+        each LidarData instance in userContainer. Re-raises any 
+        exception raised while reading. Once all the blocks that were
+        read ahead have been used, the LidarData instances are told 
+        there is no data so they read from their drivers.
+        """
+        blockData = None
+        if not self.finished:
+            blockData = self.queue.get()
+            if isinstance(blockData, Exception):
+                raise blockData
+            if blockData is self.END_OF_DATA:
+                self.finished = True
+                blockData = None
+
+        # same order as self.readers
+        userClassList = getUserClassList(self.dataFiles, userContainer)
+        if blockData is None:
+            blockData = [(None, None)] * len(userClassList)
+        for userClass, (pulses, points) in zip(userClassList, blockData):
+            if isinstance(userClass, userclasses.LidarData):
+                userClass.setPrefetchedData(pulses, points)
+
+    def close(self):
+        """
+        Stop the background thread and close the files it opened
+        """
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+        for reader in self.readers:
+            if reader is not None:
+                reader.close()
+
+def canProcessInWorkers(controls, driverList, nTotalBlocks):
+    """
+    Returns True if the blocks can be handed out to worker processes
+    as requested by Controls.setNumWorkers().
+    """
+    if controls.numWorkers <= 1 or nTotalBlocks <= 1:
+        return False
+
+    for driver in driverList:
+        if driver.mode == generic.UPDATE:
+            msg = 'Files open in UPDATE mode. Processing with one worker.'
+            controls.messageHandler(msg, MESSAGE_WARNING)
+            return False
+
+    return True
+
+class WorkerOutputDriver(basedriver.Driver):
+    """
+    Stands in for the driver of a file being created while the user 
+    function runs in a worker process. The calls that change the output
+    file are recorded so they can be sent back and replayed on the real
+    driver, in block order.
+    """
+    RECORDED_METHODS = ('writeData', 'setData', 'setHeader', 
+            'setHeaderValue', 'setScaling', 'setNativeDataType', 
+            'setNullValue')
+    "Methods of the real driver that are recorded for replay"
+
+    def __init__(self, fname, mode, controls, userClass):
+        basedriver.Driver.__init__(self, fname, mode, controls, userClass)
+        self.calls = []
+
+    def __getattr__(self, name):
+        # only called for names not found the usual way
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in WorkerOutputDriver.RECORDED_METHODS:
+            def recordCall(*args):
+                self.calls.append((name, args))
+            return recordCall
+
+        msg = '%s() is not available on files being created ' % name
+        msg += 'when processing with more than one worker'
+        raise generic.LiDARFunctionUnsupported(msg)
+
+    def setExtent(self, extent):
+        """
+        The real driver is given the extent when the calls are replayed
+        """
+        pass
+
+    def getTranslationDict(self, arrayType):
+        """
+        Uses the static method on the LiDAR driver class that will
+        actually write the file.
+        """
+        for cls in generic.LiDARFile.__subclasses__():
+            if cls.getDriverName() == self.userClass.lidarDriver:
+                return cls.getTranslationDict(arrayType)
+        msg = 'Cannot find LiDAR driver %s' % self.userClass.lidarDriver
+        raise generic.LiDARFormatDriverNotFound(msg)
+
+    def takeCalls(self):
+        """
+        Return the calls recorded for this block and start again
+        """
+        calls = self.calls
+        self.calls = []
+        return calls
+
+    def close(self):
+        """
+        Nothing to close - the real driver is closed by the main process
+        """
+        pass
+
+# state for each worker process. Set up by initWorker()
+workerState = None
+
+def initWorker(userFunc, dataFiles, otherArgs, controls, pixGrid):
+    """
+    Called at the start of each worker process. Opens the files
+    for this worker.
+    """
+    global workerState
+    userContainer = userclasses.DataContainer(controls)
+    gridList, driverList = openFiles(dataFiles, userContainer, controls,
+                                deferOutputs=True)
+    if pixGrid is not None:
+        userContainer.info.setPixGrid(pixGrid)
+
+    workerState = (userFunc, dataFiles, otherArgs, userContainer, driverList)
+
+    # make sure the files are closed when the worker exits
+    multiprocessing.util.Finalize(None, closeWorkerFiles, args=(driverList,),
+                        exitpriority=10)
+
+def closeWorkerFiles(driverList):
+    """
+    Close the files opened by initWorker()
+    """
+    for driver in driverList:
+        driver.close()
+
+def processBlockInWorker(task):
+    """
+    Runs the user function on one block inside a worker process.
+    task is a tuple of (blockNumber, lastBlock, extent or range).
+    Returns a tuple with a list of the calls recorded on each output 
+    driver, a list of the values of the accumulators on otherArgs and the
+    profiling.BlockStats for the block (None if not profiling).
+    """
+    blockNum, lastBlock, block = task
+    userFunc, dataFiles, otherArgs, userContainer, driverList = workerState
+
+    profiler = userContainer.info.getControls().profiler
+    profiling.setActiveProfiler(profiler)
+    if profiler is not None:
+        profiler.startBlock(blockNum, block)
+
+    bMoreToDo = True
+    if isinstance(block, basedriver.Extent):
+        with profiling.timer(profiling.READ):
+            for driver in driverList:
+                driver.setExtent(block)
+        userContainer.info.setExtent(block)
+    else:
+        bMoreToDo = False
+        with profiling.timer(profiling.READ):
+            for driver in driverList:
+                if (driver.mode != generic.CREATE and 
+                        driver.setPulseRange(block)):
+                    bMoreToDo = True
+        userContainer.info.setRange(block)
+
+    userContainer.info.firstBlock = blockNum == 0
+    userContainer.info.lastBlock = lastBlock
+
+    accumulators = getAccumulators(otherArgs)
+    for accumulator in accumulators:
+        accumulator.reset()
+
+    if bMoreToDo:
+        functionArgs = (userContainer,)
+        if not otherArgs is None:
+            functionArgs += (otherArgs, )
+        with profiling.timer(profiling.USER):
+            userFunc(*functionArgs)
+        flushUserClasses(dataFiles, userContainer)
+
+    driverCalls = [driver.takeCalls() for driver in driverList 
+                if isinstance(driver, WorkerOutputDriver)]
+    accumulatorValues = [accumulator.value for accumulator in accumulators]
+
+    blockStats = None
+    if profiler is not None:
+        profiler.endBlock()
+        blockStats = profiler.blocks.pop()
+    profiling.setActiveProfiler(None)
+
+    return driverCalls, accumulatorValues, blockStats
+
+def processBlocksInWorkers(userFunc, dataFiles, otherArgs, controls, 
+                    driverList, blockList, pixGrid):
+    """
+    Hands out each of the blocks in blockList (extents or pulse ranges)
+    to a pool of controls.numWorkers processes. The results are written 
+    to the output drivers in driverList, and merged into the accumulators
+    on otherArgs, in block order as they come back.
+    """
+    # workers report nothing - progress is updated here
+    workerControls = copy.copy(controls)
+    workerControls.progress = cuiprogress.SilentProgress()
+    workerControls.numWorkers = 1
+
+    outputDrivers = [driver for driver in driverList 
+                        if driver.mode == generic.CREATE]
+
+    nTotalBlocks = len(blockList)
+    taskList = [(blockNum, blockNum == (nTotalBlocks - 1), block) 
+                    for blockNum, block in enumerate(blockList)]
+
+    pool = multiprocessing.Pool(controls.numWorkers, initWorker,
+                (userFunc, dataFiles, otherArgs, workerControls, pixGrid))
+    try:
+        # imap() returns the results in the order of taskList
+        results = pool.imap(processBlockInWorker, taskList)
+        accumulators = getAccumulators(otherArgs)
+        for nBlocksSoFar, (driverCalls, accumulatorValues, 
+                    blockStats) in enumerate(results, 1):
+            block = blockList[nBlocksSoFar - 1]
+            writeStart = time.time()
+            for driver, calls in zip(outputDrivers, driverCalls):
+                if isinstance(block, basedriver.Extent):
+                    driver.setExtent(block)
+                for name, args in calls:
+                    getattr(driver, name)(*args)
+
+            if blockStats is not None:
+                blockStats.times[profiling.WRITE] += time.time() - writeStart
+                controls.profiler.addBlockStats(blockStats)
+
+            for accumulator, value in zip(accumulators, accumulatorValues):
+                accumulator.mergeValue(value)
+
+            percentProgress = int((nBlocksSoFar / nTotalBlocks) * 100)
+            controls.progress.setProgress(percentProgress)
+
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+class BlockWriter(object):
+    """
+    Background thread that performs queued calls on the drivers of files 
+    being created, in the order they were queued. See 
+    Controls.setWriteBehind().
+    """
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self.writeCalls)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def writeCalls(self):
+        """
+        Run by the background thread. Once a call has raised an 
+        exception the remaining calls are skipped.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+
+            func, args = item
+            if self.error is None:
+                try:
+                    func(*args)
+                except Exception as e:
+                    self.error = e
+            self.queue.task_done()
+
+    def checkError(self):
+        """
+        Raise any exception raised by the background thread
+        """
+        if self.error is not None:
+            raise self.error
+
+    def queueCall(self, func, args):
+        """
+        Queue func to be called with args. Waits if the queue is full.
+        """
+        self.checkError()
+        self.queue.put((func, args))
+
+    def wait(self):
+        """
+        Wait for all the queued calls to be done
+        """
+        self.queue.join()
+        self.checkError()
+
+    def stop(self):
+        """
+        Finish the queued calls and stop the background thread
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+class WriteBehindDriver(object):
+    """
+    Wraps the driver of a file being created so the calls that change
+    the file are done by a BlockWriter. All other calls wait for the 
+    BlockWriter to finish what is queued and then go straight to the driver.
+    """
+    QUEUED_METHODS = WorkerOutputDriver.RECORDED_METHODS
+    "Methods of the real driver that are queued"
+
+    def __init__(self, driver, writer):
+        self.driver = driver
+        self.writer = writer
+
+    def __getattr__(self, name):
+        # only called for names not found the usual way
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        attr = getattr(self.driver, name)
+        if name in WriteBehindDriver.QUEUED_METHODS:
+            def queueCall(*args):
+                self.writer.queueCall(attr, args)
+            return queueCall
+        elif callable(attr):
+            def directCall(*args, **kwargs):
+                self.writer.wait()
+                return attr(*args, **kwargs)
+            return directCall
+
+        return attr
+
+    def setExtent(self, extent):
+        """
+        Queue the change of extent. A copy is taken as doProcessing 
+        updates the extent in place.
+        """
+        self.writer.queueCall(self.driver.setExtent, (copy.copy(extent),))
+
+    def close(self):
+        """
+        Wait for the queued calls then close the driver
+        """
+        self.writer.wait()
+        self.driver.close()
+
+def startWriteBehind(dataFiles, userContainer, controls, driverList):
+    """
+    Starts a BlockWriter and replaces the drivers of all the files
+    being created (in driverList and on the user classes) with
+    WriteBehindDriver instances that use it. Returns the BlockWriter.
+    """
+    outputClasses = [userClass for userClass in 
+            getUserClassList(dataFiles, userContainer)
+            if userClass.driver.mode == generic.CREATE]
+
+    # each block does a setExtent() and a write on each output
+    writer = BlockWriter(controls.writeBehindDepth * 2 * 
+                            max(len(outputClasses), 1))
+
+    for userClass in outputClasses:
+        wrapped = WriteBehindDriver(userClass.driver, writer)
+        driverList[driverList.index(userClass.driver)] = wrapped
+        userClass.driver = wrapped
+
+    return writer
+
+def openFiles(dataFiles, userContainer, controls, deferOutputs=False):
     """
     Open all the files required by doProcessing
+
+    If deferOutputs is True, files to be created are not opened but
+    are given a WorkerOutputDriver instead.
     """
     gridList = []
     driverList = []
@@ -660,7 +1685,21 @@ def openFiles(dataFiles, userContainer, controls):
             inputFiles = [inputFiles]
         
         for inputFile in inputFiles:
-            if isinstance(inputFile, LidarFile):
+            if deferOutputs and inputFile.mode == generic.CREATE:
+                driver = WorkerOutputDriver(inputFile.fname, inputFile.mode,
+                                    controls, inputFile)
+                driverList.append(driver)
+
+                if isinstance(inputFile, LidarFile):
+                    userClass = userclasses.LidarData(inputFile.mode, driver)
+                else:
+                    userClass = userclasses.ImageData(inputFile.mode, driver)
+                if hasattr(userContainer, name):
+                    getattr(userContainer, name).append(userClass)
+                else:
+                    setattr(userContainer, name, userClass)
+
+            elif isinstance(inputFile, LidarFile):
                 if inputFile.mode == generic.CREATE:
                     driver = generic.getWriterForLiDARFormat(inputFile.lidarDriver,
                         inputFile.fname, inputFile.mode, controls, inputFile)
@@ -0,0 +1,320 @@
+
+"""
+Records where the time goes when processing each block with
+lidarprocessor.doProcessing(). Create an instance of BlockProfiler
+and pass it to Controls.setProfiler(). After processing, the
+statistics for each block can be written with BlockProfiler.writeJSON()
+or BlockProfiler.writeCSV() and a summary obtained from
+BlockProfiler.getSummary().
+
+The time for each block is split into the following categories:
+
++----------+-----------------------------------------------------------+
+| Category | Time spent                                                |
++==========+===========================================================+
+| read     | Reading data from the drivers (LidarData.get*(),          |
+|          | ImageData.getData() and moving to each block)             |
++----------+-----------------------------------------------------------+
+| index    | Building spatial indexes and the indexes used to create   |
+|          | the masked 2d and 3d arrays (see gridindexutils)          |
++----------+-----------------------------------------------------------+
+| user     | The user function, not counting any of the above          |
++----------+-----------------------------------------------------------+
+| write    | Writing the output for the block (flush())                |
++----------+-----------------------------------------------------------+
+
+Times are exclusive - ie time spent building an index while reading
+is counted as index time, and not as read time as well.
+
+The number of pulses and points read for each block are recorded, along
+with bytesReturned - the total size of the arrays returned to (or passed
+back from) the user function for the block. This is not the memory in
+use: an array returned by several calls (eg getPoints() called twice) 
+is counted each time, and memory used inside the drivers is not counted.
+The summary has the largest of these as maxBytesReturned.
+"""
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+
+import csv
+import json
+import time
+import functools
+import threading
+import numpy
+
+READ = 'read'
+"Time spent reading data from the drivers"
+INDEX = 'index'
+"Time spent building indexes"
+USER = 'user'
+"Time spent in the user function"
+WRITE = 'write'
+"Time spent writing data"
+
+CATEGORIES = (READ, INDEX, USER, WRITE)
+"All the categories, in the order they are reported"
+
+# the profiler that is currently recording and the thread it is
+# recording for. Set by setActiveProfiler().
+activeProfiler = None
+activeThread = None
+
+class BlockStats(object):
+    """
+    The statistics recorded for one block.
+    """
+    def __init__(self, blockNum, block):
+        self.blockNum = blockNum
+        # an Extent or a PulseRange
+        self.block = block
+        self.times = dict([(category, 0.0) for category in CATEGORIES])
+        # largest number of pulses and points read at once
+        # from each file. Keyed on the id of the LidarData.
+        self.pulseCounts = {}
+        self.pointCounts = {}
+        # total size of the arrays returned to and passed back from 
+        # the user function. Not the memory in use.
+        self.bytesReturned = 0
+
+    def asDict(self):
+        """
+        Return the statistics as a dictionary suitable for writing
+        """
+        blockDict = {'block' : self.blockNum}
+        if hasattr(self.block, 'startPulse'):
+            blockDict['startPulse'] = int(self.block.startPulse)
+            blockDict['endPulse'] = int(self.block.endPulse)
+        elif self.block is not None:
+            blockDict['xMin'] = float(self.block.xMin)
+            blockDict['xMax'] = float(self.block.xMax)
+            blockDict['yMin'] = float(self.block.yMin)
+            blockDict['yMax'] = float(self.block.yMax)
+
+        total = 0.0
+        for category in CATEGORIES:
+            blockDict[category] = self.times[category]
+            total += self.times[category]
+        blockDict['total'] = total
+
+        blockDict['nPulses'] = int(sum(self.pulseCounts.values()))
+        blockDict['nPoints'] = int(sum(self.pointCounts.values()))
+        blockDict['bytesReturned'] = int(self.bytesReturned)
+        return blockDict
+
+class BlockProfiler(object):
+    """
+    Records timings and counts for each block processed. Pass an
+    instance to Controls.setProfiler().
+
+    The blocks attribute is a list of BlockStats instances, one for
+    each block in the order they were processed.
+    """
+    def __init__(self):
+        self.blocks = []
+        self.currentBlock = None
+        # each element is a list of [category, startTime, childTime]
+        self.timerStack = []
+
+    def startBlock(self, blockNum, block):
+        """
+        For internal use. Called by the processor at the start of each
+        block. block is the Extent or PulseRange being processed.
+        """
+        self.currentBlock = BlockStats(blockNum, block)
+        self.timerStack = []
+
+    def endBlock(self):
+        """
+        For internal use. Called by the processor at the end of each
+        block.
+        """
+        if self.currentBlock is not None:
+            self.blocks.append(self.currentBlock)
+        self.currentBlock = None
+
+    def addBlockStats(self, blockStats):
+        """
+        For internal use. Adds a BlockStats instance recorded elsewhere
+        (ie by a worker process).
+        """
+        self.blocks.append(blockStats)
+
+    def startTimer(self, category):
+        """
+        Start timing the given category. Calls may be nested - the
+        time spent in the inner category is not counted in the outer one.
+        """
+        self.timerStack.append([category, time.time(), 0.0])
+
+    def stopTimer(self):
+        """
+        Stop the timer most recently started with startTimer()
+        """
+        category, startTime, childTime = self.timerStack.pop()
+        elapsed = time.time() - startTime
+        if self.currentBlock is not None:
+            self.currentBlock.times[category] += (elapsed - childTime)
+        if len(self.timerStack) > 0:
+            self.timerStack[-1][2] += elapsed
+
+    def recordArray(self, key, array, arrayType=None):
+        """
+        Record an array returned from, or passed to, the user function.
+        Its size is added to bytesReturned for the block, so an array 
+        returned more than once is counted each time. If arrayType is
+        'pulses' or 'points' the length is recorded as the number of pulses
+        or points for key (normally the LidarData instance).
+        """
+        if self.currentBlock is None or array is None:
+            return
+
+        nbytes = array.nbytes
+        if isinstance(array, numpy.ma.MaskedArray):
+            nbytes += numpy.ma.getmaskarray(array).nbytes
+        self.currentBlock.bytesReturned += nbytes
+
+        if arrayType == 'pulses':
+            counts = self.currentBlock.pulseCounts
+        elif arrayType == 'points':
+            counts = self.currentBlock.pointCounts
+        else:
+            return
+        counts[id(key)] = max(counts.get(id(key), 0), array.shape[0])
+
+    def getBlockDicts(self):
+        """
+        Return a list of dictionaries (see BlockStats.asDict()),
+        one for each block
+        """
+        return [blockStats.asDict() for blockStats in self.blocks]
+
+    def getSummary(self):
+        """
+        Return a dictionary summarising all the blocks. Contains the
+        total time for each category, the total number of pulses and
+        points, the largest bytesReturned for a block (maxBytesReturned)
+        and the number of pulses per second.
+        """
+        summary = dict([(category, 0.0) for category in CATEGORIES])
+        summary['total'] = 0.0
+        summary['nBlocks'] = len(self.blocks)
+        summary['nPulses'] = 0
+        summary['nPoints'] = 0
+        summary['maxBytesReturned'] = 0
+        for blockDict in self.getBlockDicts():
+            for category in CATEGORIES + ('total',):
+                summary[category] += blockDict[category]
+            summary['nPulses'] += blockDict['nPulses']
+            summary['nPoints'] += blockDict['nPoints']
+            summary['maxBytesReturned'] = max(summary['maxBytesReturned'],
+                                    blockDict['bytesReturned'])
+
+        summary['pulsesPerSecond'] = 0.0
+        if summary['total'] > 0:
+            summary['pulsesPerSecond'] = summary['nPulses'] / summary['total']
+        return summary
+
+    def writeJSON(self, fname):
+        """
+        Write the summary and the statistics for each block to
+        a JSON file
+        """
+        output = {'summary' : self.getSummary(),
+                    'blocks' : self.getBlockDicts()}
+        with open(fname, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    def writeCSV(self, fname):
+        """
+        Write the statistics for each block to a CSV file with
+        one row per block
+        """
+        blockDicts = self.getBlockDicts()
+        fieldNames = ['block', 'xMin', 'xMax', 'yMin', 'yMax', 'startPulse',
+                'endPulse'] + list(CATEGORIES) + ['total', 'nPulses',
+                'nPoints', 'bytesReturned']
+        # only the fields that were used
+        fieldNames = [name for name in fieldNames
+                    if any([name in blockDict for blockDict in blockDicts])]
+
+        with open(fname, 'w') as f:
+            writer = csv.DictWriter(f, fieldNames)
+            writer.writeheader()
+            for blockDict in blockDicts:
+                writer.writerow(blockDict)
+
+def setActiveProfiler(profiler):
+    """
+    For internal use. Set the profiler that timer() and recordArray()
+    record to. Only calls from the current thread are recorded. Pass
+    None to stop recording.
+    """
+    global activeProfiler, activeThread
+    activeProfiler = profiler
+    activeThread = threading.current_thread()
+
+def getActiveProfiler():
+    """
+    Returns the profiler set by setActiveProfiler() or None if there
+    isn't one or this is a different thread.
+    """
+    if activeProfiler is not None and threading.current_thread() is activeThread:
+        return activeProfiler
+    return None
+
+class timer(object):
+    """
+    Context manager that times the code within it as the given category
+    using the active profiler. Does nothing if there is no active profiler.
+    """
+    def __init__(self, category):
+        self.category = category
+        self.profiler = None
+
+    def __enter__(self):
+        self.profiler = getActiveProfiler()
+        if self.profiler is not None:
+            self.profiler.startTimer(self.category)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.profiler is not None:
+            self.profiler.stopTimer()
+        return False
+
+def timed(category):
+    """
+    Decorator that times all calls to the decorated function as
+    the given category. See timer.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def recordArray(key, array, arrayType=None):
+    """
+    Calls BlockProfiler.recordArray() on the active profiler, if any.
+    """
+    profiler = getActiveProfiler()
+    if profiler is not None:
+        profiler.recordArray(key, array, arrayType)
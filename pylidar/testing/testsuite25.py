@@ -0,0 +1,139 @@
+"""
+Simple testsuite that checks the ragged arrays returned by the
+getPointsByBins(), getPulsesByBins() and getPointsByPulse() reads
+match the masked arrays for the SPDV4, SPDV3 and LAS drivers.
+"""
+
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+
+import os
+import numpy
+from . import utils
+from pylidar import lidarprocessor
+from rios import cuiprogress
+
+REQUIRED_FORMATS = ["LAS"]
+
+INPUT_SPDV4 = 'testsuite1_idx.spd'
+INPUT_SPDV3 = 'gpv1wf_14501655e03676013s_20120504_aa2f0_r06cd_p300khz_x14_sub.spdv3'
+INPUT_LAZ = 'apl1dr_x509000ys6945000z56_2009_ba1m6_pbrisba_zip.laz'
+LAS_BIN_SIZE = 2.0
+
+def checkRagged(ragged, masked, name):
+    """
+    Raises an exception if ragged (a RaggedArray) doesn't hold the
+    same data as masked.
+    """
+    if ragged is None or masked is None:
+        if ragged is not None or masked is not None:
+            msg = '%s: only one of ragged and masked is None' % name
+            raise utils.TestingDataMismatch(msg)
+        return
+
+    utils.compareArrays(masked, ragged.toMasked(), name)
+
+def checkPointsInBins(ragged, info, name):
+    """
+    Raises an exception if any of the points in ragged (which must
+    have X and Y columns) aren't within the bin they have been put in.
+    """
+    xBlock, yBlock = info.getBlockCoordArrays()
+    halfBin = info.getExtent().binSize / 2.0
+    row, col = ragged.getBinIndex()
+    # allow for the points that are on the edge of a bin
+    tolerance = halfBin + 1e-6
+    if ((numpy.abs(ragged.data['X'] - xBlock[row, col]) > tolerance).any() or
+            (numpy.abs(ragged.data['Y'] - yBlock[row, col]) > tolerance).any()):
+        msg = '%s: points are not in the bins they are returned in' % name
+        raise utils.TestingDataMismatch(msg)
+
+def checkByBins(data, otherArgs):
+    """
+    Compares the ragged and masked reads of the points and pulses by bins
+    """
+    colNames = ['X', 'Y', 'Z']
+    masked = data.input.getPointsByBins(colNames=colNames)
+    ragged = data.input.getPointsByBins(colNames=colNames, ragged=True)
+    checkRagged(ragged, masked, 'points by bins')
+    checkPointsInBins(ragged, data.info, 'points by bins')
+
+    masked = data.input.getPulsesByBins()
+    ragged = data.input.getPulsesByBins(ragged=True)
+    checkRagged(ragged, masked, 'pulses by bins')
+
+    if otherArgs.indexByPulse:
+        masked, maskedIdx = data.input.getPointsByBins(colNames=colNames,
+                    indexByPulse=True, returnPulseIndex=True)
+        ragged, raggedIdx = data.input.getPointsByBins(colNames=colNames,
+                    indexByPulse=True, returnPulseIndex=True, ragged=True)
+        checkRagged(ragged, masked, 'points by bins indexed by pulse')
+        checkRagged(raggedIdx, maskedIdx, 'pulse index of points by bins')
+
+def checkByPulse(data, otherArgs):
+    """
+    Compares the ragged and masked reads of the points by pulse
+    """
+    masked = data.input.getPointsByPulse()
+    ragged = data.input.getPointsByPulse(ragged=True)
+    checkRagged(ragged, masked, 'points by pulse')
+
+def runCheck(checkFunc, infile, spatial, overlap=0, indexByPulse=False,
+            driverOptions=None):
+    """
+    Runs checkFunc over all of infile
+    """
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.input = lidarprocessor.LidarFile(infile, lidarprocessor.READ)
+    if driverOptions is not None:
+        for key in driverOptions:
+            dataFiles.input.setLiDARDriverOption(key, driverOptions[key])
+
+    otherArgs = lidarprocessor.OtherArgs()
+    otherArgs.indexByPulse = indexByPulse
+
+    controls = lidarprocessor.Controls()
+    progress = cuiprogress.GDALProgressBar()
+    controls.setProgress(progress)
+    controls.setSpatialProcessing(spatial)
+    controls.setOverlap(overlap)
+
+    lidarprocessor.doProcessing(checkFunc, dataFiles, otherArgs=otherArgs,
+            controls=controls)
+
+def run(oldpath, newpath):
+    """
+    Runs the 25th basic test suite. Tests:
+
+    Ragged reads against the masked reads for SPDV4, SPDV3 and LAS
+    Points are returned in the right bin by LAS and SPDV4
+    """
+    inputSPDV4 = os.path.join(oldpath, INPUT_SPDV4)
+    runCheck(checkByBins, inputSPDV4, True, indexByPulse=True)
+    runCheck(checkByBins, inputSPDV4, True, overlap=2, indexByPulse=True)
+    runCheck(checkByPulse, inputSPDV4, False)
+
+    inputSPDV3 = os.path.join(oldpath, INPUT_SPDV3)
+    runCheck(checkByPulse, inputSPDV3, False)
+
+    # the .lax file for this is in the test data too
+    inputLaz = os.path.join(oldpath, INPUT_LAZ)
+    runCheck(checkByBins, inputLaz, True,
+            driverOptions={'BIN_SIZE' : LAS_BIN_SIZE})
+    runCheck(checkByPulse, inputLaz, False)
+    print('Ragged arrays check ok')
@@ -0,0 +1,133 @@
+"""
+Simple testsuite that checks the toolbox.binreduce functions give the
+same results as the numpy.ma functions on the masked arrays.
+"""
+
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+
+import os
+import numpy
+from . import utils
+from pylidar import lidarprocessor
+from pylidar.toolbox import binreduce
+from rios import cuiprogress
+
+INPUT1_SPD = 'testsuite1_idx.spd'
+INPUT2_SPD = 'testsuite2_idx.spd'
+BACKGROUND = -9999.0
+
+# the reducers that can give slightly different answers to numpy
+# because the values are added up in a different order
+INEXACT_REDUCERS = (binreduce.REDUCE_MEAN, binreduce.REDUCE_SUM,
+                binreduce.REDUCE_STD, binreduce.REDUCE_PERCENTILE)
+
+def getMaskedReference(function, stack, count):
+    """
+    Returns what the reducer that the string function maps to should
+    give for stack (a masked array shaped (nPts, nRows, nCols)).
+    count is the number of elements in each bin.
+    """
+    empty = count == 0
+    if function == 'numpy.ma.count':
+        # numpy.ma.count() doesn't like an empty stack
+        return count.astype(numpy.float64)
+    elif stack.shape[0] == 0:
+        ref = numpy.empty(count.shape, dtype=numpy.float64)
+        ref.fill(BACKGROUND)
+    elif function in (binreduce.REDUCE_FIRST, binreduce.REDUCE_LAST):
+        # the masked elements aren't all at the end after numpy.ma.vstack
+        valid = ~numpy.ma.getmaskarray(stack)
+        if function == binreduce.REDUCE_FIRST:
+            level = numpy.argmax(valid, axis=0)
+        else:
+            level = stack.shape[0] - 1 - numpy.argmax(valid[::-1], axis=0)
+        rows, cols = numpy.mgrid[0:count.shape[0], 0:count.shape[1]]
+        ref = stack.data[level, rows, cols]
+    elif function == 'percentile95':
+        values = stack.astype(numpy.float64).filled(numpy.nan)
+        ref = numpy.empty(count.shape, dtype=numpy.float64)
+        ref[~empty] = numpy.nanpercentile(values[:, ~empty], 95, axis=0)
+    else:
+        func = eval(function)
+        ref = numpy.ma.filled(func(stack, axis=0), BACKGROUND)
+
+    ref = numpy.array(ref, dtype=numpy.float64)
+    ref[empty] = BACKGROUND
+    return ref
+
+def checkReducers(data, otherArgs):
+    """
+    Compares the result of each reducer with numpy.ma for the current
+    block, for each input on its own and for both merged.
+    """
+    maskedList = [input.getPointsByBins(colNames='Z')
+                    for input in data.inList]
+    raggedList = [input.getPointsByBins(colNames='Z', ragged=True)
+                    for input in data.inList]
+
+    # one of each on their own, then all merged
+    checkList = [(maskedList[0], raggedList[0]),
+            (numpy.ma.vstack(maskedList), binreduce.mergeRagged(raggedList))]
+
+    for stack, ragged in checkList:
+        for function in otherArgs.functions:
+            reducer, param = binreduce.getReducer(function)
+            out = binreduce.reduceBins(ragged, reducer, param, BACKGROUND)
+            ref = getMaskedReference(function, stack, ragged.count)
+
+            if reducer in INEXACT_REDUCERS:
+                ok = numpy.allclose(out, ref)
+            else:
+                ok = (out == ref).all()
+            if not ok:
+                msg = 'reducer for %s does not match numpy' % function
+                raise utils.TestingDataMismatch(msg)
+
+def run(oldpath, newpath):
+    """
+    Runs the 26th basic test suite. Tests:
+
+    toolbox.binreduce.reduceBins against numpy.ma
+    toolbox.binreduce.mergeRagged against numpy.ma.vstack
+    """
+    input1 = os.path.join(oldpath, INPUT1_SPD)
+    input2 = os.path.join(oldpath, INPUT2_SPD)
+
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.inList = [lidarprocessor.LidarFile(input1, lidarprocessor.READ),
+                    lidarprocessor.LidarFile(input2, lidarprocessor.READ)]
+
+    otherArgs = lidarprocessor.OtherArgs()
+    # the numpy.ma functions that are done with reducers
+    # plus those only binreduce has
+    otherArgs.functions = [function for function in
+                    sorted(binreduce.FUNCTION_REDUCERS.keys())
+                    if function.startswith('numpy.ma.')]
+    otherArgs.functions.extend([binreduce.REDUCE_FIRST,
+                    binreduce.REDUCE_LAST, 'percentile95'])
+
+    controls = lidarprocessor.Controls()
+    progress = cuiprogress.GDALProgressBar()
+    controls.setProgress(progress)
+    controls.setSpatialProcessing(True)
+    controls.setFootprint(lidarprocessor.UNION)
+
+    lidarprocessor.doProcessing(checkReducers, dataFiles, otherArgs=otherArgs,
+            controls=controls)
+    print('Reducers check ok')
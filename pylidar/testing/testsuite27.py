@@ -0,0 +1,135 @@
+"""
+Simple testsuite that checks reading SPDV4 files with a pyramid grid
+spatial index and with a point spatial index gives the same pulses and
+points for each bin as a file with the simple grid index.
+"""
+
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+
+import os
+from . import utils
+from pylidar import lidarprocessor
+from pylidar.lidarformats import generic
+from pylidar.lidarformats import spdv4
+from pylidar.toolbox.indexing.gridindex import createGridSpatialIndex
+from rios import cuiprogress
+
+INPUT_SPD = 'testsuite1.spd'
+INDEXED_SPD = 'testsuite1_idx.spd'
+PYRAMID_SPD = 'testsuite27_pyramid.spd'
+POINTIDX_SPD = 'testsuite27_pointidx.spd'
+BIN_SIZE = 2.0
+# must be a power of 2 so levels are built up to the size of a block
+PYRAMID_WINDOW_SIZE = 64
+# PTS_START_IDX depends on the order the pulses were written in
+PULSE_COLUMNS = ['X_IDX', 'Y_IDX', 'GPS_TIME', 'NUMBER_OF_RETURNS']
+POINT_COLUMNS = ['X', 'Y', 'Z', 'RETURN_NUMBER']
+
+def checkPulsesByBins(data, otherArgs):
+    """
+    Compares the pulses, and the points indexed by pulse, in each bin
+    """
+    oldPulses = data.reference.getPulsesByBins(colNames=PULSE_COLUMNS,
+                    ragged=True)
+    newPulses = data.indexed.getPulsesByBins(colNames=PULSE_COLUMNS,
+                    ragged=True)
+    utils.compareRaggedBins(oldPulses, newPulses, 'pulses by bins')
+
+    oldPoints = data.reference.getPointsByBins(colNames=POINT_COLUMNS,
+                    indexByPulse=True, ragged=True)
+    newPoints = data.indexed.getPointsByBins(colNames=POINT_COLUMNS,
+                    indexByPulse=True, ragged=True)
+    utils.compareRaggedBins(oldPoints, newPoints,
+                    'points by bins indexed by pulse')
+
+def checkPointsByBins(data, otherArgs):
+    """
+    Compares the points in each bin
+    """
+    oldPoints = data.reference.getPointsByBins(colNames=POINT_COLUMNS,
+                    ragged=True)
+    newPoints = data.indexed.getPointsByBins(colNames=POINT_COLUMNS,
+                    ragged=True)
+    utils.compareRaggedBins(oldPoints, newPoints, 'points by bins')
+
+def compareIndexedFiles(checkFunc, referenceFile, indexedFile,
+                binSize=None, windowSize=None):
+    """
+    Runs checkFunc over the 2 files, at the given bin size
+    (or the bin size of the files)
+    """
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.reference = lidarprocessor.LidarFile(referenceFile,
+                    lidarprocessor.READ)
+    dataFiles.indexed = lidarprocessor.LidarFile(indexedFile,
+                    lidarprocessor.READ)
+
+    controls = lidarprocessor.Controls()
+    progress = cuiprogress.GDALProgressBar()
+    controls.setProgress(progress)
+    controls.setMessageHandler(lidarprocessor.silentMessageFn)
+    controls.setSpatialProcessing(True)
+    if binSize is not None:
+        controls.setReferenceResolution(binSize)
+    if windowSize is not None:
+        controls.setWindowSize(windowSize)
+
+    lidarprocessor.doProcessing(checkFunc, dataFiles, controls=controls)
+
+def run(oldpath, newpath):
+    """
+    Runs the 27th basic test suite. Tests:
+
+    Creating a file with a pyramid grid spatial index
+    Reading a pyramid grid spatial index at coarser bin sizes
+    Creating a point spatial index with createGridSpatialIndex
+    Reading points by bins with the point spatial index
+    """
+    indexedSPD = os.path.join(oldpath, INDEXED_SPD)
+
+    # copy the indexed file, building a pyramid and a point index
+    pyramidSPD = os.path.join(newpath, PYRAMID_SPD)
+    controls = lidarprocessor.Controls()
+    controls.setSpatialProcessing(True)
+    controls.setWindowSize(PYRAMID_WINDOW_SIZE)
+    utils.copyLiDARFile(indexedSPD, pyramidSPD,
+            {'SPATIAL_INDEX_TYPE' : spdv4.SPDV4_INDEXTYPE_PYRAMIDGRID,
+            'POINT_SPATIAL_INDEX' : True}, controls)
+
+    # the finest level and 2 coarser ones
+    for binSize in (BIN_SIZE, BIN_SIZE * 2, BIN_SIZE * 4):
+        compareIndexedFiles(checkPulsesByBins, indexedSPD, pyramidSPD,
+                binSize=binSize, windowSize=PYRAMID_WINDOW_SIZE)
+
+    # create a point index the usual way. The pulses should be the same
+    # as those in the file without one
+    inputSPD = os.path.join(oldpath, INPUT_SPD)
+    pointIdxSPD = os.path.join(newpath, POINTIDX_SPD)
+    createGridSpatialIndex(inputSPD, pointIdxSPD, binSize=BIN_SIZE,
+            tempDir=newpath, indexPoints=True)
+    utils.compareLiDARFiles(indexedSPD, pointIdxSPD)
+
+    # without the point index the points are only found from the pulses
+    # in the block, so read the whole file in one block to get them all
+    header = generic.getLidarFileInfo(indexedSPD).header
+    windowSize = max(header['NUMBER_BINS_X'], header['NUMBER_BINS_Y'])
+    for indexed in (pyramidSPD, pointIdxSPD):
+        compareIndexedFiles(checkPointsByBins, indexedSPD, indexed,
+                windowSize=windowSize)
+    print('Spatial indexes check ok')
@@ -0,0 +1,115 @@
+"""
+Simple testsuite that checks SPDV4 files written with different
+COMPRESSION options, and read with the chunk cache and direct chunk
+decompression options, give the same data as with the defaults.
+"""
+
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+
+import os
+from . import utils
+from pylidar import lidarprocessor
+from pylidar.lidarformats import spdv4
+from pylidar.lidarformats import h5space
+from rios import cuiprogress
+
+INPUT_SPD = 'testsuite1.spd'
+INDEXED_SPD = 'testsuite1_idx.spd'
+DEFAULT_SPD = 'testsuite28_default.spd'
+DEFAULT_INDEXED_SPD = 'testsuite28_default_idx.spd'
+BIGCHUNK_SPD = 'testsuite28_bigchunk.spd'
+COMPRESSED_SPD = 'testsuite28_%s.spd'
+# large enough chunks for the direct chunk reads to be worthwhile
+BIG_HDF5_CHUNK_SIZE = 65536
+
+# name for the output file and the COMPRESSION option to write it with
+COMPRESSION_OPTIONS = [('none', 'none'), ('lzf', 'lzf'), ('gzip9', 'gzip:9'),
+    ('mixed', {lidarprocessor.ARRAY_TYPE_PULSES : 'none',
+                lidarprocessor.ARRAY_TYPE_POINTS : 'lzf',
+                spdv4.COMPRESSION_SPATIAL_INDEX : 'gzip:9'})]
+
+# driver options to read the file written with BIG_HDF5_CHUNK_SIZE with
+READ_OPTIONS = [{'DIRECT_CHUNK_THREADS' : 4},
+    {'CHUNK_CACHE_NBYTES' : h5space.CHUNK_CACHE_AUTO},
+    {'BLOCK_CACHE_SIZE' : 64 * 1024 * 1024, 'DIRECT_CHUNK_THREADS' : 2}]
+
+def checkPulsesByBins(data, otherArgs):
+    """
+    Compares the pulses in each bin of the 2 files
+    """
+    oldPulses = data.oldfile.getPulsesByBins()
+    newPulses = data.newfile.getPulsesByBins()
+    utils.compareArrays(oldPulses, newPulses, 'pulses by bins')
+
+def compareSpatially(oldfile, newfile):
+    """
+    Reads 2 spatially indexed files and raises an exception if
+    the pulses in any bin differ
+    """
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.oldfile = lidarprocessor.LidarFile(oldfile, lidarprocessor.READ)
+    dataFiles.newfile = lidarprocessor.LidarFile(newfile, lidarprocessor.READ)
+
+    controls = lidarprocessor.Controls()
+    progress = cuiprogress.GDALProgressBar()
+    controls.setProgress(progress)
+    controls.setSpatialProcessing(True)
+
+    lidarprocessor.doProcessing(checkPulsesByBins, dataFiles,
+            controls=controls)
+
+def run(oldpath, newpath):
+    """
+    Runs the 28th basic test suite. Tests:
+
+    Writing with the COMPRESSION option
+    Writing a spatial index with the COMPRESSION option
+    Reading with direct chunk decompression and the chunk cache options
+    """
+    inputSPD = os.path.join(oldpath, INPUT_SPD)
+    indexedSPD = os.path.join(oldpath, INDEXED_SPD)
+
+    # the reference, written with the default compression
+    defaultSPD = os.path.join(newpath, DEFAULT_SPD)
+    utils.copyLiDARFile(inputSPD, defaultSPD)
+    utils.compareLiDARData(inputSPD, defaultSPD)
+
+    # copy the spatially indexed file so the index is compressed too.
+    # The pulses are written in a different order to the input so
+    # compare with a copy made the same way with the default compression
+    defaultIndexedSPD = os.path.join(newpath, DEFAULT_INDEXED_SPD)
+    controls = lidarprocessor.Controls()
+    controls.setSpatialProcessing(True)
+    utils.copyLiDARFile(indexedSPD, defaultIndexedSPD, controls=controls)
+
+    for name, compression in COMPRESSION_OPTIONS:
+        compressedSPD = os.path.join(newpath, COMPRESSED_SPD % name)
+        controls = lidarprocessor.Controls()
+        controls.setSpatialProcessing(True)
+        utils.copyLiDARFile(indexedSPD, compressedSPD,
+                {'COMPRESSION' : compression}, controls)
+        utils.compareLiDARData(defaultIndexedSPD, compressedSPD)
+        compareSpatially(defaultIndexedSPD, compressedSPD)
+
+    bigChunkSPD = os.path.join(newpath, BIGCHUNK_SPD)
+    utils.copyLiDARFile(inputSPD, bigChunkSPD,
+            {'HDF5_CHUNK_SIZE' : BIG_HDF5_CHUNK_SIZE, 'COMPRESSION' : 'gzip:1'})
+    for options in READ_OPTIONS:
+        utils.compareLiDARData(defaultSPD, bigChunkSPD, newOptions=options)
+    print('Compression options check ok')
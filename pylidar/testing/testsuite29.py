@@ -0,0 +1,165 @@
+"""
+Simple testsuite that checks processing with more than one worker,
+prefetching, write behind, different block orders, skipping empty blocks
+and a pulse budget give the same outputs as processing each block in turn.
+"""
+
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+
+import os
+import numpy
+from . import utils
+from pylidar import lidarprocessor
+from rios import cuiprogress
+
+INPUT_SPD = 'testsuite1.spd'
+INDEXED_SPD = 'testsuite1_idx.spd'
+SERIAL_IMG = 'testsuite29_serial.img'
+PARALLEL_IMG = 'testsuite29_%s.img'
+SERIAL_SPD = 'testsuite29_serial.spd'
+PARALLEL_SPD = 'testsuite29_parallel.spd'
+NUM_WORKERS = 3
+NUM_CLASSES = 256
+
+def setWorkers(controls):
+    controls.setNumWorkers(NUM_WORKERS)
+
+def setPrefetchAndWriteBehind(controls):
+    controls.setPrefetch(2)
+    controls.setWriteBehind(2)
+
+def setHilbert(controls):
+    controls.setBlockOrder(lidarprocessor.BLOCKORDER_HILBERT)
+
+def setPulseBudget(controls):
+    controls.setWindowSize(512)
+    controls.setPulseBudget(20000)
+    controls.setSkipEmptyBlocks(True)
+
+# name for the output and the function that changes the controls
+CONTROL_OPTIONS = [('workers', setWorkers),
+    ('prefetch', setPrefetchAndWriteBehind), ('hilbert', setHilbert),
+    ('budget', setPulseBudget)]
+
+def writeImageFunc(data):
+    """
+    Writes the number of points, and the lowest, for each bin. The points
+    are binned by the location of their pulse so they don't depend on
+    which block they are read in.
+    """
+    zValues = data.input.getPointsByBins(colNames='Z', indexByPulse=True)
+    (maxPts, nRows, nCols) = zValues.shape
+    stack = numpy.zeros((2, nRows, nCols), dtype=numpy.float64)
+    if maxPts > 0:
+        stack[0] = zValues.count(axis=0)
+        stack[1] = zValues.min(axis=0).filled(0)
+    data.imageOut.setData(stack)
+
+def accumulateFunc(data, otherArgs):
+    """
+    Adds up the number of points in each class and finds the highest
+    """
+    points = data.input.getPoints(colNames=['CLASSIFICATION', 'Z'])
+    if points.size > 0:
+        otherArgs.classCounts.value += numpy.bincount(
+                points['CLASSIFICATION'], minlength=NUM_CLASSES)
+        otherArgs.maxZ.value = max(otherArgs.maxZ.value, points['Z'].max())
+
+def createImage(infile, outfile, setControls=None):
+    """
+    Runs writeImageFunc on infile. setControls is passed the
+    Controls before processing.
+    """
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.input = lidarprocessor.LidarFile(infile, lidarprocessor.READ)
+    dataFiles.imageOut = lidarprocessor.ImageFile(outfile,
+                            lidarprocessor.CREATE)
+
+    controls = lidarprocessor.Controls()
+    progress = cuiprogress.GDALProgressBar()
+    controls.setProgress(progress)
+    controls.setSpatialProcessing(True)
+    if setControls is not None:
+        setControls(controls)
+
+    lidarprocessor.doProcessing(writeImageFunc, dataFiles, controls=controls)
+
+def accumulate(infile, numWorkers):
+    """
+    Returns the values of the accumulators after running accumulateFunc
+    on infile with the given number of workers
+    """
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.input = lidarprocessor.LidarFile(infile, lidarprocessor.READ)
+
+    otherArgs = lidarprocessor.OtherArgs()
+    otherArgs.classCounts = lidarprocessor.Accumulator(
+                numpy.zeros(NUM_CLASSES, dtype=numpy.int64))
+    otherArgs.maxZ = lidarprocessor.Accumulator(-numpy.inf,
+                merge=numpy.maximum)
+
+    controls = lidarprocessor.Controls()
+    progress = cuiprogress.GDALProgressBar()
+    controls.setProgress(progress)
+    controls.setSpatialProcessing(False)
+    controls.setNumWorkers(numWorkers)
+
+    lidarprocessor.doProcessing(accumulateFunc, dataFiles,
+            otherArgs=otherArgs, controls=controls)
+    return otherArgs.classCounts.value, otherArgs.maxZ.value
+
+def run(oldpath, newpath):
+    """
+    Runs the 29th basic test suite. Tests:
+
+    Creating an image with more than one worker
+    Creating an image with prefetch and write behind
+    Creating an image with the Hilbert block order
+    Creating an image with a pulse budget and skipping empty blocks
+    Creating a LiDAR file with more than one worker
+    Accumulators with more than one worker
+    """
+    inputSPD = os.path.join(oldpath, INPUT_SPD)
+    indexedSPD = os.path.join(oldpath, INDEXED_SPD)
+
+    serialImg = os.path.join(newpath, SERIAL_IMG)
+    createImage(indexedSPD, serialImg)
+    for name, setControls in CONTROL_OPTIONS:
+        parallelImg = os.path.join(newpath, PARALLEL_IMG % name)
+        createImage(indexedSPD, parallelImg, setControls)
+        utils.compareImageFiles(serialImg, parallelImg)
+
+    serialSPD = os.path.join(newpath, SERIAL_SPD)
+    controls = lidarprocessor.Controls()
+    controls.setSpatialProcessing(True)
+    utils.copyLiDARFile(indexedSPD, serialSPD, controls=controls)
+
+    parallelSPD = os.path.join(newpath, PARALLEL_SPD)
+    controls = lidarprocessor.Controls()
+    controls.setSpatialProcessing(True)
+    controls.setNumWorkers(NUM_WORKERS)
+    utils.copyLiDARFile(indexedSPD, parallelSPD, controls=controls)
+    utils.compareLiDARData(serialSPD, parallelSPD)
+
+    serialCounts, serialMaxZ = accumulate(inputSPD, 1)
+    parallelCounts, parallelMaxZ = accumulate(inputSPD, NUM_WORKERS)
+    if not (serialCounts == parallelCounts).all() or serialMaxZ != parallelMaxZ:
+        msg = 'accumulators differ with more than one worker'
+        raise utils.TestingDataMismatch(msg)
+    print('Workers check ok')
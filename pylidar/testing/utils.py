@@ -33,7 +33,7 @@ from pylidar import lidarprocessor
 from rios import cuiprogress
 from rios.parallel.jobmanager import find_executable
 
-TESTSUITE_VERSION = 10
+TESTSUITE_VERSION = 11
 """
 Version of the test suite. Increment each change.
 Used to ensure the tarfile matches what we expect.
@@ -433,6 +433,163 @@ def compareNumpyFiles(oldfile, newfile):
         raise TestingDataMismatch(msg)
     print('numpy data checks ok')
 
+def getMaskOfElements(array):
+    """
+    Internal method. Returns a bool array the same shape as array that
+    is True where an element is masked. For structured arrays an element
+    is masked if any of its fields are.
+    """
+    mask = numpy.ma.getmaskarray(array)
+    if mask.dtype.names is not None:
+        mask = numpy.any([mask[name] for name in mask.dtype.names], axis=0)
+    return mask
+
+def compareArrays(oldarray, newarray, name):
+    """
+    Compares 2 arrays (either can be masked and/or structured) and
+    raises an exception mentioning name if the shapes, masks or the
+    unmasked data do not match.
+    """
+    if oldarray.shape != newarray.shape:
+        msg = '%s: arrays are different shapes (%s and %s)'
+        msg = msg % (name, oldarray.shape, newarray.shape)
+        raise TestingDataMismatch(msg)
+
+    oldmask = getMaskOfElements(oldarray)
+    newmask = getMaskOfElements(newarray)
+    if not (oldmask == newmask).all():
+        msg = '%s: masks do not match' % name
+        raise TestingDataMismatch(msg)
+
+    olddata = numpy.ma.getdata(oldarray)[~oldmask]
+    newdata = numpy.ma.getdata(newarray)[~newmask]
+    if olddata.dtype.names != newdata.dtype.names:
+        msg = '%s: column names do not match' % name
+        raise TestingDataMismatch(msg)
+
+    if olddata.dtype.names is None:
+        if not (olddata == newdata).all():
+            msg = '%s: data does not match' % name
+            raise TestingDataMismatch(msg)
+    else:
+        for colName in olddata.dtype.names:
+            if not (olddata[colName] == newdata[colName]).all():
+                msg = '%s: data does not match for column %s' % (name, colName)
+                raise TestingDataMismatch(msg)
+
+def sortRaggedByBin(ragged):
+    """
+    Internal method. Returns the data of a RaggedArray sorted by bin
+    and then by the values in each column, so two arrays with the same
+    elements in each bin can be compared whatever order they were read in.
+    """
+    binIdx = ragged.getBinIndex()
+    if isinstance(binIdx, tuple):
+        binIdx = numpy.ravel_multi_index(binIdx, ragged.shape)
+
+    data = ragged.data
+    if data.dtype.names is None:
+        keys = [data]
+    else:
+        keys = [data[colName] for colName in reversed(data.dtype.names)]
+    # the last key is the primary one
+    keys.append(binIdx)
+    order = numpy.lexsort(keys)
+    return data[order]
+
+def compareRaggedBins(oldragged, newragged, name):
+    """
+    Compares 2 RaggedArrays (see pylidar.lidarformats.gridindexutils)
+    and raises an exception mentioning name unless each bin has the same
+    elements in both. The order of the elements within a bin can differ.
+    """
+    if oldragged.shape != newragged.shape:
+        msg = '%s: different number of bins (%s and %s)'
+        msg = msg % (name, oldragged.shape, newragged.shape)
+        raise TestingDataMismatch(msg)
+
+    if not (oldragged.count == newragged.count).all():
+        msg = '%s: number of elements in each bin does not match' % name
+        raise TestingDataMismatch(msg)
+
+    compareArrays(sortRaggedByBin(oldragged), sortRaggedByBin(newragged),
+                name)
+
+def copyLiDARFunc(data, otherArgs):
+    """
+    Internal method. Called by copyLiDARFile via lidarprocessor.
+    """
+    if data.info.isFirstBlock():
+        for arrayType in (lidarprocessor.ARRAY_TYPE_PULSES,
+                    lidarprocessor.ARRAY_TYPE_POINTS):
+            for colName in data.input.getScalingColumns(arrayType):
+                gain, offset = data.input.getScaling(colName, arrayType)
+                data.output.setScaling(colName, arrayType, gain, offset)
+
+    pulses = data.input.getPulses()
+    points = data.input.getPointsByPulse()
+    data.output.setPulses(pulses)
+    data.output.setPoints(points)
+
+def copyLiDARFile(infile, outfile, driverOptions=None, controls=None):
+    """
+    Copies the pulses and points of a SPDV4 file to a new SPDV4 file,
+    created with the given dictionary of driver options. Pass controls
+    to change how the copy is processed - if they ask for spatial
+    processing the output is spatially indexed as it is written.
+    """
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.input = lidarprocessor.LidarFile(infile, lidarprocessor.READ)
+    dataFiles.output = lidarprocessor.LidarFile(outfile, lidarprocessor.CREATE)
+    dataFiles.output.setLiDARDriver('SPDV4')
+    dataFiles.output.setLiDARDriverOption('SCALING_BUT_NO_DATA_WARNING', False)
+    if driverOptions is not None:
+        for key in driverOptions:
+            dataFiles.output.setLiDARDriverOption(key, driverOptions[key])
+
+    if controls is None:
+        controls = lidarprocessor.Controls()
+        controls.setSpatialProcessing(False)
+    controls.setProgress(cuiprogress.GDALProgressBar())
+
+    lidarprocessor.doProcessing(copyLiDARFunc, dataFiles, controls=controls)
+
+def compareLiDARDataFunc(data, otherArgs):
+    """
+    Internal method. Called by compareLiDARData via lidarprocessor.
+    """
+    oldPulses = data.oldfile.getPulses()
+    newPulses = data.newfile.getPulses()
+    compareArrays(oldPulses, newPulses, 'pulses')
+
+    oldPoints = data.oldfile.getPoints()
+    newPoints = data.newfile.getPoints()
+    compareArrays(oldPoints, newPoints, 'points')
+
+def compareLiDARData(oldfile, newfile, oldOptions=None, newOptions=None):
+    """
+    Reads 2 LiDAR files, in pulse order, and raises an exception if any
+    of the pulses or points differ. Unlike compareLiDARFiles() the data is
+    compared directly so the driver options used to read each file (a
+    dictionary, or None for the defaults) can be set.
+    """
+    dataFiles = lidarprocessor.DataFiles()
+    dataFiles.oldfile = lidarprocessor.LidarFile(oldfile, lidarprocessor.READ)
+    dataFiles.newfile = lidarprocessor.LidarFile(newfile, lidarprocessor.READ)
+    for userClass, options in ((dataFiles.oldfile, oldOptions),
+                    (dataFiles.newfile, newOptions)):
+        if options is not None:
+            for key in options:
+                userClass.setLiDARDriverOption(key, options[key])
+
+    controls = lidarprocessor.Controls()
+    controls.setProgress(cuiprogress.GDALProgressBar())
+    controls.setSpatialProcessing(False)
+
+    lidarprocessor.doProcessing(compareLiDARDataFunc, dataFiles,
+                controls=controls)
+    print('LiDAR data checks ok')
+
 def extractTarFile(tarFile, pathToUse='.', doVersionCheck=True):
     """
     Extracts the tarFile to the given path and checks the version matches
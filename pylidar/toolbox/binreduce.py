@@ -0,0 +1,352 @@
+"""
+Functions for reducing the values in each bin of a ragged array
+(see pylidar.lidarformats.gridindexutils.RaggedArray) to a single
+value per bin, for example when creating a raster.
+
+These work in one pass over the sorted 1d data, so unlike calling
+numpy.ma functions on the masked 3d arrays the memory used does not
+depend on the number of elements in the fullest bin.
+"""
+
+# This file is part of PyLidar
+# Copyright (C) 2015 John Armston, Pete Bunting, Neil Flood, Sam Gillingham
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+
+import re
+import numpy
+from numba import jit
+from pylidar.lidarformats import gridindexutils
+
+REDUCE_COUNT = 'count'
+"Number of elements in each bin"
+REDUCE_MIN = 'min'
+"Minimum value in each bin"
+REDUCE_MAX = 'max'
+"Maximum value in each bin"
+REDUCE_MEAN = 'mean'
+"Mean value in each bin"
+REDUCE_SUM = 'sum'
+"Sum of the values in each bin"
+REDUCE_STD = 'std'
+"Population standard deviation of the values in each bin"
+REDUCE_FIRST = 'first'
+"First value in each bin (in the order read)"
+REDUCE_LAST = 'last'
+"Last value in each bin (in the order read)"
+REDUCE_PERCENTILE = 'percentile'
+"Percentile of the values in each bin. Linearly interpolated like numpy"
+
+# functions that are commonly passed to rasterization that we
+# can do the same thing as
+FUNCTION_REDUCERS = {'numpy.ma.count': (REDUCE_COUNT, None),
+    'numpy.ma.min': (REDUCE_MIN, None), 'numpy.ma.amin': (REDUCE_MIN, None),
+    'numpy.min': (REDUCE_MIN, None), 'numpy.amin': (REDUCE_MIN, None),
+    'numpy.ma.max': (REDUCE_MAX, None), 'numpy.ma.amax': (REDUCE_MAX, None),
+    'numpy.max': (REDUCE_MAX, None), 'numpy.amax': (REDUCE_MAX, None),
+    'numpy.ma.mean': (REDUCE_MEAN, None), 'numpy.mean': (REDUCE_MEAN, None),
+    'numpy.ma.sum': (REDUCE_SUM, None), 'numpy.sum': (REDUCE_SUM, None),
+    'numpy.ma.std': (REDUCE_STD, None), 'numpy.std': (REDUCE_STD, None),
+    'numpy.ma.median': (REDUCE_PERCENTILE, 50.0),
+    'numpy.median': (REDUCE_PERCENTILE, 50.0)}
+
+class BinReduceError(Exception):
+    "Exception type for binreduce errors"
+
+@jit
+def binCount(values, start, count, out):
+    """
+    Fills out with the number of elements in each bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            out[row, col] = count[row, col]
+
+@jit
+def binMin(values, start, count, out):
+    """
+    Fills out with the minimum value in each non empty bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            n = count[row, col]
+            if n > 0:
+                s = start[row, col]
+                val = values[s]
+                for i in range(s + 1, s + n):
+                    if values[i] < val:
+                        val = values[i]
+                out[row, col] = val
+
+@jit
+def binMax(values, start, count, out):
+    """
+    Fills out with the maximum value in each non empty bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            n = count[row, col]
+            if n > 0:
+                s = start[row, col]
+                val = values[s]
+                for i in range(s + 1, s + n):
+                    if values[i] > val:
+                        val = values[i]
+                out[row, col] = val
+
+@jit
+def binSum(values, start, count, out):
+    """
+    Fills out with the sum of the values in each non empty bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            n = count[row, col]
+            if n > 0:
+                s = start[row, col]
+                total = 0.0
+                for i in range(s, s + n):
+                    total += values[i]
+                out[row, col] = total
+
+@jit
+def binMean(values, start, count, out):
+    """
+    Fills out with the mean of the values in each non empty bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            n = count[row, col]
+            if n > 0:
+                s = start[row, col]
+                total = 0.0
+                for i in range(s, s + n):
+                    total += values[i]
+                out[row, col] = total / n
+
+@jit
+def binStd(values, start, count, out):
+    """
+    Fills out with the population standard deviation of the values
+    in each non empty bin. The elements of a bin are next to each other
+    so two passes over them are cheap and avoid the rounding problems
+    of the one pass formula.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            n = count[row, col]
+            if n > 0:
+                s = start[row, col]
+                total = 0.0
+                for i in range(s, s + n):
+                    total += values[i]
+                mean = total / n
+                sumSq = 0.0
+                for i in range(s, s + n):
+                    diff = values[i] - mean
+                    sumSq += diff * diff
+                out[row, col] = numpy.sqrt(sumSq / n)
+
+@jit
+def binFirst(values, start, count, out):
+    """
+    Fills out with the first value in each non empty bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            if count[row, col] > 0:
+                out[row, col] = values[start[row, col]]
+
+@jit
+def binLast(values, start, count, out):
+    """
+    Fills out with the last value in each non empty bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            n = count[row, col]
+            if n > 0:
+                out[row, col] = values[start[row, col] + n - 1]
+
+@jit
+def selectKth(buf, n, k):
+    """
+    Partially sorts the first n elements of buf in place (quickselect)
+    so that buf[k] is the k'th smallest and everything after it is no
+    smaller. Returns buf[k].
+    """
+    lo = 0
+    hi = n - 1
+    while hi > lo:
+        pivot = buf[(lo + hi) // 2]
+        i = lo
+        j = hi
+        while i <= j:
+            while buf[i] < pivot:
+                i += 1
+            while buf[j] > pivot:
+                j -= 1
+            if i <= j:
+                tmp = buf[i]
+                buf[i] = buf[j]
+                buf[j] = tmp
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            # between j and i are all equal to the pivot
+            break
+    return buf[k]
+
+@jit
+def binPercentile(values, start, count, percentile, buf, out):
+    """
+    Fills out with the given percentile (0-100) of the values in each non
+    empty bin, interpolated in the same way as numpy.percentile.
+    buf must be a float64 array at least as long as the fullest bin.
+    """
+    nRows, nCols = count.shape
+    for row in range(nRows):
+        for col in range(nCols):
+            n = count[row, col]
+            if n > 0:
+                s = start[row, col]
+                for i in range(n):
+                    buf[i] = values[s + i]
+                pos = (percentile / 100.0) * (n - 1)
+                lower = int(numpy.floor(pos))
+                val = selectKth(buf, n, lower)
+                if lower < n - 1:
+                    # next value is the smallest of the ones after
+                    upperVal = buf[lower + 1]
+                    for i in range(lower + 2, n):
+                        if buf[i] < upperVal:
+                            upperVal = buf[i]
+                    val = val + (upperVal - val) * (pos - lower)
+                out[row, col] = val
+
+REDUCER_FUNCS = {REDUCE_COUNT: binCount, REDUCE_MIN: binMin,
+    REDUCE_MAX: binMax, REDUCE_MEAN: binMean, REDUCE_SUM: binSum,
+    REDUCE_STD: binStd, REDUCE_FIRST: binFirst, REDUCE_LAST: binLast}
+
+def getReducer(function):
+    """
+    Given the string name of a function (as passed to rasterization)
+    returns a tuple of the REDUCE_* name and the parameter it needs
+    (the percentile, or None). Returns None if there is no reducer
+    that does the same thing.
+
+    As well as the numpy functions in FUNCTION_REDUCERS the REDUCE_*
+    names themselves are accepted, plus 'median' and 'percentileNN'
+    (eg 'percentile95').
+    """
+    function = function.strip()
+    if function in FUNCTION_REDUCERS:
+        return FUNCTION_REDUCERS[function]
+    if function in REDUCER_FUNCS:
+        return (function, None)
+    if function == 'median':
+        return (REDUCE_PERCENTILE, 50.0)
+    match = re.match(r'^percentile\s*(\d+(\.\d*)?)$', function)
+    if match is not None:
+        percentile = float(match.group(1))
+        if percentile > 100:
+            msg = 'Percentile must be between 0 and 100'
+            raise BinReduceError(msg)
+        return (REDUCE_PERCENTILE, percentile)
+    return None
+
+def reduceBins(ragged, reducer, param=None, background=0):
+    """
+    Reduce the values in each bin of ragged (a RaggedArray of a single
+    column, with a 2d grid of bins) using the reducer (one of the
+    REDUCE_* names). param is the percentile to use for REDUCE_PERCENTILE.
+
+    Returns a 2d float64 array, set to background for empty bins
+    (apart from REDUCE_COUNT where these are 0).
+    """
+    if reducer not in REDUCER_FUNCS and reducer != REDUCE_PERCENTILE:
+        msg = 'Unknown reducer %s' % reducer
+        raise BinReduceError(msg)
+
+    if ragged.data.dtype.names is not None:
+        msg = 'Can only reduce a single column'
+        raise BinReduceError(msg)
+
+    out = numpy.empty(ragged.shape, dtype=numpy.float64)
+    out.fill(background)
+    # make sure the index arithmetic in the jitted functions stays integer
+    start = ragged.start.astype(numpy.int64)
+
+    if reducer == REDUCE_PERCENTILE:
+        if param is None:
+            msg = 'Percentile must be given'
+            raise BinReduceError(msg)
+        buf = numpy.empty(ragged.getMaxCount(), dtype=numpy.float64)
+        binPercentile(ragged.data, start, ragged.count, float(param),
+                    buf, out)
+    else:
+        REDUCER_FUNCS[reducer](ragged.data, start, ragged.count, out)
+
+    return out
+
+def mergeRagged(raggedList):
+    """
+    Merge a list of RaggedArrays with the same bins (eg from different
+    input files) into one, with the elements from each array in the
+    order of the list, like numpy.ma.vstack does for the masked arrays.
+    """
+    if len(raggedList) == 1:
+        return raggedList[0]
+
+    totalCount = numpy.zeros(raggedList[0].shape, dtype=numpy.int64)
+    for ragged in raggedList:
+        if ragged.shape != totalCount.shape:
+            msg = 'All arrays must have the same bins'
+            raise BinReduceError(msg)
+        totalCount += ragged.count
+    flatCount = totalCount.ravel()
+    newStart = numpy.cumsum(flatCount) - flatCount
+
+    data = numpy.empty(flatCount.sum(), dtype=raggedList[0].data.dtype)
+    # where the next element of each bin goes
+    nextIdx = newStart.copy()
+    for ragged in raggedList:
+        counts = ragged.count.ravel().astype(numpy.int64)
+        valid = counts > 0
+        counts = counts[valid]
+        srcStart = ragged.start.ravel()[valid].astype(numpy.int64)
+        dstStart = nextIdx[valid]
+        # offset of each element within its bin
+        within = (numpy.arange(counts.sum()) -
+                    numpy.repeat(numpy.cumsum(counts) - counts, counts))
+        data[numpy.repeat(dstStart, counts) + within] = ragged.data[
+                    numpy.repeat(srcStart, counts) + within]
+        nextIdx[valid] += counts
+
+    return gridindexutils.RaggedArray(data, newStart.reshape(totalCount.shape),
+                totalCount)
@@ -50,6 +50,9 @@ def runCanopyMetric(infiles, outfiles, metric, otherargs):
                 spatial.readImageLayer(otherargs.externaldem)
         controls.setSpatialProcessing(False)
         controls.setWindowSize(512)
+        # results are built up with lidarprocessor.Accumulator so
+        # blocks can be processed in parallel
+        controls.setNumWorkers(getattr(otherargs, 'numworkers', 1))
         pavd_calders2014.run_pavd_calders2014(dataFiles, controls, otherargs, outfiles[0])     
     
     elif metric == "VOXEL_HANCOCK2016":              
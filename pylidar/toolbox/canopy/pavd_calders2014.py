@@ -35,15 +35,18 @@ def run_pavd_calders2014(dataFiles, controls, otherargs, outfile):
     if otherargs.planecorrection:  
         print("Applying plane correction to point heights...")
         
-        otherargs.xgrid = numpy.zeros(otherargs.gridsize**2, dtype=numpy.float64)
-        otherargs.ygrid = numpy.zeros(otherargs.gridsize**2, dtype=numpy.float64)
-        otherargs.zgrid = numpy.zeros(otherargs.gridsize**2, dtype=numpy.float64)
-        otherargs.gridmask = numpy.ones(otherargs.gridsize**2, dtype=numpy.bool)
+        xgrid = numpy.zeros(otherargs.gridsize**2, dtype=numpy.float64)
+        ygrid = numpy.zeros(otherargs.gridsize**2, dtype=numpy.float64)
+        zgrid = numpy.zeros(otherargs.gridsize**2, dtype=numpy.float64)
+        gridmask = numpy.ones(otherargs.gridsize**2, dtype=numpy.bool)
+        otherargs.mingrid = lidarprocessor.Accumulator((xgrid, ygrid, zgrid, gridmask), 
+            merge=mergeMinZGrids)
                   
         lidarprocessor.doProcessing(runXYMinGridding, dataFiles, controls=controls, otherArgs=otherargs)
         
-        otherargs.planefit = planeFitHubers(otherargs.xgrid[~otherargs.gridmask], otherargs.ygrid[~otherargs.gridmask], 
-            otherargs.zgrid[~otherargs.gridmask], reportfile=otherargs.rptfile)
+        xgrid, ygrid, zgrid, gridmask = otherargs.mingrid.value
+        otherargs.planefit = planeFitHubers(xgrid[~gridmask], ygrid[~gridmask], 
+            zgrid[~gridmask], reportfile=otherargs.rptfile)
     
     minZenithAll = min(otherargs.minzenith)
     maxZenithAll = max(otherargs.maxzenith)
@@ -51,13 +54,15 @@ def run_pavd_calders2014(dataFiles, controls, otherargs, outfile):
     
     otherargs.zenith = numpy.arange(minZenithAll+otherargs.zenithbinsize/2, maxZenithAll, otherargs.zenithbinsize)
     otherargs.height = numpy.arange(minHeightBin, otherargs.maxheight, otherargs.heightbinsize)
-    otherargs.counts = numpy.zeros([otherargs.zenith.shape[0],otherargs.height.shape[0]])
-    otherargs.pulses = numpy.zeros([otherargs.zenith.shape[0],1])     
+    otherargs.counts = lidarprocessor.Accumulator(numpy.zeros([otherargs.zenith.shape[0],otherargs.height.shape[0]]))
+    otherargs.pulses = lidarprocessor.Accumulator(numpy.zeros([otherargs.zenith.shape[0],1]))
     
     print("Calculating vertical plant profiles...")
     lidarprocessor.doProcessing(runZenithHeightStratification, dataFiles, controls=controls, otherArgs=otherargs)
     
-    pgapz = numpy.where(otherargs.pulses > 0, 1 - numpy.cumsum(otherargs.counts, axis=1) / otherargs.pulses, numpy.nan)
+    counts = otherargs.counts.value
+    pulses = otherargs.pulses.value
+    pgapz = numpy.where(pulses > 0, 1 - numpy.cumsum(counts, axis=1) / pulses, numpy.nan)
     zenithRadians = numpy.radians(otherargs.zenith)
     zenithBinSizeRadians = numpy.radians(otherargs.zenithbinsize)
     
@@ -165,6 +170,23 @@ def minPointsByXYGrid(pointX, pointY, pointZ, gridX, gridY, gridZ, gridMask,
                     gridZ[j] = pointZ[i]
                     gridMask[j] = False
     
+def mergeMinZGrids(grids, blockGrids):
+    """
+    Merge function for the minimum Z grid accumulator used by runXYMinGridding().
+    Both arguments are tuples of (gridX, gridY, gridZ, gridMask) as updated by
+    minPointsByXYGrid(). Keeps the point with the lowest Z in each grid cell.
+    """
+    gridX, gridY, gridZ, gridMask = grids
+    blockX, blockY, blockZ, blockMask = blockGrids
+    
+    useBlock = ~blockMask & (gridMask | (blockZ < gridZ))
+    gridX[useBlock] = blockX[useBlock]
+    gridY[useBlock] = blockY[useBlock]
+    gridZ[useBlock] = blockZ[useBlock]
+    gridMask[useBlock] = False
+    
+    return gridX, gridY, gridZ, gridMask
+
 def runXYMinGridding(data, otherargs):
     """
     Derive a minimum Z surface following plane correction procedures outlined in Calders et al. (2014)
@@ -189,8 +211,9 @@ def runXYMinGridding(data, otherargs):
         y = points['Y'] - pulsesByPoint['Y_ORIGIN']
         z = points['Z'] - pulsesByPoint['Z_ORIGIN']
         
-        minPointsByXYGrid(x, y, z, otherargs.xgrid, otherargs.ygrid, otherargs.zgrid,  
-            otherargs.gridmask, minX, maxX, minY, maxY, otherargs.gridbinsize, otherargs.gridsize)
+        xgrid, ygrid, zgrid, gridmask = otherargs.mingrid.value
+        minPointsByXYGrid(x, y, z, xgrid, ygrid, zgrid,  
+            gridmask, minX, maxX, minY, maxY, otherargs.gridbinsize, otherargs.gridsize)
 
 def runZenithHeightStratification(data, otherargs):
     """
@@ -241,7 +264,7 @@ def runZenithHeightStratification(data, otherargs):
         countPointsPulsesByZenithHeight(otherargs.zenith,otherargs.minazimuth[i],otherargs.maxazimuth[i],
             otherargs.minzenith[i],otherargs.maxzenith[i],otherargs.zenithbinsize,
             pulses['AZIMUTH'],pulsesByPoint['AZIMUTH'],pulses['ZENITH'],pulsesByPoint['ZENITH'],
-            pointHeights,otherargs.height,otherargs.heightbinsize,otherargs.counts,otherargs.pulses,
+            pointHeights,otherargs.height,otherargs.heightbinsize,otherargs.counts.value,otherargs.pulses.value,
             weights,otherargs.minheight)
 
 def extractPointHeightsFromDEM(x, y, z, otherargs):
@@ -60,6 +60,7 @@ def getCmdargs():
     p.add_argument("--excludedclasses", nargs="+", default=[], type=int, help="Point CLASSIFICATION values to exclude from the metric calculation (default is all points)")
     p.add_argument("--rasterdriver", default="HFA", help="GDAL format for output raster (default is %(default)s)")
     p.add_argument("--externaltransformfn", nargs="+", default=[], help="External transform filenames (for RIEGL RXP input files)")
+    p.add_argument("--numworkers", default=1, type=int, help="Number of worker processes to use (default: %(default)i; PAVD_CALDERS2014 metric only)")
     p.add_argument("--externaldem", help="External single layer DEM image to use for calculation of point heights (PAVD_CALDERS2014) or lower boundary of voxel traversal (VOXEL_HANCOCK2016)")
        
     cmdargs = p.parse_args()
@@ -134,6 +135,7 @@ def run():
         otherargs.totalpaimethod = cmdargs.totalpaimethod
         otherargs.totalpai = cmdargs.totalpai
         otherargs.externaldem = cmdargs.externaldem
+        otherargs.numworkers = cmdargs.numworkers
 
     elif cmdargs.metric == "VOXEL_HANCOCK2016":    
         
@@ -31,6 +31,7 @@ from pylidar.basedriver import Extent
 DEFAULT_RESOLUTION = 1.0
 DEFAULT_INDEXTYPE = "CARTESIAN"
 DEFAULT_PULSEINDEXMETHOD = "FIRST_RETURN"
+DEFAULT_BLOCKORDER = "ROWMAJOR"
 
 def getCmdargs():
     """
@@ -56,6 +57,13 @@ def getCmdargs():
             " If not specified, a temporary directory will be created and " +
             "removed at the end of processing.")
     p.add_argument("--wkt", help="projection to use for output in WKT format")
+    p.add_argument("--blockorder", default=DEFAULT_BLOCKORDER,
+        choices=['ROWMAJOR', 'MORTON', 'HILBERT'],
+        help="Order the blocks are written to the output. " +
+            "(default: %(default)s)")
+    p.add_argument("--indexpoints", default=False, action="store_true",
+        help="Also index the points by their own location so they can " +
+            "be read by bin without being re-binned")
 
     cmdargs = p.parse_args()
 
@@ -92,11 +100,14 @@ def run():
         msg = 'Unsupported pulse indexing method %s' % cmdargs.pulseindexmethod
         raise generic.LiDARPulseIndexUnsupported(msg)            
 
+    blockOrder = getattr(gridindex, "BLOCKORDER_%s" % cmdargs.blockorder)
+
     gridindex.createGridSpatialIndex(cmdargs.input, cmdargs.output, 
                                 extent=extent, tempDir=cmdargs.tempdir,
                                 indexType=indexType,
                                 pulseIndexMethod=pulseindexmethod,
                                 binSize=cmdargs.resolution,
                                 blockSize=cmdargs.blocksize,
-                                wkt=cmdargs.wkt) 
+                                wkt=cmdargs.wkt, blockOrder=blockOrder,
+                                indexPoints=cmdargs.indexpoints) 
 
@@ -37,14 +37,23 @@ def getCmdargs():
     p = argparse.ArgumentParser()
     p.add_argument("-i", "--infiles", nargs="+", 
         help="Input lidar files (required)")
-    p.add_argument("-o", "--output", help="output file (required)")
+    p.add_argument("-o", "--output", nargs="+", help="output file " +
+        "(required). Give one file per layer to write each layer to its " +
+        "own file instead of a band of one file.")
     p.add_argument("-a", "--attributes", nargs="+", 
         help="Pulse, point or waveform attributes to rasterize. Can list " +
         "multiple attributes for one --type to create an image stack.")
+    p.add_argument("-s", "--stats", nargs="+", 
+        help="Layers to create as ATTRIBUTE:FUNCTION pairs (eg Z:min " +
+        "Z:max INTENSITY:mean Z:count). All are calculated from one read " +
+        "of the data and are added after any --attributes layers.")
     p.add_argument("-f", "--function", default=DEFAULT_FUNCTION,
         help="function to apply to data. Must contain module name " + 
         "and be able to operate on masked arrays and take the 'axis' " +
-        "parameter. default=%(default)s")
+        "parameter. Common numpy functions (min, max, mean, sum, std, " +
+        "count, median) are done without creating masked arrays. Also " +
+        "accepts count, min, max, mean, sum, std, first, last, median " + 
+        "and percentileNN (eg percentile95). default=%(default)s")
     p.add_argument("-t", "--type", default=DEFAULT_ATTRIBUTE,
         choices=['POINT', 'PULSE'],
         help="Type of data to operate on. default=%(default)s")
@@ -66,16 +75,36 @@ def getCmdargs():
         help="Don't show progress etc")
 
     cmdargs = p.parse_args()
-    if cmdargs.attributes is None:
-        print("Must specify attributes to use") 
+    if cmdargs.attributes is None and cmdargs.stats is None:
+        print("Must specify attributes or stats to use") 
         p.print_help()
         sys.exit()
 
+    layers = []
+    if cmdargs.attributes is not None:
+        layers.extend(cmdargs.attributes)
+    if cmdargs.stats is not None:
+        for stat in cmdargs.stats:
+            if ':' not in stat:
+                print("Stats must be given as ATTRIBUTE:FUNCTION")
+                p.print_help()
+                sys.exit()
+            layers.append(tuple(stat.split(':', 1)))
+    cmdargs.attributes = layers
+
     if cmdargs.output is None:
         print("Must specify output file name") 
         p.print_help()
         sys.exit()
 
+    if len(cmdargs.output) == 1:
+        # a band per layer in the one file
+        cmdargs.output = cmdargs.output[0]
+    elif len(cmdargs.output) != len(cmdargs.attributes):
+        print("Must specify one output file, or one per layer")
+        p.print_help()
+        sys.exit()
+
     if cmdargs.footprint is not None:
         # Evaluate the footprint string as a named constant
         cmdargs.footprint = eval("lidarprocessor.{}".format(cmdargs.footprint))
@@ -28,6 +28,7 @@ from pylidar import lidarprocessor
 from pylidar.lidarformats import spdv4
 from pylidar.lidarformats import las
 from pylidar.lidarformats import generic
+from pylidar.lidarformats import gridindexutils
 from pylidar.basedriver import Extent
 from rios import cuiprogress
 from rios import pixelgrid
@@ -62,9 +63,17 @@ PULSE_INDEX_END_WAVEFORM = spdv4.SPDV4_PULSE_INDEX_END_WAVEFORM
 PULSE_INDEX_ORIGIN = spdv4.SPDV4_PULSE_INDEX_ORIGIN
 PULSE_INDEX_MAX_INTENSITY = spdv4.SPDV4_PULSE_INDEX_MAX_INTENSITY
 
+"""
+Orders the tiles can be merged in. Copied from gridindexutils.
+"""
+BLOCKORDER_ROWMAJOR = gridindexutils.BLOCKORDER_ROWMAJOR
+BLOCKORDER_MORTON = gridindexutils.BLOCKORDER_MORTON
+BLOCKORDER_HILBERT = gridindexutils.BLOCKORDER_HILBERT
+
 def createGridSpatialIndex(infile, outfile, binSize=1.0, blockSize=None, 
         tempDir=None, extent=None, indexType=INDEX_CARTESIAN,
-        pulseIndexMethod=PULSE_INDEX_FIRST_RETURN, wkt=None):
+        pulseIndexMethod=PULSE_INDEX_FIRST_RETURN, wkt=None,
+        blockOrder=BLOCKORDER_ROWMAJOR, indexPoints=False):
     """
     Creates a grid spatially indexed file from a non spatial input file.
     Currently only supports creation of a SPD V4 file.
@@ -80,6 +89,12 @@ def createGridSpatialIndex(infile, outfile, binSize=1.0, blockSize=None,
     pulseIndexMethod is one of the PULSE_INDEX_* constants.
     wkt is the projection to use for the output. Copied from the input if
     not supplied.
+    blockOrder is one of the BLOCKORDER_* constants and is the order the
+    blocks are written to the output. Processing the output with the same
+    order (see lidarprocessor.Controls.setBlockOrder()) and a window size
+    of blockSize reads the file sequentially.
+    indexPoints if True also writes an index of the points by their own
+    location (see the POINT_SPATIAL_INDEX option of the SPDV4 driver).
     nPulsesPerChunkMerge is the number of pulses to process at a time
     when merging.
 
@@ -105,7 +120,8 @@ def createGridSpatialIndex(infile, outfile, binSize=1.0, blockSize=None,
         if len(wkt) == 0:
             wkt = getDefaultWKT()
 
-    indexAndMerge(extentList, extent, wkt, outfile, header) 
+    indexAndMerge(extentList, extent, wkt, outfile, header, blockOrder,
+                indexPoints)
     
     # delete the temp files
     for fname, extent in extentList:
@@ -292,8 +308,11 @@ def splitFileIntoTiles(infiles, binSize=1.0, blockSize=None,
         
     otherArgs = lidarprocessor.OtherArgs()
     otherArgs.outList = extentList
+    otherArgs.tileLayout = getTileLayout(extentList)
     otherArgs.indexType = indexType
     otherArgs.pulseIndexMethod = pulseIndexMethod
+    # set on the first block that has pulses
+    otherArgs.scalingSet = False
         
     lidarprocessor.doProcessing(classifyFunc, dataFiles, controls=controls, 
                 otherArgs=otherArgs)
@@ -362,11 +381,57 @@ def setScalingForCoordField(driver, srcfield, coordfield):
     elif coordfield in spdv4.POINT_SCALED_FIELDS:
         driver.setScaling(coordfield, lidarprocessor.ARRAY_TYPE_POINTS, gain, offset)
     
+def getTileLayout(outList):
+    """
+    Internal method. Works out the columns and rows of the tiles in 
+    outList (as created by splitFileIntoTiles) so the tile each pulse
+    is in can be found by searching rather than by testing every tile.
+
+    Returns the xMin and xMax of each column, the yMax and yMin of each
+    row (from the top) and a 2d array of the index into outList of the
+    tile at each row and column (-1 if none).
+    """
+    xMins = numpy.unique([extent.xMin for extent, driver in outList])
+    yMaxs = numpy.unique([extent.yMax for extent, driver in outList])[::-1]
+    xMaxs = numpy.empty_like(xMins)
+    yMins = numpy.empty_like(yMaxs)
+    tileGrid = numpy.full((yMaxs.size, xMins.size), -1, dtype=numpy.int64)
+    for n, (extent, driver) in enumerate(outList):
+        col = numpy.searchsorted(xMins, extent.xMin)
+        row = numpy.searchsorted(-yMaxs, -extent.yMax)
+        xMaxs[col] = extent.xMax
+        yMins[row] = extent.yMin
+        tileGrid[row, col] = n
+
+    return xMins, xMaxs, yMaxs, yMins, tileGrid
+
+def getTileForPulses(xIdx, yIdx, tileLayout):
+    """
+    Internal method. Returns the index into outList of the tile each
+    pulse is in (-1 if none) given the layout from getTileLayout().
+    A pulse is in a tile when xMin <= xIdx < xMax and yMin < yIdx <= yMax
+    as for the spatial index.
+    """
+    xMins, xMaxs, yMaxs, yMins, tileGrid = tileLayout
+    xIdx = numpy.asarray(xIdx)
+    yIdx = numpy.asarray(yIdx)
+    # last column starting at or before xIdx, and the last row 
+    # (they go down) with its top at or above yIdx
+    col = numpy.searchsorted(xMins, xIdx, side='right') - 1
+    row = numpy.searchsorted(-yMaxs, -yIdx, side='right') - 1
+    valid = (col >= 0) & (row >= 0)
+    col[~valid] = 0
+    row[~valid] = 0
+    valid &= (xIdx < xMaxs[col]) & (yIdx > yMins[row])
+
+    return numpy.where(valid, tileGrid[row, col], -1)
+
 def classifyFunc(data, otherArgs):
     """
     Called by lidarprocessor. Looks at the input data and splits into 
     the appropriate output files.
     """
+    gotPulses = False
     for input in data.inputs:
         pulses = input.getPulses()
         points = input.getPointsByPulse()
@@ -376,67 +441,79 @@ def classifyFunc(data, otherArgs):
         # With LAS sometimes this happens. Not sure why...
         if len(pulses) == 0:
             continue
+        gotPulses = True
+
+        # TODO: should we always be able to rely on X_IDX, Y_IDX for
+        # whatever index we are building?
+        # No - as the values of these columns may have to change if the
+        # properties of the spatial indexing method change   
+        if otherArgs.indexType == INDEX_CARTESIAN:
+            xIdxFieldName = 'X'
+            yIdxFieldName = 'Y'
+            xIdx, yIdx = indexPulses(pulses, points, otherArgs.pulseIndexMethod)
+        elif otherArgs.indexType == INDEX_SPHERICAL:
+            xIdxFieldName = 'AZIMUTH'
+            yIdxFieldName = 'ZENITH'
+            xIdx, yIdx = pulses[xIdxFieldName], pulses[yIdxFieldName]
+        elif otherArgs.indexType == INDEX_SCAN:
+            xIdxFieldName = 'SCANLINE_IDX'
+            yIdxFieldName = 'SCANLINE'
+            xIdx, yIdx = pulses[xIdxFieldName], pulses[yIdxFieldName]              
+        else:
+            msg = 'unsupported indexing method'
+            raise generic.LiDARSpatialIndexNotAvailable(msg)
 
-        for extent, driver in otherArgs.outList:
-    
-            if data.info.isFirstBlock():
+        # not on isFirstBlock() as that may have had no pulses
+        if not otherArgs.scalingSet:
+            for extent, driver in otherArgs.outList:
                 # deal with scaling. There must be a better way to do this.
                 copyScaling(input, driver)
 
-            # TODO: should we always be able to rely on X_IDX, Y_IDX for
-            # whatever index we are building?
-            # No - as the values of these columns may have to change if the
-            # properties of the spatial indexing method change   
-            if otherArgs.indexType == INDEX_CARTESIAN:
-                xIdxFieldName = 'X'
-                yIdxFieldName = 'Y'
-                xIdx, yIdx = indexPulses(pulses, points, otherArgs.pulseIndexMethod)
-            elif otherArgs.indexType == INDEX_SPHERICAL:
-                xIdxFieldName = 'AZIMUTH'
-                yIdxFieldName = 'ZENITH'
-                xIdx, yIdx = pulses[xIdxFieldName], pulses[yIdxFieldName]
-            elif otherArgs.indexType == INDEX_SCAN:
-                xIdxFieldName = 'SCANLINE_IDX'
-                yIdxFieldName = 'SCANLINE'
-                xIdx, yIdx = pulses[xIdxFieldName], pulses[yIdxFieldName]              
-            else:
-                msg = 'unsupported indexing method'
-                raise generic.LiDARSpatialIndexNotAvailable(msg)
-
-            # ensure the scaling of X_IDX & Y_IDX matches the data we are putting in it
-            if driver.getDriverName() == 'SPDV4':
-                # only makes sense for SPDV4 since LAS doesn't really have an X_IDX etc
-                setScalingForCoordField(driver, xIdxFieldName, 'X_IDX')
-                setScalingForCoordField(driver, yIdxFieldName, 'Y_IDX')
-        
-            # this the expression used in the spatial index building
-            # so we are consistent. 
-            mask = ((xIdx >= extent.xMin) & (xIdx < extent.xMax) & 
-                    (yIdx > extent.yMin) & (yIdx <= extent.yMax))
+                # ensure the scaling of X_IDX & Y_IDX matches the data we are putting in it
+                if driver.getDriverName() == 'SPDV4':
+                    # only makes sense for SPDV4 since LAS doesn't really have an X_IDX etc
+                    setScalingForCoordField(driver, xIdxFieldName, 'X_IDX')
+                    setScalingForCoordField(driver, yIdxFieldName, 'Y_IDX')
+
+        # group the pulses by tile, keeping them in the same order 
+        # within each tile, and only write to tiles that get some
+        tile = getTileForPulses(xIdx, yIdx, otherArgs.tileLayout)
+        inTile = numpy.nonzero(tile >= 0)[0]
+        tileOrder, tileCounts = gridindexutils.sortByBin(tile[inTile], 
+                                    len(otherArgs.outList))
+        tileStarts = numpy.cumsum(tileCounts) - tileCounts
+
+        for n in numpy.nonzero(tileCounts)[0]:
+            extent, driver = otherArgs.outList[n]
+            start = tileStarts[n]
+            sel = inTile[tileOrder[start:start + tileCounts[n]]]
 
             # subset the data
-            pulsesSub = pulses[mask]
+            pulsesSub = pulses[sel]
             # this is required otherwise the pulses get stripped out
             # when we write the pulses in spatial mode (in indexAndMerge)
-            pulsesSub['X_IDX'] = xIdx[mask]
-            pulsesSub['Y_IDX'] = yIdx[mask]
+            pulsesSub['X_IDX'] = xIdx[sel]
+            pulsesSub['Y_IDX'] = yIdx[sel]
         
             # subset the other data also to match
-            pointsSub = points[..., mask]
+            pointsSub = points[..., sel]
         
             waveformInfoSub = None
             recvSub = None
             transSub = None
             if waveformInfo is not None and waveformInfo.size > 0:
-                waveformInfoSub = waveformInfo[...,mask]
+                waveformInfoSub = waveformInfo[...,sel]
             if recv is not None and recv.size > 0:
-                recvSub = recv[:,:,mask]
+                recvSub = recv[:,:,sel]
             if trans is not None and trans.size > 0:
-                transSub = trans[:,:,mask]
+                transSub = trans[:,:,sel]
            
             driver.writeData(pulsesSub, pointsSub, transSub, recvSub, 
                         waveformInfoSub)
 
+    if gotPulses:
+        otherArgs.scalingSet = True
+
 def indexPulses(pulses, points, pulseIndexMethod):
     """
     Internal method to assign a point coordinates to the X_IDX and Y_IDX
@@ -465,14 +542,27 @@ def indexPulses(pulses, points, pulseIndexMethod):
 
     return xIdx, yIdx
 
-def indexAndMerge(extentList, extent, wkt, outfile, header):
+def indexAndMerge(extentList, extent, wkt, outfile, header, 
+        blockOrder=BLOCKORDER_ROWMAJOR, indexPoints=False):
     """
     Internal method to merge all the temporary files into the output
-    spatially indexing as we go.
+    spatially indexing as we go. The files are merged in the order
+    given by blockOrder. If indexPoints is True the points are indexed too.
     """
     controls = lidarprocessor.Controls()
     controls.setSpatialProcessing(False)
 
+    # work out the column and row of each tile
+    # round() ok since they should be on the grid
+    cols = [int(numpy.round((subExtent.xMin - extent.xMin) / 
+                (subExtent.xMax - subExtent.xMin))) 
+                for fname, subExtent in extentList]
+    rows = [int(numpy.round((extent.yMax - subExtent.yMax) / 
+                (subExtent.yMax - subExtent.yMin))) 
+                for fname, subExtent in extentList]
+    order = gridindexutils.getBlockOrder(cols, rows, blockOrder)
+    extentList = [extentList[idx] for idx in order]
+
     # open in read mode
     driverExtentList = []
     for fname, subExtent in extentList:
@@ -486,6 +576,8 @@ def indexAndMerge(extentList, extent, wkt, outfile, header):
     # create output file    
     userClass = lidarprocessor.LidarFile(outfile, generic.CREATE)
     userClass.setLiDARDriverOption('SCALING_BUT_NO_DATA_WARNING', False)
+    if indexPoints:
+        userClass.setLiDARDriverOption('POINT_SPATIAL_INDEX', True)
     controls = lidarprocessor.Controls()
     controls.setSpatialProcessing(True)
     outDriver = spdv4.SPDV4File(outfile, generic.CREATE, controls, userClass)
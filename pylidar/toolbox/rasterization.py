@@ -23,6 +23,7 @@ from __future__ import print_function, division
 import numpy
 import importlib
 from pylidar import lidarprocessor
+from pylidar.toolbox import binreduce
 from rios import cuiprogress
 
 DEFAULT_FUNCTION = "numpy.ma.min"
@@ -34,40 +35,63 @@ PULSE = 1
 class RasterizationError(Exception):
     "Exception type for rasterization errors"
 
-def writeImageFunc(data, otherArgs):
+def readDataByBins(data, otherArgs, ragged):
     """
-    Called from pylidar.lidarprocessor. Calls the nominated
-    function on the data.
+    Returns a list of the data for each input file for the current 
+    block, either as masked arrays or as RaggedArrays.
     """
-    # get data for each file
     if otherArgs.atype == POINT:
-        dataList = [input.getPointsByBins(colNames=otherArgs.attributes)
-                    for input in data.inList]
+        dataList = [input.getPointsByBins(colNames=otherArgs.attributes,
+                    ragged=ragged) for input in data.inList]
     else:
-        dataList = [input.getPulsesByBins(colNames=otherArgs.attributes)
-                    for input in data.inList]
+        dataList = [input.getPulsesByBins(colNames=otherArgs.attributes,
+                    ragged=ragged) for input in data.inList]
+    return dataList
 
-    # stack it so we can analyse the whole thing
-    dataStack = numpy.ma.vstack(dataList)
+def writeImageFunc(data, otherArgs):
+    """
+    Called from pylidar.lidarprocessor. Calculates each of the layers
+    in otherArgs.layers from the data. Layers done by 
+    pylidar.toolbox.binreduce are calculated from ragged arrays, 
+    the others by calling the nominated function on a masked array. 
+    The data is only read from the files once. If both forms are
+    needed the data is read as ragged arrays and the masked array
+    made from them with RaggedArray.toMasked().
+    """
+    ragged = None
+    dataStack = None
+    if otherArgs.needRagged:
+        ragged = binreduce.mergeRagged(readDataByBins(data, otherArgs, True))
+        shape = ragged.shape
+        if otherArgs.needMasked:
+            # same elements in the same order as numpy.ma.vstack gives
+            dataStack = ragged.toMasked()
+    elif otherArgs.needMasked:
+        # stack it so we can analyse the whole thing
+        dataStack = numpy.ma.vstack(readDataByBins(data, otherArgs, False))
+        shape = dataStack.shape[1:]
 
     # create output
-    nLayers = len(otherArgs.attributes)
-    (maxPts, nRows, nCols) = dataStack.shape
-    outStack = numpy.empty((nLayers, nRows, nCols), dtype=numpy.float64)
-    if maxPts > 0:
-        # a layer per attribute
-        nIdx = 0
-        for attribute in otherArgs.attributes:
+    nLayers = len(otherArgs.layers)
+    outStack = numpy.empty((nLayers,) + shape, dtype=numpy.float64)
+    for nIdx, (attribute, reducer, func) in enumerate(otherArgs.layers):
+        if reducer is not None:
+            outStack[nIdx] = binreduce.reduceBins(ragged[attribute], 
+                    reducer[0], reducer[1], otherArgs.background)
+        elif dataStack.shape[0] > 0:
             attributeData = dataStack[attribute]
-            attributeDataFunc = otherArgs.func(attributeData, axis=0)
+            attributeDataFunc = func(attributeData, axis=0)
             outStack[nIdx] = attributeDataFunc
             # Need to manually put in the 'background' value. Masked arrays are dangerous. 
             outStack[nIdx][attributeDataFunc.mask] = otherArgs.background
-            nIdx += 1
-    else:
-        outStack.fill(otherArgs.background)
+        else:
+            outStack[nIdx].fill(otherArgs.background)
 
-    data.imageOut.setData(outStack)
+    if otherArgs.filePerLayer:
+        for nIdx, imageOut in enumerate(data.imageOutList):
+            imageOut.setData(outStack[nIdx:nIdx+1])
+    else:
+        data.imageOut.setData(outStack)
 
 def rasterize(infiles, outfile, attributes, function=DEFAULT_FUNCTION, 
         atype=DEFAULT_ATTRIBUTE, background=0, binSize=None, extraModule=None, 
@@ -77,8 +101,15 @@ def rasterize(infiles, outfile, attributes, function=DEFAULT_FUNCTION,
     an output raster file. attributes is a list of attributes to run
     the function on. The function name must contain a module
     name and the specified function must take a masked array, plus
-    the 'axis' parameter. atype should be a string containing 
-    either POINT|PULSE.
+    the 'axis' parameter. Functions that pylidar.toolbox.binreduce 
+    can do the same thing as (numpy.ma.min, numpy.ma.mean etc) are done
+    by it, and its own names (eg 'first', 'percentile95') may also be used.
+    Elements of attributes may also be (attribute, function) tuples
+    to use a different function for that layer. Every layer is 
+    calculated from the same read of the data.
+    outfile is either the name of a file with a band per layer, or a 
+    list of file names, one per layer.
+    atype should be a string containing either POINT|PULSE.
     background is the background raster value to use. binSize is the bin size
     to use which defaults to that of the spatial indices used.
     extraModule should be a string with an extra module to import - use
@@ -86,17 +117,36 @@ def rasterize(infiles, outfile, attributes, function=DEFAULT_FUNCTION,
     quiet means no progress etc
     footprint specifies the footprint type
     """
+    # work out the attribute and function for each layer
+    layerList = []
+    for attribute in attributes:
+        if isinstance(attribute, str):
+            layerList.append((attribute, function))
+        else:
+            layerList.append(tuple(attribute))
+
     dataFiles = lidarprocessor.DataFiles()
     dataFiles.inList = [lidarprocessor.LidarFile(fname, lidarprocessor.READ) 
                         for fname in infiles]
-    dataFiles.imageOut = lidarprocessor.ImageFile(outfile, lidarprocessor.CREATE)
-    dataFiles.imageOut.setRasterIgnore(background)
-
-    if driverName is not None:
-        dataFiles.imageOut.setRasterDriver(driverName)
+    if isinstance(outfile, str):
+        imageList = [lidarprocessor.ImageFile(outfile, lidarprocessor.CREATE)]
+        dataFiles.imageOut = imageList[0]
+    else:
+        if len(outfile) != len(layerList):
+            msg = 'Need one output file per layer'
+            raise RasterizationError(msg)
+        imageList = [lidarprocessor.ImageFile(fname, lidarprocessor.CREATE)
+                        for fname in outfile]
+        dataFiles.imageOutList = imageList
+
+    for imageOut in imageList:
+        imageOut.setRasterIgnore(background)
+
+        if driverName is not None:
+            imageOut.setRasterDriver(driverName)
         
-    if driverOptions is not None:
-        dataFiles.imageOut.setRasterDriverOptions(driverOptions)
+        if driverOptions is not None:
+            imageOut.setRasterDriverOptions(driverOptions)
 
     # import any other modules required
     globalsDict = globals()
@@ -119,9 +169,24 @@ def rasterize(infiles, outfile, attributes, function=DEFAULT_FUNCTION,
         controls.setWindowSize(windowSize)
 
     otherArgs = lidarprocessor.OtherArgs()
-    # reference to the function to call
-    otherArgs.func = eval(function, globalsDict)
-    otherArgs.attributes = attributes
+    # for each layer use the quicker binreduce version if there is one, 
+    # otherwise a reference to the function to call
+    otherArgs.layers = []
+    otherArgs.attributes = []
+    for attribute, layerFunction in layerList:
+        reducer = binreduce.getReducer(layerFunction)
+        func = None
+        if reducer is None:
+            func = eval(layerFunction, globalsDict)
+        otherArgs.layers.append((attribute, reducer, func))
+        # only read each attribute once
+        if attribute not in otherArgs.attributes:
+            otherArgs.attributes.append(attribute)
+    otherArgs.needRagged = any([reducer is not None 
+                    for (attribute, reducer, func) in otherArgs.layers])
+    otherArgs.needMasked = any([reducer is None
+                    for (attribute, reducer, func) in otherArgs.layers])
+    otherArgs.filePerLayer = not isinstance(outfile, str)
     otherArgs.background = background
     atype = atype.upper()
     if atype == 'POINT':
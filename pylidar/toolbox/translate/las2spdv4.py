@@ -189,6 +189,10 @@ def translate(info, infile, outfile, expectRange=None, spatial=None, extent=None
     dataFiles.output1 = lidarprocessor.LidarFile(outfile, lidarprocessor.CREATE)
     dataFiles.output1.setLiDARDriver('SPDV4')
     dataFiles.output1.setLiDARDriverOption('SCALING_BUT_NO_DATA_WARNING', False)
+    if extent is None and info.header['NUMBER_OF_POINT_RECORDS'] > 0:
+        # so the columns don't have to keep being grown
+        dataFiles.output1.setLiDARDriverOption('EXPECTED_NUMBER_OF_POINTS', 
+                    info.header['NUMBER_OF_POINT_RECORDS'])
 
     lidarprocessor.doProcessing(transFunc, dataFiles, controls=controls, 
                     otherArgs=otherArgs)
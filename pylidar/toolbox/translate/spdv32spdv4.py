@@ -100,6 +100,12 @@ def translate(info, infile, outfile, expectRange=None, spatial=False,
     dataFiles.output1 = lidarprocessor.LidarFile(outfile, lidarprocessor.CREATE)
     dataFiles.output1.setLiDARDriver('SPDV4')
     dataFiles.output1.setLiDARDriverOption('SCALING_BUT_NO_DATA_WARNING', False)
+    if extent is None:
+        # so the columns don't have to keep being grown
+        dataFiles.output1.setLiDARDriverOption('EXPECTED_NUMBER_OF_PULSES', 
+                    info.header['NUMBER_OF_PULSES'])
+        dataFiles.output1.setLiDARDriverOption('EXPECTED_NUMBER_OF_POINTS', 
+                    info.header['NUMBER_OF_POINTS'])
 
     controls = lidarprocessor.Controls()
     progress = cuiprogress.GDALProgressBar()
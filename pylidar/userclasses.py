@@ -23,7 +23,9 @@ from __future__ import print_function, division
 import copy
 import numpy
 from numba import jit
+from . import profiling
 from .lidarformats import generic
+from .lidarformats import gridindexutils
 from .toolbox import arrayutils
 
 @jit
@@ -278,6 +280,89 @@ class LidarData(object):
         self.receivedToWrite = None
         self.transmittedToWrite = None
         self.waveformInfoToWrite = None
+        # set by the processor when reading ahead
+        self.prefetchedPulses = None
+        self.prefetchedPoints = None
+        
+    def setPrefetchedData(self, pulses, points):
+        """
+        For internal use. Used by the processor to pass in all the
+        columns of the pulses and points for the current block that
+        have already been read in the background (see Controls.setPrefetch()).
+        Pass None for both when there is nothing read ahead.
+        """
+        self.prefetchedPulses = pulses
+        self.prefetchedPoints = points
+        
+    def getPrefetchedColumns(self, array, colNames):
+        """
+        Internal method. Returns the requested columns from an array
+        set by setPrefetchedData(), or None if there is no array or it
+        doesn't have all the columns (so the driver must be asked instead).
+        """
+        if array is None:
+            return None
+        if colNames is not None:
+            if isinstance(colNames, str):
+                requested = [colNames]
+            else:
+                requested = colNames
+            for name in requested:
+                if name not in array.dtype.names:
+                    return None
+        return generic.LiDARFile.subsetColumns(array, colNames)
+
+    def getColumnsToRead(self, colNames, arrayType):
+        """
+        Internal method. If the columns have been declared with 
+        LidarFile.setColumns() and colNames is None or only has declared
+        columns, returns the declared list so every read of the block 
+        asks the driver for the same columns (which it caches). 
+        Otherwise returns colNames.
+        """
+        if arrayType == generic.ARRAY_TYPE_POINTS:
+            declared = self.driver.userClass.pointColumns
+        else:
+            declared = self.driver.userClass.pulseColumns
+
+        if declared is None or colNames is None:
+            return declared
+
+        if isinstance(colNames, str):
+            requested = [colNames]
+        else:
+            requested = colNames
+        for name in requested:
+            if name not in declared:
+                return colNames
+        return declared
+
+    @staticmethod
+    def convertRaggedForWriting(array):
+        """
+        Internal method. Converts a RaggedArray of points by pulse
+        (as returned by getPointsByPulse(ragged=True)) back to the masked 
+        form the drivers write. Points or pulses by bins can't be written 
+        in ragged form since the drivers need the index created when the 
+        masked form is read.
+        """
+        if isinstance(array, gridindexutils.RaggedArray):
+            if array.count.ndim != 1:
+                msg = ('Ragged arrays by bins cannot be written. Use the ' +
+                        'masked form returned when ragged=False')
+                raise generic.LiDARInvalidData(msg)
+            array = array.toMasked()
+        return array
+
+    @staticmethod
+    def subsetReadColumns(array, readColNames, colNames):
+        """
+        Internal method. Subsets colNames from an array read with
+        the columns returned by getColumnsToRead().
+        """
+        if colNames is not None and readColNames is not colNames:
+            array = generic.LiDARFile.subsetColumns(array, colNames)
+        return array
         
     def translateFieldNames(self, otherLidarData, array, arrayType):
         """
@@ -306,6 +391,7 @@ class LidarData(object):
         # just for consistancy
         return array
         
+    @profiling.timed(profiling.READ)
     def getPoints(self, colNames=None):
         """
         Returns the points for the extent/range of the current
@@ -315,12 +401,20 @@ class LidarData(object):
         colNames can be a name or list of column names to return. By default
         all columns are returned.
         """
-        if self.controls.spatialProcessing:
-            points = self.driver.readPointsForExtent(colNames)
-        else:
-            points = self.driver.readPointsForRange(colNames)
+        points = self.getPrefetchedColumns(self.prefetchedPoints, colNames)
+        if points is None:
+            readColNames = self.getColumnsToRead(colNames, 
+                                generic.ARRAY_TYPE_POINTS)
+            if self.controls.spatialProcessing:
+                points = self.driver.readPointsForExtent(readColNames)
+            else:
+                points = self.driver.readPointsForRange(readColNames)
+            points = self.subsetReadColumns(points, readColNames, colNames)
+
+        profiling.recordArray(self, points, 'points')
         return points
         
+    @profiling.timed(profiling.READ)
     def getPulses(self, colNames=None, pulseIndex=None):
         """
         Returns the pulses for the extent/range of the current
@@ -332,18 +426,33 @@ class LidarData(object):
         
         pulseIndex is an optional masked 3d array of indices to remap the
         1d pulse array to a 3D point by bin array. pulseIndex is returned from
-        getPointsByBins with returnPulseIndex=True.
-        """
-        if self.controls.spatialProcessing:
-            pulses = self.driver.readPulsesForExtent(colNames)
-            if pulseIndex is not None:
-                pulses = numpy.ma.array(pulses[pulseIndex], mask=pulseIndex.mask)
-        else:
-            pulses = self.driver.readPulsesForRange(colNames)              
+        getPointsByBins with returnPulseIndex=True. If pulseIndex is a
+        RaggedArray (ragged=True was also passed) a RaggedArray of pulses
+        is returned.
+        """
+        pulses = self.getPrefetchedColumns(self.prefetchedPulses, colNames)
+        if pulses is None:
+            readColNames = self.getColumnsToRead(colNames, 
+                                generic.ARRAY_TYPE_PULSES)
+            if self.controls.spatialProcessing:
+                pulses = self.driver.readPulsesForExtent(readColNames)
+            else:
+                pulses = self.driver.readPulsesForRange(readColNames)
+            pulses = self.subsetReadColumns(pulses, readColNames, colNames)
+
+        if self.controls.spatialProcessing and pulseIndex is not None:
+            if isinstance(pulseIndex, gridindexutils.RaggedArray):
+                pulses = gridindexutils.RaggedArray(pulses[pulseIndex.data],
+                                pulseIndex.start, pulseIndex.count)
+            else:
+                pulses = numpy.ma.array(pulses[pulseIndex], 
+                                mask=pulseIndex.mask)
         
+        profiling.recordArray(self, pulses, 'pulses')
         return pulses
         
-    def getPulsesByBins(self, extent=None, colNames=None):
+    @profiling.timed(profiling.READ)
+    def getPulsesByBins(self, extent=None, colNames=None, ragged=False):
         """
         Returns the pulses for the extent of the current block
         as a 3 dimensional structured masked array. Only valid for spatial 
@@ -361,17 +470,29 @@ class LidarData(object):
 
         colNames can be a name or list of column names to return. By default
         all columns are returned.
+        
+        Set ragged to True to return a gridindexutils.RaggedArray instead.
+        This holds the pulses in a 1d array, sorted so that the pulses for 
+        each bin are together, and 2d arrays of the start and count of the 
+        pulses for each bin. This uses much less memory than the masked 
+        array when some bins have many more pulses than others.
         """
         if self.controls.spatialProcessing:
-            pulses = self.driver.readPulsesForExtentByBins(extent, colNames)
+            readColNames = self.getColumnsToRead(colNames, 
+                                generic.ARRAY_TYPE_PULSES)
+            pulses = self.driver.readPulsesForExtentByBins(extent, 
+                                readColNames, ragged)
+            pulses = self.subsetReadColumns(pulses, readColNames, colNames)
         else:
             msg = 'Call only valid when doing spatial processing'
             raise generic.LiDARNonSpatialProcessing(msg)
             
+        profiling.recordArray(self, pulses)
         return pulses
         
+    @profiling.timed(profiling.READ)
     def getPointsByBins(self, extent=None, colNames=None, indexByPulse=False,
-                returnPulseIndex=False):
+                returnPulseIndex=False, ragged=False):
         """
         Returns the points for the extent of the current block
         as a 3 dimensional structured masked array. Only valid for spatial 
@@ -395,14 +516,35 @@ class LidarData(object):
         
         Set returnPulseIndex to True to also return a 3 dimensional masked array
         containing the indexes into the 1d array returned by getPulses().
+        
+        Set ragged to True to return a gridindexutils.RaggedArray instead
+        (the pulse index is also returned as one). This holds the points in
+        a 1d array, sorted so that the points for each bin are together, 
+        and 2d arrays of the start and count of the points for each bin. 
+        This uses much less memory than the masked array when some bins have
+        many more points than others.
         """
         if self.controls.spatialProcessing:
-            points = self.driver.readPointsForExtentByBins(extent, colNames, 
-                        indexByPulse, returnPulseIndex)
+            readColNames = self.getColumnsToRead(colNames, 
+                                generic.ARRAY_TYPE_POINTS)
+            points = self.driver.readPointsForExtentByBins(extent, 
+                        readColNames, indexByPulse, returnPulseIndex, ragged)
+            if isinstance(points, tuple):
+                points, pulseIndex = points
+                points = (self.subsetReadColumns(points, readColNames, 
+                            colNames), pulseIndex)
+            else:
+                points = self.subsetReadColumns(points, readColNames, 
+                            colNames)
         else:
             msg = 'Call only valid when doing spatial processing'
             raise generic.LiDARNonSpatialProcessing(msg)
 
+        if isinstance(points, tuple):
+            for array in points:
+                profiling.recordArray(self, array)
+        else:
+            profiling.recordArray(self, points)
         return points
     
     def rebinPtsByHeight(self, pointsByBin, bins, heightArray=None, heightField='Z'):
@@ -452,7 +594,8 @@ class LidarData(object):
         rebinnedPtsMasked = numpy.ma.array(rebinnedPts, mask=idxMask)
         return rebinnedPtsMasked
         
-    def getPointsByPulse(self, colNames=None):
+    @profiling.timed(profiling.READ)
+    def getPointsByPulse(self, colNames=None, ragged=False):
         """
         Returns the points as a 2d structured masked array. The first axis
         is the same length as the pulse array but the second axis contains the 
@@ -461,9 +604,19 @@ class LidarData(object):
 
         colNames can be a name or list of column names to return. By default
         all columns are returned.
+        
+        Set ragged to True to return a gridindexutils.RaggedArray instead
+        with the 1d points and 1d arrays of the start and count of the 
+        points for each pulse.
         """
-        return self.driver.readPointsByPulse(colNames)
+        readColNames = self.getColumnsToRead(colNames, 
+                            generic.ARRAY_TYPE_POINTS)
+        points = self.driver.readPointsByPulse(readColNames, ragged)
+        points = self.subsetReadColumns(points, readColNames, colNames)
+        profiling.recordArray(self, points)
+        return points
         
+    @profiling.timed(profiling.READ)
     def getWaveformInfo(self):
         """
         Returns a 2d masked structured array with information about 
@@ -472,6 +625,7 @@ class LidarData(object):
         """
         return self.driver.readWaveformInfo()
         
+    @profiling.timed(profiling.READ)
     def getTransmitted(self):
         """
         Returns a masked 3d radiance array. 
@@ -484,6 +638,7 @@ class LidarData(object):
         """
         return self.driver.readTransmitted()
         
+    @profiling.timed(profiling.READ)
     def getReceived(self):
         """
         Returns a masked 3d radiance array. 
@@ -693,6 +848,7 @@ class LidarData(object):
         3d masked array (like that read from getPointsByBins()).
 
         """
+        points = self.convertRaggedForWriting(points)
         self.pointsToWrite = self.convertToStructIfNeeded(points, colName,
                                     self.pointsToWrite)
             
@@ -709,6 +865,7 @@ class LidarData(object):
         3d masked array (like that read from getPulsesByBins()).
 
         """
+        pulses = self.convertRaggedForWriting(pulses)
         self.pulsesToWrite = self.convertToStructIfNeeded(pulses, colName,
                                     self.pulsesToWrite)
         
@@ -739,6 +896,7 @@ class ImageData(object):
         self.driver = driver
         self.data = None
         
+    @profiling.timed(profiling.READ)
     def getData(self):
         """
         Returns the data for the current extent as a 3d numpy array in the 
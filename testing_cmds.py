@@ -228,6 +228,31 @@ from pylidar.testing import testsuite24
 testsuite24.run('.', '.')
 nameList.append('testsuite24')
 
+# testsuite25
+from pylidar.testing import testsuite25
+testsuite25.run('.', '.')
+nameList.append('testsuite25')
+
+# testsuite26
+from pylidar.testing import testsuite26
+testsuite26.run('.', '.')
+nameList.append('testsuite26')
+
+# testsuite27
+from pylidar.testing import testsuite27
+testsuite27.run('.', '.')
+nameList.append('testsuite27')
+
+# testsuite28
+from pylidar.testing import testsuite28
+testsuite28.run('.', '.')
+nameList.append('testsuite28')
+
+# testsuite29
+from pylidar.testing import testsuite29
+testsuite29.run('.', '.')
+nameList.append('testsuite29')
+
 # add our list of tests
 versionInfo['tests'] = nameList
 